@@ -1,5 +1,7 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from dotenv import load_dotenv
 import os
@@ -8,14 +10,93 @@ load_dotenv()
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:7071/api")
 TOKEN = os.getenv("TOKEN", None)
+PAGE_SIZE = 10
+PREFETCH_AT = 3  # cards left in the deck when the next page starts loading
 
 logging.basicConfig(level=logging.INFO)
 
+@st.cache_resource
+def get_http() -> requests.Session:
+    # One keep-alive connection pool shared by every rerun and background task
+    http = requests.Session()
+    http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    if TOKEN:
+        http.params = {"code": TOKEN}
+    return http
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="connect-client")
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_dynamics() -> list:
+    dynamics_response = get_http().get(f"{BASE_URL}/get_dynamics", timeout=10)
+    logging.info(f"Dynamics response: {dynamics_response.status_code}")
+    dynamics_response.raise_for_status()
+    return dynamics_response.json()
+
+def fetch_page(session: dict, cursor: str = None) -> dict:
+    params = {"page_size": PAGE_SIZE}
+    if cursor:
+        params["cursor"] = cursor
+    if session.get("session_token"):
+        params["token"] = session["session_token"]
+    response = get_http().get(f"{BASE_URL}/get_cards/{session.get('session_id')}/next", params=params, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+def send_feedback(events: list, session_token: str = None):
+    body = {"events": events}
+    if session_token:
+        body["session_token"] = session_token
+    try:
+        get_http().post(f"{BASE_URL}/update_card_status_batch", json=body, timeout=10).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error sending feedback: {e}")
+
+def record_swipe(card: dict, liked: bool):
+    # Fire and forget: the next card shows without waiting for the backend
+    session = st.session_state.session_id
+    event = {"session_id": session.get('session_id'), "card_id": card.get("id"), "liked": liked}
+    get_executor().submit(send_feedback, [event], session.get("session_token"))
+
+def prefetch_next_page():
+    remaining = len(st.session_state.cards) - st.session_state.current_index - 1
+    if (remaining <= PREFETCH_AT and st.session_state.has_more
+            and st.session_state.next_page is None and st.session_state.session_id):
+        st.session_state.next_page = get_executor().submit(fetch_page, st.session_state.session_id,
+                                                           st.session_state.cursor)
+
+def append_next_page(wait: bool = False):
+    future = st.session_state.next_page
+    if future is None or (not future.done() and not wait):
+        return
+    st.session_state.next_page = None
+    try:
+        page = future.result()
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Error en la solicitud: {e}")
+        return
+    st.session_state.cards.extend(page["cards"])
+    st.session_state.cursor = page["next_cursor"]
+    st.session_state.has_more = page["has_more"]
+
+def advance():
+    append_next_page(wait=st.session_state.current_index >= len(st.session_state.cards) - 1)
+    if st.session_state.current_index < len(st.session_state.cards) - 1:
+        st.session_state.current_index += 1
+        st.rerun()
+    else:
+        st.info("🎉 No hay más cartas")
+
 st.title("🎴Connect")
 
-dynamics_response = requests.get(f"{BASE_URL}/get_dynamics" + f'?code={TOKEN}' if TOKEN else '')
-dynamics = dynamics_response.json() if dynamics_response.status_code == 200 else [{"name": "questions"}]
-logging.info(f"Dynamics response: {dynamics_response.status_code}, {dynamics_response.text}")
+try:
+    dynamics = load_dynamics()
+except requests.exceptions.RequestException as e:
+    logging.error(f"Error loading dynamics: {e}")
+    dynamics = [{"name": "questions"}]
 
 # Sidebar with questions (hidable by default in Streamlit)
 with st.sidebar:
@@ -41,19 +122,20 @@ with st.sidebar:
 
         try:
             # Create session
-            session_url = f"{BASE_URL}/create_session" + f'?code={TOKEN}' if TOKEN else ''
-            response = requests.post(
-                session_url,
-                json={"selections": selections}
+            response = get_http().post(
+                f"{BASE_URL}/create_session",
+                json={"selections": selections},
+                timeout=30
             )
             response.raise_for_status()
             st.session_state.session_id = response.json()#.get("session_id")
 
             # Get cards
-            cards_url = f"{BASE_URL}/get_cards/{st.session_state.session_id.get('session_id')}" + f'?code={TOKEN}' if TOKEN else ''
-            cards_response = requests.get(cards_url)
-            cards_response.raise_for_status()
-            st.session_state.cards = cards_response.json()
+            page = fetch_page(st.session_state.session_id)
+            st.session_state.cards = page["cards"]
+            st.session_state.cursor = page["next_cursor"]
+            st.session_state.has_more = page["has_more"]
+            st.session_state.next_page = None
             st.session_state.current_index = 0
 
             st.success("✅ Sesión creada")
@@ -68,13 +150,20 @@ if "cards" not in st.session_state:
     st.session_state.cards = []
 if "current_index" not in st.session_state:
     st.session_state.current_index = 0
+if "cursor" not in st.session_state:
+    st.session_state.cursor = None
+if "has_more" not in st.session_state:
+    st.session_state.has_more = False
+if "next_page" not in st.session_state:
+    st.session_state.next_page = None
 
 # Main page: show cards one by one
 if st.session_state.cards:
+    append_next_page()
+    prefetch_next_page()
     card = st.session_state.cards[st.session_state.current_index]
     st.subheader(f"🃏 Card {st.session_state.current_index + 1}")
     st.json(card)  # display raw card JSON (can be replaced with pretty formatting)
-    status_url = f"{BASE_URL}/update_card_status" + f'?code={TOKEN}' if TOKEN else ''
     col1, col2, col3 = st.columns(3)
     with col1:
         if st.button("⬅ Anterior", key=f"prev_{st.session_state.current_index}"):
@@ -84,45 +173,15 @@ if st.session_state.cards:
                 st.info("🎉 No hay más cartas")
     with col2:
         if st.button("👍 Me gusta", key=f"like_{st.session_state.current_index}"):
-            try:
-                requests.post(
-                    status_url,
-                    json={
-                        "session_id": st.session_state.session_id.get('session_id'),
-                        "card_id": card.get("id"),
-                        "liked": True
-                    }
-                )
-                st.success("❤️ Carta marcada como favorita")
-            except requests.exceptions.RequestException as e:
-                st.error(f"❌ Error al enviar like: {e}")
-            
-            if st.session_state.current_index < len(st.session_state.cards) - 1:
-                st.session_state.current_index += 1
-                st.rerun()
-            else:
-                st.info("🎉 No hay más cartas")
+            record_swipe(card, liked=True)
+            st.success("❤️ Carta marcada como favorita")
+            advance()
 
     with col3:
         if st.button("➡️ Siguiente", key=f"next_{st.session_state.current_index}"):
-            try:
-                requests.post(
-                    status_url,
-                    json={
-                        "session_id": st.session_state.session_id.get('session_id'),
-                        "card_id": card.get("id"),
-                        "liked": False
-                    }
-                )
-                st.info("Carta marcada como vista")
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error al marcar carta como vista: {e}")
-
-            if st.session_state.current_index < len(st.session_state.cards) - 1:
-                st.session_state.current_index += 1
-                st.rerun()
-            else:
-                st.info("🎉 No hay más cartas")
+            record_swipe(card, liked=False)
+            st.info("Carta marcada como vista")
+            advance()
             
         
 # Show session ID at the bottom
@@ -0,0 +1,53 @@
+"""
+Compare the old row-by-row INSERT loop with db.bulk_insert for cards.
+
+Runs against the database configured in .env; every row it writes uses a
+throwaway combination_hash and is deleted at the end.
+
+    python benchmarks/bench_bulk_insert.py [10 1000 100000]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from utils import load_env
+load_env()
+import db_operations as db
+
+COLUMNS = ("card_data", "combination_hash", "combination_name")
+BENCH_HASH = "bench-bulk-insert"
+
+def insert_row_by_row(cur, rows: list) -> list:
+    ids = []
+    for row in rows:
+        cur.execute("INSERT INTO cards (card_data, combination_hash, combination_name) VALUES (%s, %s, %s) RETURNING id;", row)
+        ids.append(cur.fetchone()[0])
+    return ids
+
+def run(size: int) -> dict:
+    rows = [(f"Tarjeta de prueba {i}\tcon tabulador", BENCH_HASH, "bench") for i in range(size)]
+    timings = {}
+    for name, insert in (("row_by_row", insert_row_by_row),
+                         ("bulk", lambda cur, rows: db.bulk_insert(cur, "cards", COLUMNS, rows))):
+        with db.get_connection() as conn:
+            cur = conn.cursor()
+            start = time.perf_counter()
+            ids = insert(cur, rows)
+            conn.commit()
+            timings[name] = time.perf_counter() - start
+
+            cur.execute("SELECT id, card_data FROM cards WHERE id = ANY(%s)", (ids,))
+            stored = dict(cur.fetchall())
+            assert [stored[i] for i in ids] == [row[0] for row in rows], f"{name} returned ids out of order"
+
+            cur.execute("DELETE FROM cards WHERE combination_hash = %s", (BENCH_HASH,))
+            conn.commit()
+    return timings
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 1_000, 100_000]
+    print(f"{'rows':>8} {'row_by_row (s)':>15} {'bulk (s)':>10} {'speedup':>8}")
+    for size in sizes:
+        t = run(size)
+        print(f"{size:>8} {t['row_by_row']:>15.3f} {t['bulk']:>10.3f} {t['row_by_row'] / t['bulk']:>7.1f}x")
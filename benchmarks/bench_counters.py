@@ -0,0 +1,94 @@
+"""
+Concurrency benchmark for swipe counters on a single hot card: in-place
+UPDATE of cards (CARD_COUNTER_MODE=direct) vs appending to card_events.
+
+Each worker thread records one swipe per statement, as update_card_status did
+before buffering. A monitor samples pg_stat_activity to count backends
+waiting on row locks. Uses the database from .env and cleans up after itself.
+
+    python benchmarks/bench_counters.py [threads] [swipes_per_thread]
+"""
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from utils import load_env
+load_env()
+import db_operations as db
+
+BENCH_HASH = "bench-counters"
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+def run(mode: str, card_id: int, threads: int, swipes: int) -> dict:
+    db.CARD_COUNTER_MODE = mode
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+    lock_waiters = []
+
+    def worker():
+        local = []
+        for i in range(swipes):
+            start = time.perf_counter()
+            db.apply_feedback_batch([(card_id, 1, i % 2)], [])
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    def monitor():
+        with db.get_connection() as conn:
+            cur = conn.cursor()
+            while not done.is_set():
+                cur.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+                lock_waiters.append(cur.fetchone()[0])
+                conn.rollback()
+                time.sleep(0.01)
+
+    watcher = threading.Thread(target=monitor)
+    watcher.start()
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    watcher.join()
+
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "avg_lock_waiters": sum(lock_waiters) / max(len(lock_waiters), 1),
+    }
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    swipes = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    db.get_pool().close()
+    db._pool = db.ConnectionPool(max_size=threads + 2)
+
+    card_id = db.create_cards(["Tarjeta muy popular"], BENCH_HASH, "bench")[0]
+    try:
+        print(f"{threads} threads x {swipes} swipes on one card")
+        print(f"{'mode':<8} {'swipes/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'lock waiters':>13}")
+        for mode in ("direct", "events"):
+            r = run(mode, card_id, threads, swipes)
+            print(f"{mode:<8} {r['throughput']:>9.0f} {r['p50']:>9.2f} {r['p99']:>9.2f} {r['avg_lock_waiters']:>13.2f}")
+
+        start = time.perf_counter()
+        folded = db.compact_card_events()
+        print(f"\ncompacted {folded} events in {(time.perf_counter() - start) * 1000:.1f} ms")
+        print(f"live count: {db.query_to_list('SELECT times_shown FROM live_cards(%s)', (BENCH_HASH,), one=True)}")
+    finally:
+        with db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM card_events WHERE combination_hash = %s", (BENCH_HASH,))
+            cur.execute("DELETE FROM cards WHERE combination_hash = %s", (BENCH_HASH,))
+            conn.commit()
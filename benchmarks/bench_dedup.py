@@ -0,0 +1,47 @@
+"""
+Near-duplicate index: query latency against a combination holding N cards,
+and how paraphrases, exact repeats and unrelated cards are classified.
+
+    python benchmarks/bench_dedup.py [cards]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import dedup
+from fake_llm_server import fake_cards
+
+PAIRS = [
+    ("¿Cuál es tu comida favorita?", "¿Cuál es la comida que más te gusta?"),
+    ("¿Cuál es tu recuerdo más bonito de la infancia?", "¿Cuál es el recuerdo más bonito de tu infancia?"),
+    ("Cuenta un secreto que nadie en esta mesa conozca.", "Cuenta un secreto que nadie de la mesa conoce."),
+    ("¿Qué canción te recuerda a tu primer amor?", "¿Qué canción te recuerda a tu primer amor?"),
+    ("¿A qué ciudad te mudarías mañana?", "Imita a tu personaje de película favorito."),
+    ("¿Cuál fue tu primer trabajo?", "¿Qué deporte practicabas de niño?"),
+]
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = random.Random(7)
+    texts = [card["description"] for card in fake_cards(count, rng)]
+
+    index = dedup.MinHashIndex()
+    start = time.perf_counter()
+    for card_id, text in enumerate(texts, start=1):
+        index.add(card_id, text)
+    print(f"indexed {count} cards in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    queries = [card["description"] for card in fake_cards(1000, rng)]
+    start = time.perf_counter()
+    matches = sum(1 for text in queries if index.query(text))
+    per_query_ms = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"query: {per_query_ms:.3f} ms avg, {matches}/{len(queries)} random cards matched a stored one")
+
+    print(f"\n{'jaccard':>8}  {'duplicate':<10} pair")
+    for a, b in PAIRS:
+        pair_index = dedup.MinHashIndex()
+        pair_index.add(1, a)
+        similarity = dedup.jaccard(dedup.shingles(a), dedup.shingles(b))
+        print(f"{similarity:>8.2f}  {str(bool(pair_index.query(b))):<10} {a} | {b}")
@@ -0,0 +1,44 @@
+"""
+Time the bucketed draw (sampling.choose_bucket_ranks, as run by
+draw_session_cards) against scoring every card, at growing deck sizes. Pure
+Python, no database. The distribution checks live in tests/test_sampling.py.
+
+    python benchmarks/bench_sampling.py
+"""
+import os
+import sys
+import math
+import time
+import heapq
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from sampling import choose_bucket_ranks, bucket_weight
+
+POLICY = 5
+SAMPLE_SIZE = 10
+EXPLORATION = 0.5
+
+def brute_force(counts: dict, sample_size: int, policy: int, rng=random) -> list:
+    # -LN(1 - RANDOM()) / weight for every card, ORDER BY score ASC LIMIT sample_size
+    scored = ((-math.log(1.0 - rng.random()) / bucket_weight(bucket[0], bucket[1], policy, EXPLORATION),
+               bucket, rank)
+              for bucket, count in counts.items() if policy - bucket[0] > 0
+              for rank in range(count))
+    return [(bucket, rank) for _, bucket, rank in heapq.nsmallest(sample_size, scored)]
+
+def time_selection(n_cards: int, repeats: int = 3) -> tuple:
+    counts = {(times_shown, tier): n_cards // (POLICY * 4) for times_shown in range(POLICY) for tier in range(4)}
+    timings = []
+    for sampler in (brute_force, lambda c, k, p: choose_bucket_ranks(c, k, p, exploration=EXPLORATION)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            sampler(counts, SAMPLE_SIZE, POLICY)
+        timings.append((time.perf_counter() - start) / repeats)
+    return tuple(timings)
+
+if __name__ == "__main__":
+    print(f"{'cards':>9} {'full scan (ms)':>15} {'bucketed (ms)':>14}")
+    for n_cards in (1_000, 100_000, 1_000_000):
+        full, bucketed = time_selection(n_cards, repeats=3 if n_cards < 1_000_000 else 1)
+        print(f"{n_cards:>9} {full * 1000:>15.2f} {bucketed * 1000:>14.3f}")
@@ -0,0 +1,102 @@
+"""
+Seed a synthetic dataset and record EXPLAIN ANALYZE timings for the hot
+queries before and after the index migrations.
+
+Everything happens in a scratch schema that is dropped at the end, so it is
+safe to point at a shared database from .env.
+
+    python benchmarks/bench_schema_indexes.py [cards] [combinations]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from utils import load_env
+load_env()
+import db_operations as db
+import migrate
+
+SCHEMA = "bench_schema_indexes"
+POLICY = 5
+
+HOT_QUERIES = {
+    "count_fresh_cards":
+        "SELECT COUNT(*) FROM cards WHERE combination_hash = %(hash)s AND times_shown < %(policy)s",
+    "get_cards_by_hash":
+        "SELECT * FROM cards WHERE combination_hash = %(hash)s AND times_shown < 5",
+    "sample_cards_by_hash": """
+        WITH weighted AS (
+            SELECT c.id, c.card_data, c.times_shown, c.like_count,
+                   GREATEST(0, %(policy)s - c.times_shown) AS weight
+            FROM cards c
+            WHERE c.combination_hash = %(hash)s AND c.times_shown < %(policy)s
+        )
+        SELECT id, card_data, times_shown, like_count
+        FROM weighted
+        ORDER BY -LN(RANDOM()) / weight DESC
+        LIMIT 10""",
+    "update_session_card":
+        "UPDATE session_cards SET ended_at = NOW() WHERE session_id = %(session_id)s AND card_id = %(card_id)s",
+}
+
+def seed(cur, n_cards: int, n_combinations: int):
+    cur.execute("""
+        INSERT INTO cards (card_data, combination_name, combination_hash, times_shown, like_count)
+        SELECT 'Tarjeta sintética ' || g, 'combo-' || (g %% %(combos)s), md5('combo-' || (g %% %(combos)s)),
+               (random() * 7)::int, (random() * 3)::int
+        FROM generate_series(1, %(cards)s) g""", {"cards": n_cards, "combos": n_combinations})
+    cur.execute("""
+        INSERT INTO sessions (selection, selection_name, selection_hash)
+        SELECT '{}', 'combo-' || (g %% %(combos)s), md5('combo-' || (g %% %(combos)s))
+        FROM generate_series(1, %(sessions)s) g""", {"sessions": n_cards // 10, "combos": n_combinations})
+    cur.execute("""
+        INSERT INTO session_cards (session_id, card_id)
+        SELECT s.id, c.id FROM sessions s JOIN cards c ON c.id %% (%(cards)s / 10) = s.id %% (%(cards)s / 10)
+        LIMIT %(cards)s""", {"cards": n_cards})
+    cur.execute("ANALYZE")
+
+def explain_all(cur) -> dict:
+    cur.execute("SELECT combination_hash FROM cards LIMIT 1")
+    params = {"hash": cur.fetchone()[0], "policy": POLICY}
+    cur.execute("SELECT session_id, card_id FROM session_cards LIMIT 1")
+    params["session_id"], params["card_id"] = cur.fetchone()
+
+    timings = {}
+    for name, query in HOT_QUERIES.items():
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0][0]
+        timings[name] = (plan["Execution Time"], plan["Plan"]["Node Type"])
+    return timings
+
+def run(n_cards: int, n_combinations: int):
+    migrations = dict(migrate.list_migrations())
+    with db.get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA}")
+            with open(migrations["0001"]) as f:
+                cur.execute(f.read())
+            cur.execute("DROP INDEX idx_cards_hash_times_shown")
+            seed(cur, n_cards, n_combinations)
+            before = explain_all(cur)
+
+            for version in sorted(migrations):
+                with open(migrations[version]) as f:
+                    cur.execute(f.read())
+            cur.execute("ANALYZE")
+            after = explain_all(cur)
+        finally:
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; SET search_path TO DEFAULT")
+            conn.commit()
+
+    print(f"{n_cards} cards over {n_combinations} combinations")
+    print(f"{'query':<22} {'before (ms)':>12} {'after (ms)':>11}  plan before -> after")
+    for name in HOT_QUERIES:
+        (t0, plan0), (t1, plan1) = before[name], after[name]
+        print(f"{name:<22} {t0:>12.2f} {t1:>11.2f}  {plan0} -> {plan1}")
+
+if __name__ == "__main__":
+    n_cards = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_combinations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    run(n_cards, n_combinations)
@@ -0,0 +1,46 @@
+"""
+Measure what signed session tokens save per request: a sessions lookup
+round trip vs verifying the token locally, and a synchronous session insert
+vs taking a reserved id and queueing the insert.
+
+    SESSION_TOKEN_SECRET=... python benchmarks/bench_session_tokens.py [requests]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault('SESSION_TOKEN_SECRET', 'bench-secret')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from utils import load_env
+load_env()
+import db_operations as db
+import session_tokens
+from utils import generate_hash_str
+
+SELECTION = {"social_context": "friends", "purpose": "fun", "tone": "2", "dynamic": "questions",
+             "hot": False, "drink": True}
+SELECTION_NAME = "friends-fun-2-questions-drink"
+
+def timed(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    selection_hash = generate_hash_str(SELECTION_NAME)
+
+    session_id = db.start_session(SELECTION, SELECTION_NAME, selection_hash)
+    token = session_tokens.issue_token(session_id, SELECTION, SELECTION_NAME)
+    db.get_session(session_id)  # warm the pool
+
+    lookup = timed(lambda: db.get_session(session_id), n)
+    verify = timed(lambda: session_tokens.verify_token(token), n)
+    insert = timed(lambda: db.start_session(SELECTION, SELECTION_NAME, selection_hash), n)
+    queued = timed(lambda: session_tokens.start_session(SELECTION, SELECTION_NAME, selection_hash), n)
+    session_tokens.session_writer.flush()
+
+    print(f"{n} requests, token is {len(token)} bytes")
+    print(f"session read:   lookup {lookup:8.3f} ms   token verify {verify:8.3f} ms   saved {lookup - verify:8.3f} ms")
+    print(f"session create: insert {insert:8.3f} ms   reserved id  {queued:8.3f} ms   saved {insert - queued:8.3f} ms")
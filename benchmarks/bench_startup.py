@@ -0,0 +1,102 @@
+"""
+Cold-start benchmark: import time of function_app and time to first response
+per endpoint, each measured in a fresh interpreter.
+
+For every endpoint a child process imports function_app (timed), prepares
+what the endpoint needs directly in the store (a session, cards), then
+times the first and second call. The report also lists which heavy
+packages the import pulled in. Uses the in-process MemoryDB and the fake
+LLM server by default; `--db postgres` uses the database from .env.
+
+    python benchmarks/bench_startup.py [--db memory|postgres] [--runs 3] [--warm-up]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ("get_dynamics", "create_session", "get_cards", "update_card_status", "metrics")
+HEAVY_MODULES = ("openai", "httpx", "pydantic", "psycopg2", "azure.functions")
+SELECTIONS = {"social_context": "friends", "purpose": "fun", "tone": "1", "dynamic": "questions",
+              "hot": False, "drink": False}
+
+def child(endpoint: str, db_mode: str, warm_up: bool):
+    if warm_up:
+        os.environ["WARMUP_ON_IMPORT"] = "true"
+    sys.path.insert(0, os.path.join(HERE, '..'))
+    start = time.perf_counter()
+    import function_app
+    import_ms = (time.perf_counter() - start) * 1000
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    import azure.functions as func
+    import db_operations as db
+    import llm_operations as llm
+    from utils import generate_hash_str
+    from load_test import _handler, _Out
+    from fake_llm_server import FakeLLM
+
+    if db_mode == "memory":
+        from memory_db import MemoryDB
+        MemoryDB(rtt_ms=1.0).install()
+    fake = FakeLLM(first_token_ms=200, tokens_per_s=400)
+    os.environ.update({"LLM_ENDPOINT": fake.start(), "LLM_KEY": "fake", "LLM_DEPLOYMENT": "fake",
+                       "LLM_API_VERSION": os.getenv("LLM_API_VERSION", "2024-06-01")})
+    llm._client = None
+
+    selection_name = "friends-fun-1-questions"
+    selection_hash = generate_hash_str(selection_name)
+    body, params, route_params, bindings = None, {}, {}, {}
+    if endpoint == "create_session":
+        body = {"selections": dict(SELECTIONS)}
+    elif endpoint in ("get_cards", "update_card_status"):
+        session_id = db.start_session(SELECTIONS, selection_name, selection_hash)
+        card_ids = db.create_cards([f"Carta {i}" for i in range(20)], selection_hash, selection_name)
+        route_params = {"session_id": str(session_id)}
+        bindings = {"refill": _Out()} if endpoint == "get_cards" else {}
+        body = {"session_id": session_id, "card_id": card_ids[0], "liked": True} \
+            if endpoint == "update_card_status" else None
+
+    handler = _handler(getattr(function_app, endpoint))
+    timings = []
+    for _ in range(2):
+        req = func.HttpRequest(method="POST" if body is not None else "GET", url=f"/api/{endpoint}", headers={},
+                               params=params, route_params=route_params,
+                               body=json.dumps(body).encode() if body is not None else b"")
+        start = time.perf_counter()
+        response = handler(req, **bindings)
+        timings.append(((time.perf_counter() - start) * 1000, response.status_code))
+    fake.stop()
+    print(json.dumps({"import_ms": import_ms, "loaded": loaded,
+                      "first_ms": timings[0][0], "second_ms": timings[1][0], "status": timings[0][1]}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per endpoint; medians are reported")
+    parser.add_argument("--warm-up", action="store_true", help="set WARMUP_ON_IMPORT in the child")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.db, args.warm_up)
+        return
+
+    print(f"{'endpoint':<20}{'import ms':>11}{'first ms':>10}{'second ms':>11}{'status':>8}  heavy modules at import")
+    for endpoint in ENDPOINTS:
+        runs = []
+        for _ in range(args.runs):
+            command = [sys.executable, os.path.abspath(__file__), "--child", endpoint, "--db", args.db]
+            if args.warm_up:
+                command.append("--warm-up")
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        median = lambda key: sorted(run[key] for run in runs)[len(runs) // 2]
+        print(f"{endpoint:<20}{median('import_ms'):>11.1f}{median('first_ms'):>10.1f}{median('second_ms'):>11.1f}"
+              f"{runs[0]['status']:>8}  {', '.join(runs[0]['loaded'])}")
+
+if __name__ == "__main__":
+    main()
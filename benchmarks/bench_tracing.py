@@ -0,0 +1,37 @@
+"""
+Per-call overhead of tracing.traced and tracing.span, disabled vs enabled.
+
+    python benchmarks/bench_tracing.py [calls]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import tracing
+
+def plain():
+    return 1
+
+traced = tracing.traced("bench.traced")(plain)
+
+def with_span():
+    with tracing.span("bench.span", label="x"):
+        return 1
+
+def per_call_ns(fn, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e9
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    baseline = per_call_ns(plain, calls)
+    print(f"plain call: {baseline:.0f} ns")
+    for state in (False, True):
+        tracing.set_enabled(state)
+        label = "enabled" if state else "disabled"
+        print(f"traced ({label}): {per_call_ns(traced, calls) - baseline:+.0f} ns/call, "
+              f"span ({label}): {per_call_ns(with_span, calls) - baseline:+.0f} ns/call")
+    print(f"histograms: { {k: v['count'] for k, v in tracing.get_metrics().items()} }")
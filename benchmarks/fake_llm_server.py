@@ -0,0 +1,174 @@
+"""
+Stand-in for the Azure OpenAI chat completions API, for load tests.
+
+Answers POST /openai/deployments/<deployment>/chat/completions with a
+streamed (or plain) completion holding a JSON array of cards, after a
+configurable time to first token and at a configurable token rate. A
+fraction of requests can be failed with 429 (with Retry-After) or 500.
+
+    python benchmarks/fake_llm_server.py [--port 8765] [--first-token-ms 400] [--tokens-per-s 80] [--failure-rate 0.0]
+
+Point the app at it with LLM_ENDPOINT=http://127.0.0.1:<port>, any LLM_KEY,
+LLM_DEPLOYMENT and LLM_API_VERSION.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 4
+WORDS = ("familia amigos viaje recuerdo secreto sueño miedo comida música película infancia verano "
+         "regalo canción ciudad deporte libro fiesta trabajo mascota abuela primer beso aventura").split()
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The client drops streams once the JSON array is closed; not an error
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+def fake_cards(count: int, rng: random.Random) -> list:
+    return [{"id": i + 1,
+             "description": "¿Cuál es tu " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))) + "?"}
+            for i in range(count)]
+
+class FakeLLM:
+    def __init__(self, first_token_ms: float = 400, tokens_per_s: float = 80, failure_rate: float = 0.0,
+                 cards_per_call: int = 10, retry_after_s: float = 1, seed: int = None):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_s = tokens_per_s
+        self.failure_rate = failure_rate
+        self.cards_per_call = cards_per_call
+        self.retry_after_s = retry_after_s
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.metrics = {"requests": 0, "completions": 0, "failures_429": 0, "failures_500": 0,
+                        "completion_tokens": 0}
+        self._server = None
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.metrics[key] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.metrics)
+
+    def _outcome(self) -> str:
+        with self._lock:
+            roll = self._rng.random()
+            cards = fake_cards(self.cards_per_call, self._rng)
+        if roll < self.failure_rate / 2:
+            return "429", None
+        if roll < self.failure_rate:
+            return "500", None
+        return "ok", json.dumps(cards, ensure_ascii=False)
+
+    def handler(self):
+        llm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict, headers: dict = None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if "/chat/completions" not in self.path:
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                llm._count("requests")
+                outcome, content = llm._outcome()
+                if outcome == "429":
+                    llm._count("failures_429")
+                    self._send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                                    {"Retry-After": str(llm.retry_after_s)})
+                    return
+                if outcome == "500":
+                    llm._count("failures_500")
+                    self._send_json(500, {"error": {"code": "500", "message": "Injected failure."}})
+                    return
+
+                time.sleep(llm.first_token_ms / 1000)
+                tokens = [content[i:i + CHARS_PER_TOKEN] for i in range(0, len(content), CHARS_PER_TOKEN)]
+                llm._count("completions")
+                llm._count("completion_tokens", len(tokens))
+                base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": request.get("model", "fake")}
+
+                if not request.get("stream"):
+                    time.sleep(len(tokens) / llm.tokens_per_s)
+                    self._send_json(200, dict(base, object="chat.completion", choices=[
+                        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                        usage={"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for token in tokens:
+                        chunk = dict(base, object="chat.completion.chunk",
+                                     choices=[{"index": 0, "finish_reason": None, "delta": {"content": token}}])
+                        self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                        time.sleep(1 / llm.tokens_per_s)
+                    done = dict(base, object="chat.completion.chunk",
+                                choices=[{"index": 0, "finish_reason": "stop", "delta": {}}])
+                    self._write_chunk(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+                    self._write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stops reading once the JSON array is closed
+                    self.close_connection = True
+
+        return Handler
+
+    def start(self, port: int = 0) -> str:
+        """
+        Serve in a daemon thread; returns the endpoint URL.
+        """
+        self._server = _Server(("127.0.0.1", port), self.handler())
+        threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--tokens-per-s", type=float, default=80)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--cards-per-call", type=int, default=10)
+    args = parser.parse_args()
+
+    server = FakeLLM(args.first_token_ms, args.tokens_per_s, args.failure_rate, args.cards_per_call)
+    print(f"Fake LLM listening on {server.start(args.port)}")
+    try:
+        while True:
+            time.sleep(60)
+            print(server.snapshot())
+    except KeyboardInterrupt:
+        server.stop()
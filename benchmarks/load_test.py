@@ -0,0 +1,286 @@
+"""
+Load test for the HTTP endpoints, run in process against local stand-ins.
+
+Drives realistic sessions (get_dynamics, create_session, get_cards, then
+update_card_status for up to 10 cards) through the function_app handlers
+at increasing concurrency, and reports per endpoint p50/p95/p99 latency
+and database round trips per request, plus LLM calls per session.
+
+The database is either the in-process MemoryDB (default, no services
+needed) or the Postgres from .env (`--db postgres`, schema applied with
+`python migrate.py` and a seeded catalog), whose round trips are counted
+on the connection. The LLM is the fake server in fake_llm_server.py
+unless `--llm azure` is given. Refills run on the in-process worker and
+the feedback buffer is flushed after every level, so their work lands in
+the "background" column.
+
+    python benchmarks/load_test.py [--concurrency 1,4,16,32] [--sessions 40] [--db memory|postgres]
+        [--llm fake|azure] [--first-token-ms 400] [--tokens-per-s 80] [--failure-rate 0.0] [--json report.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from utils import load_env
+load_env()
+import azure.functions as func
+import db_operations as db
+import llm_operations as llm
+import replenishment
+import dedup
+import feedback_buffer
+import session_tokens
+import function_app
+from fake_llm_server import FakeLLM
+from memory_db import MemoryDB
+
+COMBINATIONS = [
+    {"social_context": context, "purpose": purpose, "tone": tone, "dynamic": dynamic, "hot": hot, "drink": False}
+    for context in ("family", "friends", "couple")
+    for purpose in ("fun", "meet")
+    for tone, dynamic, hot in (("1", "questions", False), ("3", "challenges", True))
+]
+SWIPES_PER_SESSION = 10
+LIKE_RATE = 0.3
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+class RoundTrips:
+    """
+    Counts database round trips, attributed to the request running on the
+    current thread or, outside of one, to background work.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.background = 0
+
+    def count(self, n: int = 1):
+        current = getattr(self._local, "current", None)
+        if current is not None:
+            current[0] += n
+        else:
+            with self._lock:
+                self.background += n
+
+    @contextmanager
+    def request(self):
+        self._local.current = [0]
+        try:
+            yield self._local.current
+        finally:
+            self._local.current = None
+
+def counting_connect(round_trips: RoundTrips):
+    """
+    connect_db variant whose connections count every statement, commit and rollback.
+    """
+    import psycopg2.extensions
+
+    class CountingCursor(db.TracedCursor):
+        def execute(self, query, vars=None):
+            round_trips.count()
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            vars_list = list(vars_list)
+            round_trips.count(len(vars_list))
+            return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            round_trips.count()
+            return super().copy_expert(sql, file, size)
+
+    class CountingConnection(psycopg2.extensions.connection):
+        def commit(self):
+            round_trips.count()
+            return super().commit()
+
+        def rollback(self):
+            round_trips.count()
+            return super().rollback()
+
+    return lambda: db.connect_db(connection_factory=CountingConnection, cursor_factory=CountingCursor)
+
+def _handler(function):
+    # Decorated functions are FunctionBuilders in the v2 programming model
+    return function.build().get_user_function() if hasattr(function, "build") else function
+
+class _Out:
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+HANDLERS = {
+    "get_dynamics": _handler(function_app.get_dynamics),
+    "create_session": _handler(function_app.create_session),
+    "get_cards": _handler(function_app.get_cards),
+    "update_card_status": _handler(function_app.update_card_status),
+}
+
+class LoadTest:
+    def __init__(self, round_trips: RoundTrips, seed: int = None):
+        self.round_trips = round_trips
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        # Zipf-like popularity: a few combinations get most sessions
+        self._weights = [1 / (rank + 1) for rank in range(len(COMBINATIONS))]
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.latencies = {name: [] for name in HANDLERS}
+        self.request_round_trips = {name: [] for name in HANDLERS}
+        self.errors = {name: 0 for name in HANDLERS}
+
+    def _call(self, name: str, method: str, url: str, body: dict = None, params: dict = None,
+              route_params: dict = None, **bindings) -> func.HttpResponse:
+        req = func.HttpRequest(method=method, url=url, headers={}, params=params or {},
+                               route_params=route_params or {},
+                               body=json.dumps(body).encode() if body is not None else b"")
+        with self.round_trips.request() as count:
+            start = time.perf_counter()
+            try:
+                response = HANDLERS[name](req, **bindings)
+            except Exception:
+                response = None
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.latencies[name].append(elapsed_ms)
+            self.request_round_trips[name].append(count[0])
+            if response is None or response.status_code >= 400:
+                self.errors[name] += 1
+        return response
+
+    def run_session(self):
+        with self._rng_lock:
+            selections = dict(self._rng.choices(COMBINATIONS, weights=self._weights)[0])
+            likes = [self._rng.random() < LIKE_RATE for _ in range(SWIPES_PER_SESSION)]
+
+        self._call("get_dynamics", "GET", "/api/get_dynamics")
+        response = self._call("create_session", "POST", "/api/create_session", body={"selections": selections})
+        if response is None or response.status_code != 200:
+            return
+        session = json.loads(response.get_body())
+        params = {"token": session["session_token"]} if session.get("session_token") else {}
+
+        response = self._call("get_cards", "GET", f"/api/get_cards/{session['session_id']}", params=params,
+                              route_params={"session_id": str(session["session_id"])}, refill=_Out())
+        if response is None or response.status_code != 200:
+            return
+        for card, liked in zip(json.loads(response.get_body()), likes):
+            body = {"session_id": session["session_id"], "card_id": card["id"], "liked": liked}
+            if session.get("session_token"):
+                body["session_token"] = session["session_token"]
+            self._call("update_card_status", "POST", "/api/update_card_status", body=body)
+
+    def run_level(self, concurrency: int, sessions: int) -> float:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(self.run_session) for _ in range(sessions)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        # Let background work triggered by this level finish before measuring the next
+        replenishment._local_queue.join()
+        feedback_buffer.feedback_buffer.flush()
+        return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,32")
+    parser.add_argument("--sessions", type=int, default=40, help="sessions per concurrency level")
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="simulated round trip time for --db memory")
+    parser.add_argument("--llm", choices=("fake", "azure"), default="fake")
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--tokens-per-s", type=float, default=80)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    round_trips = RoundTrips()
+    if args.db == "memory":
+        MemoryDB(rtt_ms=args.rtt_ms, on_round_trip=round_trips.count, seed=args.seed).install()
+    else:
+        db._pool = db.ConnectionPool(connect=counting_connect(round_trips))
+
+    fake = None
+    if args.llm == "fake":
+        fake = FakeLLM(args.first_token_ms, args.tokens_per_s, args.failure_rate, seed=args.seed)
+        os.environ.update({"LLM_ENDPOINT": fake.start(), "LLM_KEY": "fake", "LLM_DEPLOYMENT": "fake",
+                           "LLM_API_VERSION": os.getenv("LLM_API_VERSION", "2024-06-01")})
+        llm._client = None
+    replenishment.REPLENISH_MODE = "local"
+
+    test = LoadTest(round_trips, seed=args.seed)
+    report = []
+    print(f"db={args.db} llm={args.llm} tokens={'on' if session_tokens.tokens_enabled() else 'off'} "
+          f"sessions/level={args.sessions}")
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        test.reset()
+        background_before = round_trips.background
+        llm_before = llm.get_llm_metrics()["calls"]
+        fake_before = fake.snapshot()["requests"] if fake else 0
+
+        elapsed = test.run_level(concurrency, args.sessions)
+
+        level = {
+            "concurrency": concurrency,
+            "sessions": args.sessions,
+            "sessions_per_s": args.sessions / elapsed,
+            "llm_calls_per_session": (llm.get_llm_metrics()["calls"] - llm_before) / args.sessions,
+            "llm_requests_per_session": ((fake.snapshot()["requests"] - fake_before) / args.sessions
+                                         if fake else None),
+            "background_round_trips": round_trips.background - background_before,
+            "endpoints": {},
+        }
+        for name, latencies in test.latencies.items():
+            counts = test.request_round_trips[name]
+            level["endpoints"][name] = {
+                "requests": len(latencies),
+                "errors": test.errors[name],
+                "p50_ms": percentile(latencies, 0.50),
+                "p95_ms": percentile(latencies, 0.95),
+                "p99_ms": percentile(latencies, 0.99),
+                "round_trips_per_request": sum(counts) / len(counts) if counts else 0.0,
+            }
+        report.append(level)
+
+        print(f"\nconcurrency {concurrency}: {level['sessions_per_s']:.1f} sessions/s, "
+              f"{level['llm_calls_per_session']:.2f} LLM calls/session"
+              + (f" ({level['llm_requests_per_session']:.2f} HTTP requests incl. retries)" if fake else "")
+              + f", {level['background_round_trips']} background round trips")
+        print(f"  {'endpoint':<20}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'trips/req':>11}")
+        for name, stats in level["endpoints"].items():
+            print(f"  {name:<20}{stats['requests']:>9}{stats['errors']:>8}{stats['p50_ms']:>9.1f}"
+                  f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['round_trips_per_request']:>11.2f}")
+
+    d = dedup.get_dedup_metrics()
+    print(f"\ndedup: {d['duplicate_rate']:.1%} of {d['checked']} generated cards dropped, "
+          f"{d['effective_cards_per_1k_tokens']} cards per 1k tokens, {d['check_ms_avg']} ms per check")
+    if fake:
+        print(f"\nfake LLM: {fake.snapshot()}")
+        fake.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
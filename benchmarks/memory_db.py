@@ -0,0 +1,256 @@
+"""
+In-process stand-in for the Postgres side of db_operations, for load tests.
+
+MemoryDB implements the db_operations functions the endpoints call, with
+the same signatures and return shapes, over plain dicts. Each call is
+charged the round trips its real counterpart makes (statement plus
+commit/rollback) and sleeps rtt_ms per round trip, so latency and round
+trip counts stay comparable with a real database. Sampling is uniform over
+fresh, unseen cards; it stands in for the server-side sampler, it does not
+reproduce it.
+
+    memdb = MemoryDB(rtt_ms=1.0)
+    memdb.install()  # patches db_operations and the catalog cache
+"""
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+import db_operations as db
+import cache_operations
+import feedback_buffer
+import session_tokens
+
+DYNAMICS = [
+    {"id": 1, "name": "questions", "title": "Preguntas", "description": "Preguntas para conocerse"},
+    {"id": 2, "name": "challenges", "title": "Retos", "description": "Retos para el grupo"},
+]
+
+PROMPT_TEMPLATES = (
+    [{"id": i + 1, "selection_key": "base", "selection_value": d["name"], "template_order": 0,
+      "prompt": "You are the host of a {dynamic} card game for {social_context}, aiming to {purpose}. "}
+     for i, d in enumerate(DYNAMICS)]
+    + [{"id": 10 + i, "selection_key": key, "selection_value": value, "template_order": i,
+        "prompt": f"Cards should suit {key} = {value}."}
+       for i, (key, value) in enumerate([("social_context", "family"), ("social_context", "friends"),
+                                         ("social_context", "couple"), ("purpose", "fun"), ("purpose", "meet"),
+                                         ("tone", "1"), ("tone", "2"), ("tone", "3"), ("tone", "4"),
+                                         ("hot", "true"), ("drink", "true")])]
+)
+
+class MemoryDB:
+    def __init__(self, rtt_ms: float = 1.0, on_round_trip=None, seed: int = None):
+        self.rtt_ms = rtt_ms
+        self.on_round_trip = on_round_trip
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._advisory = {}
+        self.sessions = {}
+        self.cards = {}
+        self.cards_by_hash = {}
+        self.session_cards = {}  # session_id -> {card_id: page}
+        self._next_session_id = 1
+        self._next_card_id = 1
+
+    def _charge(self, round_trips: int = 2):
+        if self.on_round_trip is not None:
+            self.on_round_trip(round_trips)
+        if self.rtt_ms:
+            time.sleep(round_trips * self.rtt_ms / 1000)
+
+    # Sessions
+
+    def start_session(self, selection: dict, selection_name: str, selection_hash: str) -> int:
+        self._charge()
+        with self._lock:
+            session_id = self._next_session_id
+            self._next_session_id += 1
+            self._add_session(session_id, selection, selection_name, selection_hash)
+        return session_id
+
+    def _add_session(self, session_id, selection, selection_name, selection_hash):
+        self.sessions.setdefault(session_id, {"id": session_id, "selection": json.dumps(selection),
+                                              "selection_name": selection_name, "selection_hash": selection_hash,
+                                              "created_at": time.time(), "ended_at": None})
+
+    def reserve_session_ids(self, count: int) -> list:
+        self._charge()
+        with self._lock:
+            first = self._next_session_id
+            self._next_session_id += count
+        return list(range(first, first + count))
+
+    def insert_sessions(self, sessions: list) -> int:
+        self._charge()
+        with self._lock:
+            before = len(self.sessions)
+            for session_id, selection, selection_name, selection_hash in sessions:
+                self._add_session(session_id, selection, selection_name, selection_hash)
+            return len(self.sessions) - before
+
+    def get_session(self, session_id) -> dict:
+        self._charge()
+        with self._lock:
+            row = self.sessions.get(int(session_id))
+            return dict(row, selection=json.loads(row['selection'])) if row else None
+
+    # Cards
+
+    def _fresh(self, combination_hash: str, policy: int) -> list:
+        return [self.cards[card_id] for card_id in self.cards_by_hash.get(combination_hash, ())
+                if self.cards[card_id]['times_shown'] < policy]
+
+    def count_fresh_cards(self, combination_hash: str, policy: int = 5, exclude_session_id: int = None) -> int:
+        self._charge()
+        with self._lock:
+            seen = self.session_cards.get(exclude_session_id, {}) if exclude_session_id is not None else {}
+            return sum(1 for card in self._fresh(combination_hash, policy) if card['id'] not in seen)
+
+    def count_fresh_cards_batch(self, combination_hashes: list, policy: int = 5) -> dict:
+        self._charge()
+        with self._lock:
+            return {h: len(self._fresh(h, policy)) for h in combination_hashes}
+
+    def create_cards(self, card_data_list: list, combination_hash: str, combination_name: str) -> list:
+        self._charge()
+        with self._lock:
+            card_ids = []
+            for card_data in card_data_list:
+                card_id = self._next_card_id
+                self._next_card_id += 1
+                self.cards[card_id] = {"id": card_id, "card_data": card_data, "combination_name": combination_name,
+                                       "combination_hash": combination_hash, "created_at": time.time(),
+                                       "like_count": 0, "times_shown": 0, "last_time_shown": None}
+                self.cards_by_hash.setdefault(combination_hash, []).append(card_id)
+                card_ids.append(card_id)
+            return card_ids
+
+    def get_card_texts(self, combination_hash: str, after_id: int = 0) -> list:
+        self._charge()
+        with self._lock:
+            return [{"id": card_id, "card_data": self.cards[card_id]['card_data']}
+                    for card_id in self.cards_by_hash.get(combination_hash, ()) if card_id > after_id]
+
+    def _session_view(self, session_id, session: dict = None):
+        if session is not None:
+            self._add_session(int(session_id), session['selection'], session['selection_name'],
+                              session['selection_hash'])
+        row = self.sessions.get(int(session_id))
+        return dict(row) if row else None
+
+    def _draw(self, session_row: dict, sample_size: int, policy: int, page=None) -> tuple:
+        seen = self.session_cards.setdefault(session_row['id'], {})
+        fresh = self._fresh(session_row['selection_hash'], policy)
+        unseen = [card for card in fresh if card['id'] not in seen]
+        picks = self._rng.sample(unseen, min(sample_size, len(unseen)))
+        for card in picks:
+            seen[card['id']] = page
+        return len(fresh), len(unseen) - len(picks), [{"id": c['id'], "card_data": c['card_data'], "times_shown": c['times_shown'],
+                             "like_count": c['like_count']} for c in picks]
+
+    def draw_session_cards(self, session_id, sample_size: int = 10, policy: int = 5, session: dict = None) -> dict:
+        self._charge()
+        with self._lock:
+            session_row = self._session_view(session_id, session)
+            if session_row is None:
+                return None
+            stock, unseen, cards = self._draw(session_row, sample_size, policy)
+        session_row['selection'] = json.loads(session_row['selection'])
+        return {"session": session_row, "stock": stock, "unseen": unseen, "cards": cards}
+
+    def next_session_page(self, session_id, page: int, page_size: int = 10, policy: int = 5,
+                          session: dict = None) -> dict:
+        self._charge()
+        with self._lock:
+            session_row = self._session_view(session_id, session)
+            if session_row is None:
+                return None
+            seen = self.session_cards.setdefault(session_row['id'], {})
+            cards = [self.cards[card_id] for card_id, p in seen.items() if p == page]
+            if cards:
+                cards = [{"id": c['id'], "card_data": c['card_data'], "times_shown": c['times_shown'],
+                          "like_count": c['like_count']} for c in cards]
+            else:
+                _, _, cards = self._draw(session_row, page_size, policy, page=page)
+            reserved = [card_id for card_id, p in seen.items() if p == page + 1]
+            stock, unseen, drawn = self._draw(session_row, 0 if reserved else page_size, policy, page=page + 1)
+            reserved = reserved or drawn
+        session_row['selection'] = json.loads(session_row['selection'])
+        return {"session": session_row, "stock": stock, "unseen": unseen, "page": page, "cards": cards,
+                "has_more": bool(reserved)}
+
+    def apply_feedback_batch(self, card_counts: list, session_endings: list) -> tuple:
+        self._charge()
+        cards_updated = session_cards_updated = 0
+        with self._lock:
+            for card_id, shown, likes in card_counts:
+                card = self.cards.get(card_id)
+                if card is not None:
+                    card['times_shown'] += shown
+                    card['like_count'] += likes
+                    cards_updated += 1
+            for session_id, card_id, _, _ in session_endings:
+                if card_id in self.session_cards.get(session_id, ()):
+                    session_cards_updated += 1
+        return cards_updated, session_cards_updated
+
+    def compact_card_events(self, batch_size: int = db.COMPACTION_BATCH_SIZE) -> int:
+        self._charge()
+        return 0
+
+    @contextmanager
+    def advisory_lock(self, name: str, timeout: float = db.ADVISORY_LOCK_TIMEOUT):
+        with self._lock:
+            lock = self._advisory.setdefault(name, threading.Lock())
+        self._charge()
+        if not lock.acquire(timeout=timeout):
+            raise db.LockTimeout(f"Advisory lock {name} not acquired after {timeout}s")
+        try:
+            yield
+            self._charge()
+        finally:
+            lock.release()
+
+    # Catalog
+
+    def get_recent_combinations(self, policy: int = 5, since_hours: int = 24) -> list:
+        self._charge()
+        cutoff = time.time() - since_hours * 3600
+        with self._lock:
+            recent = {}
+            for row in self.sessions.values():
+                if row['created_at'] > cutoff:
+                    recent[row['selection_hash']] = row
+            return [{"selection_hash": h, "selection_name": row['selection_name'],
+                     "selection": json.loads(row['selection']), "stock": len(self._fresh(h, policy))}
+                    for h, row in recent.items()]
+
+    def load_catalog(self) -> dict:
+        self._charge()
+        return {"prompt_templates": [dict(t) for t in PROMPT_TEMPLATES], "dynamics": [dict(d) for d in DYNAMICS]}
+
+    def get_dynamics(self) -> list:
+        self._charge()
+        return [dict(d) for d in DYNAMICS]
+
+    def get_pool_metrics(self) -> dict:
+        return {}
+
+    EXPORTS = ("start_session", "reserve_session_ids", "insert_sessions", "get_session", "count_fresh_cards",
+               "count_fresh_cards_batch", "create_cards", "get_card_texts", "draw_session_cards",
+               "next_session_page", "apply_feedback_batch", "compact_card_events", "advisory_lock",
+               "get_recent_combinations", "load_catalog", "get_dynamics", "get_pool_metrics")
+
+    def install(self):
+        """
+        Route db_operations (as seen by every module that imported it) to this store.
+        """
+        for name in self.EXPORTS:
+            setattr(db, name, getattr(self, name))
+        # Writers bound as default arguments when their modules were imported
+        cache_operations.catalog._loader = self.load_catalog
+        feedback_buffer.feedback_buffer._writer = self.apply_feedback_batch
+        session_tokens.session_writer._writer = self.insert_sessions
+        cache_operations.invalidate_catalog()
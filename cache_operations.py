@@ -0,0 +1,159 @@
+import os
+import json
+import threading
+import time
+import logging
+import hashlib
+from collections import OrderedDict
+import db_operations as db
+
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', 300))  # seconds before a background refresh
+
+def _normalize_value(selection_value):
+    # Booleans are stored as lowercase strings in prompt_templates
+    if isinstance(selection_value, bool):
+        return str(selection_value).lower()
+    return selection_value
+
+class CatalogCache:
+    """
+    In-process copy of the prompt_templates and dynamics tables.
+
+    Both tables are loaded with one query and templates are indexed by
+    (selection_key, selection_value). Only the very first lookup waits for the
+    database; once the TTL expires the stale copy keeps being served while a
+    background thread reloads it.
+    """
+    def __init__(self, loader=db.load_catalog, ttl: float = CATALOG_CACHE_TTL):
+        self._loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._templates = None
+        self._dynamics = None
+        self._loaded_at = 0.0
+        self.version = None
+
+    def _load(self):
+        catalog = self._loader()
+        templates = {}
+        for template in catalog['prompt_templates']:
+            key = (template['selection_key'], template['selection_value'])
+            templates.setdefault(key, []).append(template)
+        version = hashlib.sha256(json.dumps(catalog, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+        with self._lock:
+            self._templates = templates
+            self._dynamics = catalog['dynamics']
+            self._loaded_at = time.monotonic()
+            self.version = version
+            snapshot = (templates, self._dynamics, version)
+        logging.info(f"Catalog cache loaded {len(catalog['prompt_templates'])} templates, "
+                     f"{len(catalog['dynamics'])} dynamics (version {version})")
+        return snapshot
+
+    def _background_refresh(self):
+        try:
+            self._load()
+        except Exception as e:
+            logging.error(f"Error refreshing catalog cache: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _snapshot(self):
+        if self._templates is None:
+            with self._load_lock:
+                if self._templates is None:
+                    return self._load()
+
+        with self._lock:
+            snapshot = (self._templates, self._dynamics, self.version)
+            expired = time.monotonic() - self._loaded_at >= self.ttl
+            start_refresh = expired and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+        if start_refresh:
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+        return snapshot
+
+    def get_prompt_templates(self, selection_key: str, selection_value) -> list:
+        templates, _, _ = self._snapshot()
+        return templates.get((selection_key, _normalize_value(selection_value)), [])
+
+    def get_dynamics(self) -> list:
+        _, dynamics, _ = self._snapshot()
+        return dynamics
+
+    def get_version(self) -> str:
+        _, _, version = self._snapshot()
+        return version
+
+    def invalidate(self, reload: bool = False):
+        """
+        Drop the cached tables so the next lookup reloads them, e.g. after editing templates.
+        """
+        with self._lock:
+            self._templates = None
+            self._dynamics = None
+            self._loaded_at = 0.0
+            self.version = None
+        if reload:
+            self._load()
+
+catalog = CatalogCache()
+
+PROMPT_CACHE_SIZE = int(os.getenv('PROMPT_CACHE_SIZE', 512))  # compiled prompts kept per worker
+
+class PromptCache:
+    """
+    Bounded LRU of compiled (system_message, user_message) pairs keyed by
+    (selection_hash, catalog version). A template edit changes the catalog
+    version, which empties the cache on the next lookup.
+    """
+    def __init__(self, catalog_cache: CatalogCache, max_size: int = PROMPT_CACHE_SIZE):
+        self._catalog = catalog_cache
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._metrics = {"hits": 0, "misses": 0}
+
+    def get_or_build(self, selection_hash: str, build):
+        version = self._catalog.get_version()
+        key = (selection_hash, version)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._metrics["hits"] += 1
+                return self._entries[key]
+            self._metrics["misses"] += 1
+
+        prompt = build()
+        with self._lock:
+            if self._version == version:
+                self._entries[key] = prompt
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return prompt
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["size"] = len(self._entries)
+        return snapshot
+
+prompt_cache = PromptCache(catalog)
+
+def invalidate_catalog(reload: bool = False):
+    catalog.invalidate(reload=reload)
+    prompt_cache.clear()
@@ -1,202 +1,719 @@
 from datetime import datetime
+import hashlib
+import io
 import os
-from psycopg2.extensions import connection
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from psycopg2.extensions import connection, cursor, TRANSACTION_STATUS_IDLE
 import psycopg2
-from dotenv import load_dotenv
+from psycopg2.extras import execute_values
 import json
-
-load_dotenv(".env", override=True)  # Load environment variables from .env file
-
-def connect_db()-> connection:
+import tracing
+
+POOL_MIN_SIZE = int(os.getenv('PG_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.getenv('PG_POOL_MAX_SIZE', 10))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv('PG_POOL_ACQUIRE_TIMEOUT', 30))  # seconds to wait for a free connection
+POOL_HEALTHCHECK_AFTER = float(os.getenv('PG_POOL_HEALTHCHECK_AFTER', 30))  # idle seconds before a connection is pinged
+BULK_COPY_THRESHOLD = int(os.getenv('PG_BULK_COPY_THRESHOLD', 5000))  # rows from which inserts switch to COPY
+ADVISORY_LOCK_POOL_SIZE = int(os.getenv('PG_ADVISORY_LOCK_POOL_SIZE', 4))  # connections for held advisory locks
+ADVISORY_LOCK_TIMEOUT = float(os.getenv('PG_ADVISORY_LOCK_TIMEOUT', 120))  # seconds to wait for a busy lock
+ADVISORY_LOCK_ACQUIRE_TIMEOUT = float(os.getenv('PG_ADVISORY_LOCK_ACQUIRE_TIMEOUT', 2))  # seconds to wait for a lock connection
+ADVISORY_LOCK_POLL_INTERVAL = 0.25  # seconds between pg_try_advisory_lock attempts
+
+def _sql_label(query) -> str:
+    if not isinstance(query, str):
+        query = query.decode() if isinstance(query, bytes) else str(query)
+    return " ".join(query.split()[:4])[:80]
+
+class TracedCursor(cursor):
+    """
+    Cursor that records a db.statement span (SQL label, rows, duration) per statement when tracing is on.
+    """
+    def execute(self, query, vars=None):
+        if not tracing.enabled():
+            return super().execute(query, vars)
+        with tracing.span("db.statement", label=_sql_label(query)) as span:
+            result = super().execute(query, vars)
+            span.set_attribute("rows", self.rowcount)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        if not tracing.enabled():
+            return super().copy_expert(sql, file, size)
+        with tracing.span("db.statement", label=_sql_label(sql)) as span:
+            result = super().copy_expert(sql, file, size)
+            span.set_attribute("rows", self.rowcount)
+        return result
+
+def connect_db(**kwargs)-> connection:
     POSTGRES_REMOTE_ENDPOINT = os.environ['PGHOST']
     POSTGRES_REMOTE_USER = os.environ['PGUSER']
     POSTGRES_REMOTE_PASSWORD = os.environ['PGPASSWORD']
     POSTGRES_DB_NAME = os.environ['PGDATABASE']
-    sslmode = "require"
+    sslmode = os.getenv('PGSSLMODE', "require")
     # logging.info(f"Env: {POSTGRES_REMOTE_ENDPOINT},{POSTGRES_DB_NAME},{POSTGRES_REMOTE_USER}")
-    conn_string = f"host={POSTGRES_REMOTE_ENDPOINT} user={POSTGRES_REMOTE_USER} dbname={POSTGRES_DB_NAME} password={POSTGRES_REMOTE_PASSWORD} sslmode={sslmode}"
+    conn_string = f"host={POSTGRES_REMOTE_ENDPOINT} user={POSTGRES_REMOTE_USER} dbname={POSTGRES_DB_NAME} password={POSTGRES_REMOTE_PASSWORD} sslmode={sslmode} keepalives=1 keepalives_idle=30"
 
-    conn: connection = psycopg2.connect(conn_string)
+    kwargs.setdefault('cursor_factory', TracedCursor)
+    conn: connection = psycopg2.connect(conn_string, **kwargs)
     return conn
 
-def query_to_list(query, args=(), one=False):
-    print('running query_to_list ...')
+class PoolTimeout(Exception):
+    pass
+
+class LockTimeout(Exception):
+    pass
 
-    conn = connect_db()
-    cur = conn.cursor()
+class LockPoolTimeout(LockTimeout):
+    """
+    Every connection of the lock pool is holding a lock; the lock itself may be free.
+    """
+    pass
 
-    cur.execute(query, args)
-    r = [dict((cur.description[i][0], value) \
-               for i, value in enumerate(row)) for row in cur.fetchall()]
+class ConnectionPool:
+    """
+    Process-wide pool of Postgres connections that survives warm Function invocations.
+
+    Connections are created lazily up to max_size, handed out LIFO so the most
+    recently used (and most likely still alive) connection is reused first, and
+    pinged with SELECT 1 when they have been idle longer than healthcheck_after.
+    """
+    def __init__(self, connect=connect_db, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 acquire_timeout=POOL_ACQUIRE_TIMEOUT, healthcheck_after=POOL_HEALTHCHECK_AFTER):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.healthcheck_after = healthcheck_after
+        self._idle = deque()  # (conn, last_used) pairs
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._metrics = {
+            "checkouts": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "healthchecks_failed": 0,
+            "in_use": 0,
+        }
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+
+    def _new_connection(self) -> connection:
+        conn = self._connect()
+        with self._lock:
+            self._metrics["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn: connection):
+        with self._lock:
+            self._metrics["connections_discarded"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn: connection, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._lock:
+                self._metrics["healthchecks_failed"] += 1
+            return False
+
+    def _checkout_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, last_used = self._idle.pop()
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+
+    def acquire(self, timeout: float = None) -> connection:
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._metrics["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available after {timeout}s")
+        waited_ms = (time.monotonic() - start) * 1000
+
+        try:
+            conn = self._checkout_idle() or self._new_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._metrics["checkouts"] += 1
+            self._metrics["in_use"] += 1
+            self._metrics["wait_time_total_ms"] += waited_ms
+            self._metrics["wait_time_max_ms"] = max(self._metrics["wait_time_max_ms"], waited_ms)
+        return conn
+
+    def release(self, conn: connection, discard: bool = False):
+        try:
+            if not discard and not conn.closed:
+                try:
+                    if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self._metrics["in_use"] -= 1
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["idle"] = len(self._idle)
+        snapshot["max_size"] = self.max_size
+        return snapshot
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def get_pool_metrics() -> dict:
+    return get_pool().metrics() if _pool is not None else {}
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled connection. Callers commit their own writes; anything left
+    uncommitted is rolled back when the connection goes back to the pool, and
+    connections broken by the error are thrown away instead of reused.
+    """
+    pool = get_pool()
+    with tracing.span("db.acquire"):
+        conn = pool.acquire()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.release(conn, discard=discard)
+
+_lock_pool = None
+
+def get_lock_pool() -> ConnectionPool:
+    """
+    Small pool, separate from the request pool, for connections that hold
+    advisory locks; a held lock pins its connection for as long as the work
+    it guards (e.g. an LLM generation) runs.
+    """
+    global _lock_pool
+    if _lock_pool is None:
+        with _pool_lock:
+            if _lock_pool is None:
+                _lock_pool = ConnectionPool(min_size=0, max_size=ADVISORY_LOCK_POOL_SIZE)
+    return _lock_pool
+
+@contextmanager
+def advisory_lock(name: str, timeout: float = ADVISORY_LOCK_TIMEOUT):
+    """
+    Hold a session-level Postgres advisory lock named `name`.
+    Serializes work across Function workers that share the database.
+
+    The lock is taken on a connection from get_lock_pool(), never from the
+    request pool. Waiters poll pg_try_advisory_lock without keeping a
+    connection between attempts, and raise LockTimeout after `timeout` seconds.
+    Getting a connection has its own, much shorter limit: when the lock pool
+    stays full for ADVISORY_LOCK_ACQUIRE_TIMEOUT, LockPoolTimeout is raised
+    instead of queueing behind unrelated locks.
+    """
+    key = int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+    pool = get_lock_pool()
+    deadline = time.monotonic() + timeout
+    with tracing.span("db.advisory_lock_wait"):
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                conn = pool.acquire(timeout=ADVISORY_LOCK_ACQUIRE_TIMEOUT)
+            except PoolTimeout:
+                raise LockPoolTimeout(f"No lock connection for {name} after {ADVISORY_LOCK_ACQUIRE_TIMEOUT}s: "
+                                      f"all {pool.max_size} are holding locks")
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+                locked = cur.fetchone()[0]
+                conn.commit()  # end the implicit transaction; a session-level lock stays held
+            except psycopg2.Error:
+                pool.release(conn, discard=True)
+                raise
+            if locked:
+                break
+            pool.release(conn)
+            if remaining <= ADVISORY_LOCK_POLL_INTERVAL:
+                raise LockTimeout(f"Advisory lock {name} not acquired after {timeout}s")
+            time.sleep(ADVISORY_LOCK_POLL_INTERVAL)
+
+    try:
+        yield
+    finally:
+        try:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (key,))
+            conn.commit()
+            pool.release(conn)
+        except psycopg2.Error:
+            # Closing the session releases the lock
+            pool.release(conn, discard=True)
+
+def query_to_list(query, args=(), one=False):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, args)
+        r = [dict((cur.description[i][0], value) \
+                   for i, value in enumerate(row)) for row in cur.fetchall()]
 
-    conn.close()
     return (r[0] if r else None) if one else r
 
+@tracing.traced("db.start_session")
 def start_session(selection: dict, selection_name: str, selection_hash: str) -> str:
-    print('starting session ...')
-
-    conn = connect_db()
-    cur = conn.cursor()
+    with get_connection() as conn:
+        cur = conn.cursor()
 
-    cur.execute("INSERT INTO sessions (selection, selection_name, selection_hash) VALUES (%s, %s, %s) RETURNING id;",
-                 (json.dumps(selection), selection_name, selection_hash))
-    session_id = cur.fetchone()[0]
-    conn.commit()
-    conn.close()
+        cur.execute("INSERT INTO sessions (selection, selection_name, selection_hash) VALUES (%s, %s, %s) RETURNING id;",
+                     (json.dumps(selection), selection_name, selection_hash))
+        session_id = cur.fetchone()[0]
+        conn.commit()
     return session_id
 
-def get_session(session_id: str) -> dict:
-    print('getting session ...')
+@tracing.traced("db.reserve_session_ids")
+def reserve_session_ids(count: int) -> list:
+    """
+    Take `count` ids from the sessions sequence so sessions can be created without waiting for their insert.
+    """
+    rows = query_to_list("SELECT nextval(pg_get_serial_sequence('sessions', 'id')) AS id FROM generate_series(1, %s)",
+                         (count,), one=False)
+    return [row['id'] for row in rows]
 
-    conn = connect_db()
-    cur = conn.cursor()
+@tracing.traced("db.insert_sessions")
+def insert_sessions(sessions: list) -> int:
+    """
+    Insert sessions with pre-reserved ids; rows that already exist are left untouched.
 
+    Args:
+        sessions: (session_id, selection, selection_name, selection_hash) tuples.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        execute_values(cur, """INSERT INTO sessions (id, selection, selection_name, selection_hash) VALUES %s
+                               ON CONFLICT (id) DO NOTHING""",
+                       [(session_id, json.dumps(selection), selection_name, selection_hash)
+                        for session_id, selection, selection_name, selection_hash in sessions])
+        inserted = cur.rowcount
+        conn.commit()
+    return inserted
+
+@tracing.traced("db.get_session")
+def get_session(session_id: str) -> dict:
     query = "SELECT * FROM sessions WHERE id = %s"
     row = query_to_list(query, (session_id,), one=True)
-    conn.close()
-    row['selection'] = json.loads(row['selection']) if row else None
+    if row:
+        row['selection'] = json.loads(row['selection'])
     return row
 
+@tracing.traced("db.get_cards_by_hash")
 def get_cards_by_hash(combination_hash: str, policy= 5) -> list:
-    print('getting cards by hash ...')
-
-    query = f"SELECT * FROM cards WHERE combination_hash = %s AND times_shown < {policy}"
+    query = f"SELECT * FROM live_cards(%s) WHERE times_shown < {policy}"
     rows = query_to_list(query, (combination_hash,), one=False)
 
     return rows
 
-def sample_cards_by_hash(combination_hash: str, sample_size: int = 10, policy = 5) -> list:
-    print("sampling cards by hash ...")
+@tracing.traced("db.get_card_texts")
+def get_card_texts(combination_hash: str, after_id: int = 0) -> list:
+    """
+    Id and text of every card stored for a combination, live or archived,
+    with id above after_id (used to build and catch up the dedup index).
+    """
+    query = "SELECT id, card_data FROM all_cards WHERE combination_hash = %s AND id > %s ORDER BY id"
+    return query_to_list(query, (combination_hash, after_id), one=False)
 
-    # Step 1: Weighted sampling query (no duplicates, freshness-aware)
+@tracing.traced("db.count_fresh_cards")
+def count_fresh_cards(combination_hash: str, policy: int = 5, exclude_session_id: int = None) -> int:
+    """
+    Number of cards for a combination that can still be shown. Counted through
+    live_cards, which finds the combination's cards by
+    idx_cards_hash_times_shown_quality and adds the swipes not yet compacted
+    from card_events, so times_shown is filtered after that merge. With
+    exclude_session_id, cards already dealt to that session are left out.
+    """
+    query = "SELECT COUNT(*) AS stock FROM live_cards(%(hash)s) c WHERE c.times_shown < %(policy)s"
+    if exclude_session_id is not None:
+        query += SEEN_BY_SESSION_FILTER
+    row = query_to_list(query, {"hash": combination_hash, "policy": policy, "session_id": exclude_session_id},
+                        one=True)
+    return row['stock']
+
+@tracing.traced("db.count_fresh_cards_batch")
+def count_fresh_cards_batch(combination_hashes: list, policy: int = 5) -> dict:
+    """
+    Fresh card counts for many combinations in one query; hashes without cards map to 0.
+    """
     query = """
-    WITH weighted AS (
-        SELECT c.id, c.card_data, c.times_shown, c.like_count,
-               GREATEST(0, %s - c.times_shown) AS weight
-        FROM cards c
-        WHERE c.combination_hash = %s
-    ),
-    scored AS (
-        SELECT *,
-               CASE
-                   WHEN weight > 0 THEN -LN(RANDOM()) / weight
-                   ELSE NULL
-               END AS score
-        FROM weighted
-    )
-    SELECT id, card_data, times_shown, like_count
-    FROM scored
-    WHERE score IS NOT NULL
-    ORDER BY score DESC
-    LIMIT %s;
-    """
-
-    # Fetch rows
-    rows = query_to_list(query, (policy, combination_hash, sample_size), one=False)
-
-    # if not rows:
-    #     print("⚠️ No valid cards found, you should trigger generation here.")
-    #     return []
-
-    # # Step 2: Update times_shown for sampled cards
-    # ids = tuple(r["id"] for r in rows)
-    # update_query = """
-    # UPDATE cards
-    # SET times_shown = times_shown + 1,
-    #     last_shown_at = NOW()
-    # WHERE id = ANY(%s);
-    # """
-    # query_to_list(update_query, (list(ids),), one=True)
-
-    return rows
-
-def create_card(card_data: dict, combination_hash: str, combination_name: str) -> int:
-    print('creating card ...')
+    SELECT h.combination_hash, COUNT(*) AS stock
+    FROM unnest(%s::text[]) AS h(combination_hash)
+    CROSS JOIN LATERAL live_cards(h.combination_hash) c
+    WHERE c.times_shown < %s
+    GROUP BY h.combination_hash
+    """
+    rows = query_to_list(query, (list(combination_hashes), policy), one=False)
+    counts = {combination_hash: 0 for combination_hash in combination_hashes}
+    counts.update({row['combination_hash']: row['stock'] for row in rows})
+    return counts
 
-    conn = connect_db()
-    cur = conn.cursor()
+SEEN_BY_SESSION_FILTER = """
+    AND NOT EXISTS (SELECT 1 FROM session_cards sc WHERE sc.session_id = %(session_id)s AND sc.card_id = c.id)
+"""
 
-    cur.execute("INSERT INTO cards (card_data, combination_hash, combination_name) VALUES (%s, %s, %s) RETURNING id;",
-                 (json.dumps(card_data), combination_hash, combination_name))
-    card_id = cur.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return card_id
+@tracing.traced("db.draw_session_cards")
+def draw_session_cards(session_id: int, sample_size: int = 10, policy: int = 5, session: dict = None) -> dict:
+    """
+    Sample cards for a session and record them in session_cards in one round trip.
+
+    Runs the draw_session_cards server-side function (migrations/0004, with
+    quality-weighted buckets since 0010/0011), which excludes cards the session
+    has already seen. When `session` (selection,
+    selection_name, selection_hash from a verified token) is given, the
+    session row is created first if its asynchronous insert has not landed.
+
+    Returns:
+        result (dict): {"session": {...}, "stock": fresh cards for the combination,
+        "unseen": fresh cards still left for this session after the draw,
+        "cards": [...]}, or None when the session does not exist.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        if session is None:
+            cur.execute("SELECT draw_session_cards(%s, %s, %s)", (session_id, sample_size, policy))
+        else:
+            cur.execute("SELECT draw_session_cards(%s, %s, %s, %s, %s, %s)",
+                        (session_id, sample_size, policy, json.dumps(session['selection']),
+                         session['selection_name'], session['selection_hash']))
+        result = cur.fetchone()[0]
+        conn.commit()
+
+    if result:
+        result['session']['selection'] = json.loads(result['session']['selection'])
+    return result
+
+@tracing.traced("db.next_session_page")
+def next_session_page(session_id: int, page: int, page_size: int = 10, policy: int = 5, session: dict = None) -> dict:
+    """
+    Serve page `page` of a session's deck and reserve the page after it, in one round trip.
 
-def create_cards(card_data_list: list, combination_hash: str, combination_name: str) -> list:
-    print('creating cards ...')
+    Cards already recorded for the session are never served again. The page
+    reserved by the previous call is returned as-is, so turning a page costs
+    no sampling on the critical path beyond the prefetch. `session` has the
+    same meaning as in draw_session_cards.
 
-    conn = connect_db()
-    cur = conn.cursor()
+    Returns:
+        result (dict): {"session", "stock", "unseen", "page", "cards", "has_more"}, or None
+        when the session does not exist.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        query = "SELECT next_session_page(%s, %s, %s, %s);"
+        params = (session_id, page, page_size, policy)
+        if session is not None:
+            # Make sure a session created under a token exists before paging it
+            query = "SELECT draw_session_cards(%s, 0, %s, %s, %s, %s);" + query
+            params = (session_id, policy, json.dumps(session['selection']),
+                      session['selection_name'], session['selection_hash']) + params
+        cur.execute(query, params)
+        result = cur.fetchone()[0]
+        conn.commit()
+
+    if result:
+        result['session']['selection'] = json.loads(result['session']['selection'])
+    return result
+
+@tracing.traced("db.create_card")
+def create_card(card_data: dict, combination_hash: str, combination_name: str) -> int:
+    with get_connection() as conn:
+        cur = conn.cursor()
 
-    card_ids = []
-    for card_data in card_data_list:
         cur.execute("INSERT INTO cards (card_data, combination_hash, combination_name) VALUES (%s, %s, %s) RETURNING id;",
-                     (card_data, combination_hash, combination_name))
+                     (json.dumps(card_data), combination_hash, combination_name))
         card_id = cur.fetchone()[0]
-        card_ids.append(card_id)
-
-    conn.commit()
-    conn.close()
-    return card_ids
-
-def update_card_status(card_id: int, liked: bool = False):
-    print('updating card status ...')
+        conn.commit()
+    return card_id
 
-    conn = connect_db()
-    cur = conn.cursor()
+def _copy_escape(value) -> str:
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
 
-    if liked:
-        cur.execute("""UPDATE cards SET 
-                        times_shown = times_shown + 1,
-                        like_count = like_count + 1
-                        WHERE id = %s;""",
-                        (card_id,))
-    else:
-        cur.execute("""UPDATE cards SET 
-                        times_shown = times_shown + 1
-                        WHERE id = %s;""",
-                        (card_id,))
+def bulk_insert(cur, table: str, columns: tuple, rows: list) -> list:
+    """
+    Insert rows in bulk and return their ids in input order.
 
-    conn.commit()
-    conn.close()
+    Small batches use a single multi-row INSERT ... VALUES ... RETURNING id.
+    Batches of BULK_COPY_THRESHOLD rows or more reserve their ids from the
+    table sequence first and are then streamed with COPY, which has no
+    RETURNING clause.
+    """
+    if not rows:
+        return []
+
+    if len(rows) < BULK_COPY_THRESHOLD:
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s RETURNING id"
+        returned = execute_values(cur, query, rows, page_size=len(rows), fetch=True)
+        return [row[0] for row in returned]
+
+    cur.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                (table, len(rows)))
+    ids = [row[0] for row in cur.fetchall()]
+    buffer = io.StringIO()
+    for row_id, row in zip(ids, rows):
+        buffer.write('\t'.join([str(row_id)] + [_copy_escape(value) for value in row]) + '\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} (id, {', '.join(columns)}) FROM STDIN", buffer)
+    return ids
+
+@tracing.traced("db.create_cards")
+def create_cards(card_data_list: list, combination_hash: str, combination_name: str) -> list:
+    with get_connection() as conn:
+        cur = conn.cursor()
+        card_ids = bulk_insert(cur, "cards", ("card_data", "combination_hash", "combination_name"),
+                               [(card_data, combination_hash, combination_name) for card_data in card_data_list])
+        conn.commit()
+    return card_ids
 
-def create_session_cards(session_id: int, card_ids: list):
-    print('creating session cards ...')
+@tracing.traced("db.update_card_status")
+def update_card_status(card_id: int, liked: bool = False):
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        if liked:
+            cur.execute("""UPDATE cards SET 
+                            times_shown = times_shown + 1,
+                            like_count = like_count + 1
+                            WHERE id = %s;""",
+                            (card_id,))
+        else:
+            cur.execute("""UPDATE cards SET 
+                            times_shown = times_shown + 1
+                            WHERE id = %s;""",
+                            (card_id,))
+
+        conn.commit()
+
+@tracing.traced("db.create_session_cards")
+def create_session_cards(session_id: int, card_ids: list) -> list:
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Cards already recorded for the session are skipped (unique session_id, card_id)
+        cur.execute("""INSERT INTO session_cards (session_id, card_id)
+                       SELECT %s, card_id FROM unnest(%s::int[]) WITH ORDINALITY AS t(card_id, ord)
+                       ORDER BY ord
+                       ON CONFLICT (session_id, card_id) DO NOTHING
+                       RETURNING id;""",
+                    (session_id, list(card_ids)))
+        session_card_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    return session_card_ids
+
+@tracing.traced("db.update_session_card")
+def update_session_card(session_id:int , card_id: int, feedback_text: str = None):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""UPDATE session_cards SET 
+                            feedback_text = %s,
+                            ended_at = NOW()
+                            WHERE session_id = %s AND card_id = %s;""",
+                            (feedback_text, session_id, card_id))
+
+        conn.commit()
+
+CARD_COUNTER_MODE = os.getenv('CARD_COUNTER_MODE', 'events')  # 'events' appends to card_events, 'direct' updates cards
+COMPACTION_BATCH_SIZE = int(os.getenv('COMPACTION_BATCH_SIZE', 10000))  # card_events folded per statement
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 5000))  # exhausted cards moved per statement
+ARCHIVE_GRACE_MINUTES = int(os.getenv('ARCHIVE_GRACE_MINUTES', 60))  # quiet time before a card is archived
+
+@tracing.traced("db.apply_feedback_batch")
+def apply_feedback_batch(card_counts: list, session_endings: list) -> tuple:
+    """
+    Apply merged swipe feedback in one statement and one transaction.
 
-    conn = connect_db()
-    cur = conn.cursor()
+    With CARD_COUNTER_MODE 'events' the card increments are appended to
+    card_events (folded into cards later by compact_card_events) so swipes on
+    a popular card never wait on its row lock; 'direct' updates cards in place.
 
-    for card_id in card_ids:
-        cur.execute("INSERT INTO session_cards (session_id, card_id, created_at) VALUES (%s, %s, NOW()) RETURNING id;",
-                     (session_id, card_id))
-    conn.commit()
-    conn.close()
+    Args:
+        card_counts: (card_id, times_shown increment, like_count increment) tuples.
+        session_endings: (session_id, card_id, feedback_text, ended_at) tuples.
 
-def update_session_card(session_id:int , card_id: int, feedback_text: str = None):
-    print('updating session card ...')
+    Returns:
+        (cards_updated, session_cards_updated)
+    """
+    # Lock rows in id order so concurrent flushes cannot deadlock each other
+    card_counts = sorted(card_counts)
+    session_endings = sorted(session_endings, key=lambda e: (e[0], e[1]))
+    if CARD_COUNTER_MODE == 'events':
+        card_statement = """
+        INSERT INTO card_events (card_id, combination_hash, shown, likes)
+        SELECT v.card_id, c.combination_hash, v.shown, v.likes
+        FROM unnest(%s::int[], %s::int[], %s::int[]) AS v(card_id, shown, likes)
+        JOIN cards c ON c.id = v.card_id
+        RETURNING card_id AS id
+        """
+    else:
+        card_statement = """
+        UPDATE cards c SET
+            times_shown = c.times_shown + v.shown,
+            like_count = c.like_count + v.likes
+        FROM unnest(%s::int[], %s::int[], %s::int[]) AS v(card_id, shown, likes)
+        WHERE c.id = v.card_id
+        RETURNING c.id
+        """
+    query = """
+    WITH card_updates AS (""" + card_statement + """),
+    session_updates AS (
+        UPDATE session_cards sc SET
+            feedback_text = v.feedback_text,
+            ended_at = v.ended_at
+        FROM unnest(%s::int[], %s::int[], %s::text[], %s::timestamp[]) AS v(session_id, card_id, feedback_text, ended_at)
+        WHERE sc.session_id = v.session_id AND sc.card_id = v.card_id
+        RETURNING sc.id
+    )
+    SELECT (SELECT COUNT(*) FROM card_updates), (SELECT COUNT(*) FROM session_updates)
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, ([c[0] for c in card_counts], [c[1] for c in card_counts], [c[2] for c in card_counts],
+                            [e[0] for e in session_endings], [e[1] for e in session_endings],
+                            [e[2] for e in session_endings], [e[3] for e in session_endings]))
+        updated = cur.fetchone()
+        conn.commit()
+    return updated
+
+@tracing.traced("db.compact_card_events")
+def compact_card_events(batch_size: int = COMPACTION_BATCH_SIZE) -> int:
+    """
+    Fold up to batch_size card_events rows into cards and delete them, atomically.
+    Rows locked by a concurrent compaction are skipped.
 
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("""UPDATE session_cards SET 
-                        feedback_text = %s,
-                        ended_at = NOW()
-                        WHERE session_id = %s AND card_id = %s;""",
-                        (feedback_text, session_id, card_id))
+    Returns:
+        folded (int): number of events folded.
+    """
+    query = """
+    WITH moved AS (
+        DELETE FROM card_events
+        WHERE id IN (SELECT id FROM card_events ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING card_id, shown, likes
+    ),
+    folded AS (
+        SELECT card_id, SUM(shown) AS shown, SUM(likes) AS likes, COUNT(*) AS events
+        FROM moved
+        GROUP BY card_id
+    ),
+    updated AS (
+        UPDATE cards c SET
+            times_shown = c.times_shown + f.shown,
+            like_count = c.like_count + f.likes
+        FROM folded f
+        WHERE c.id = f.card_id
+    )
+    SELECT COALESCE(SUM(events), 0) FROM folded
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, (batch_size,))
+        folded = cur.fetchone()[0]
+        conn.commit()
+    return int(folded)
+
+@tracing.traced("db.archive_exhausted_cards")
+def archive_exhausted_cards(batch_size: int = ARCHIVE_BATCH_SIZE, policy: int = 5,
+                            grace_minutes: int = ARCHIVE_GRACE_MINUTES) -> int:
+    """
+    Move up to batch_size exhausted cards (times_shown >= policy) from cards
+    to archived_cards in one statement.
 
-    conn.commit()
-    conn.close()
+    Only cards with no swipes waiting in card_events and not served to a
+    session for grace_minutes are taken, so late feedback still lands on
+    the live row and counts are final when a card is archived. Rows locked
+    by a concurrent run are skipped.
 
+    Returns:
+        archived (int): number of cards moved.
+    """
+    query = """
+    WITH victims AS (
+        SELECT c.id
+        FROM cards c
+        WHERE c.times_shown >= %(policy)s
+          AND NOT EXISTS (SELECT 1 FROM card_events e WHERE e.card_id = c.id)
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.card_id = c.id AND sc.created_at > NOW() - %(grace)s * INTERVAL '1 minute')
+        ORDER BY c.id
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    moved AS (
+        DELETE FROM cards c
+        USING victims v
+        WHERE c.id = v.id
+        RETURNING c.id, c.card_data, c.combination_name, c.combination_hash, c.created_at,
+                  c.like_count, c.times_shown, c.last_time_shown
+    )
+    INSERT INTO archived_cards (id, card_data, combination_name, combination_hash, created_at,
+                                like_count, times_shown, last_time_shown)
+    SELECT * FROM moved
+    ON CONFLICT (id) DO NOTHING
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, {"policy": policy, "grace": grace_minutes, "batch_size": batch_size})
+        archived = cur.rowcount
+        conn.commit()
+    return archived
+
+@tracing.traced("db.get_dynamics")
 def get_dynamics() -> list:
-    print('getting dynamics ...')
-
     query = "SELECT id, name, title, description FROM dynamics ORDER BY id"
     rows = query_to_list(query, (), one=False)
     return rows
 
+@tracing.traced("db.get_prompt_templates")
 def get_prompt_templates(selection_key: str, selection_value: str) -> list:
-    print('getting prompt templates ...')
-
     # Convert booleans to lowercase strings if needed (for consistent storage)
     if isinstance(selection_value, bool):
         selection_value = str(selection_value).lower()
@@ -205,13 +722,119 @@ def get_prompt_templates(selection_key: str, selection_value: str) -> list:
     rows = query_to_list(query, (selection_key, selection_value), one=False)
     return rows
 
+@tracing.traced("db.get_system_prompt_templates")
 def get_system_prompt_templates() -> list:
-    print('getting system prompt templates ...')
-
     query = "SELECT selection_value FROM prompt_templates WHERE selection_key = %s"
     rows = query_to_list(query, ("base",), one=False)
     return rows
+@tracing.traced("db.get_recent_combinations")
+def get_recent_combinations(policy: int = 5, since_hours: int = 24) -> list:
+    """
+    Combinations requested by sessions in the last since_hours, with their fresh card stock.
+    """
+    query = """
+    SELECT recent.selection_hash, recent.selection_name, recent.selection,
+           (SELECT COUNT(*) FROM live_cards(recent.selection_hash) c
+            WHERE c.times_shown < %s) AS stock
+    FROM (
+        SELECT DISTINCT ON (selection_hash) selection_hash, selection_name, selection
+        FROM sessions
+        WHERE created_at > NOW() - %s * INTERVAL '1 hour'
+        ORDER BY selection_hash, created_at DESC
+    ) recent
+    """
+    rows = query_to_list(query, (policy, since_hours), one=False)
+    for row in rows:
+        row['selection'] = json.loads(row['selection'])
+    return rows
+
+@tracing.traced("db.get_combination_demand")
+def get_combination_demand(lookback_days: int = 7, window_hours: int = 2, policy: int = 5, top_n: int = 20) -> list:
+    """
+    Demand for the most served combinations of the last lookback_days, with their stock.
+
+    Per combination: sessions and sessions_recent (last window_hours), cards
+    served in total, in the last window_hours (served_recent) and in the
+    window_hours starting at this time of day on previous days
+    (served_same_window, summed over the days), plus fresh stock and the
+    servings it has left before retiring (servings_left).
+    """
+    query = """
+    WITH recent AS (
+        SELECT id, selection_hash, selection_name, selection, created_at
+        FROM sessions
+        WHERE created_at > NOW() - %(lookback_days)s * INTERVAL '1 day'
+    ),
+    served AS (
+        SELECT r.selection_hash,
+               COUNT(*) AS served,
+               COUNT(*) FILTER (WHERE sc.created_at > NOW() - %(window_hours)s * INTERVAL '1 hour') AS served_recent,
+               COUNT(*) FILTER (
+                   WHERE EXTRACT(EPOCH FROM NOW() - sc.created_at) >= 86400 - %(window_hours)s * 3600
+                   AND MOD(EXTRACT(EPOCH FROM NOW() - sc.created_at)::numeric, 86400) >= 86400 - %(window_hours)s * 3600
+               ) AS served_same_window
+        FROM recent r
+        JOIN session_cards sc ON sc.session_id = r.id AND NOT sc.reserved
+        GROUP BY r.selection_hash
+    ),
+    combinations AS (
+        SELECT DISTINCT ON (selection_hash) selection_hash, selection_name, selection,
+               COUNT(*) OVER (PARTITION BY selection_hash) AS sessions,
+               COUNT(*) FILTER (WHERE created_at > NOW() - %(window_hours)s * INTERVAL '1 hour')
+                   OVER (PARTITION BY selection_hash) AS sessions_recent
+        FROM recent
+        ORDER BY selection_hash, created_at DESC
+    )
+    SELECT c.selection_hash, c.selection_name, c.selection, c.sessions, c.sessions_recent,
+           COALESCE(s.served, 0) AS served, COALESCE(s.served_recent, 0) AS served_recent,
+           COALESCE(s.served_same_window, 0) AS served_same_window,
+           stock.stock, stock.servings_left
+    FROM combinations c
+    LEFT JOIN served s ON s.selection_hash = c.selection_hash
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS stock, COALESCE(SUM(%(policy)s - l.times_shown), 0) AS servings_left
+        FROM live_cards(c.selection_hash) l
+        WHERE l.times_shown < %(policy)s
+    ) stock
+    ORDER BY COALESCE(s.served, 0) DESC, c.sessions DESC
+    LIMIT %(top_n)s
+    """
+    rows = query_to_list(query, {"lookback_days": lookback_days, "window_hours": window_hours,
+                                 "policy": policy, "top_n": top_n}, one=False)
+    for row in rows:
+        row['selection'] = json.loads(row['selection'])
+        row['servings_left'] = int(row['servings_left'])
+    return rows
+
+@tracing.traced("db.insert_prewarm_report")
+def insert_prewarm_report(report: dict) -> int:
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO prewarm_reports (token_budget, tokens_planned, cards_created, projected_hit_rate, report)
+                       VALUES (%s, %s, %s, %s, %s) RETURNING id""",
+                    (report['token_budget'], report['tokens_planned'], report['cards_created'],
+                     report['projected_hit_rate'], json.dumps(report, default=str)))
+        report_id = cur.fetchone()[0]
+        conn.commit()
+    return report_id
+
+@tracing.traced("db.load_catalog")
+def load_catalog() -> dict:
+    """
+    Load every prompt template and dynamic in a single round trip.
+    """
+    query = """
+    SELECT
+        (SELECT COALESCE(json_agg(t ORDER BY t.template_order NULLS LAST, t.id), '[]'::json)
+         FROM prompt_templates t) AS prompt_templates,
+        (SELECT COALESCE(json_agg(d ORDER BY d.id), '[]'::json)
+         FROM (SELECT id, name, title, description FROM dynamics) d) AS dynamics
+    """
+    return query_to_list(query, (), one=True)
+
 if __name__ == "__main__":
+    from utils import load_env
+    load_env()
 
     r = get_prompt_templates("hot", True)
     print(r)
@@ -0,0 +1,216 @@
+"""
+Near-duplicate detection for generated cards.
+
+Each combination gets a MinHash/LSH index of the cards already stored for
+it (live and archived). Texts are normalized (lowercase, no accents or
+punctuation, common Spanish function words dropped) and cut into character
+shingles; the MinHash signature is split into bands, and cards sharing a
+band bucket are candidates whose shingle sets are then compared exactly.
+Generation checks every streamed card against the index and against the
+cards accepted earlier in the same run, and drops the ones at or above
+DEDUP_THRESHOLD Jaccard similarity before they are inserted.
+
+Indexes are built on first use from the database and caught up
+incrementally (cards with a higher id) at the start of every generation.
+"""
+import os
+import re
+import time
+import zlib
+import random
+import threading
+import unicodedata
+from collections import OrderedDict
+import db_operations as db
+import llm_operations as llm
+
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', 0.6))  # Jaccard similarity counted as a duplicate
+DEDUP_SHINGLE_SIZE = int(os.getenv('DEDUP_SHINGLE_SIZE', 4))  # characters per shingle
+DEDUP_NUM_PERM = int(os.getenv('DEDUP_NUM_PERM', 64))  # MinHash signature length
+DEDUP_BANDS = int(os.getenv('DEDUP_BANDS', 16))  # LSH bands, DEDUP_NUM_PERM must be a multiple
+DEDUP_INDEX_SIZE = int(os.getenv('DEDUP_INDEX_SIZE', 128))  # combination indexes kept per worker
+
+STOPWORDS = frozenset(("el la los las un una unos unas de del al a en y o que es se lo le les tu tus te "
+                       "mi mis me su sus con por para como mas pero si no ya muy este esta eso esa").split())
+
+# One random 32-bit mask per signature position, XORed into the shingle
+# hashes: cheaper than (a * x + b) mod p permutations, and the LSH only picks
+# candidates, which are then compared exactly. Fixed seed so every worker
+# computes the same signatures.
+_rng = random.Random(1234)
+_MASKS = [_rng.getrandbits(32) for _ in range(DEDUP_NUM_PERM)]
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = [word for word in re.split(r'[^a-z0-9]+', text) if word and word not in STOPWORDS]
+    return " ".join(words)
+
+def shingles(text: str, size: int = DEDUP_SHINGLE_SIZE) -> frozenset:
+    """
+    Hashed character shingles of the normalized text.
+    """
+    normalized = normalize_text(text)
+    if len(normalized) <= size:
+        return frozenset((zlib.crc32(normalized.encode()),))
+    return frozenset(zlib.crc32(normalized[i:i + size].encode()) for i in range(len(normalized) - size + 1))
+
+def signature(shingle_hashes: frozenset) -> tuple:
+    return tuple([min(map(mask.__xor__, shingle_hashes)) for mask in _MASKS])
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class MinHashIndex:
+    """
+    LSH index over one combination's cards, keyed by card id.
+    """
+    def __init__(self, bands: int = DEDUP_BANDS, threshold: float = DEDUP_THRESHOLD):
+        self.bands = bands
+        self.rows = DEDUP_NUM_PERM // bands
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._shingles = {}
+        self.max_id = 0  # highest card id loaded from the database
+
+    def _band_keys(self, sig: tuple) -> list:
+        return [(band, sig[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def __len__(self):
+        return len(self._shingles)
+
+    def add(self, key, text: str = None, card_shingles: frozenset = None):
+        card_shingles = card_shingles if card_shingles is not None else shingles(text)
+        band_keys = self._band_keys(signature(card_shingles))
+        with self._lock:
+            if key in self._shingles:
+                return
+            self._shingles[key] = card_shingles
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, []).append(key)
+
+    def query(self, text: str = None, card_shingles: frozenset = None):
+        """
+        Most similar indexed card at or above the threshold.
+
+        Returns:
+            match (tuple): (key, similarity), or None when there is no near-duplicate.
+        """
+        card_shingles = card_shingles if card_shingles is not None else shingles(text)
+        band_keys = self._band_keys(signature(card_shingles))
+        best = None
+        with self._lock:
+            candidates = {key for band_key in band_keys for key in self._buckets.get(band_key, ())}
+            for key in candidates:
+                similarity = jaccard(card_shingles, self._shingles[key])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (key, similarity)
+        return best
+
+class DedupIndex:
+    """
+    Bounded LRU of per-combination MinHashIndex objects, loaded and caught
+    up from the database through `loader(combination_hash, after_id)`.
+    """
+    def __init__(self, loader=None, max_size: int = DEDUP_INDEX_SIZE):
+        self._loader = loader
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._metrics = {"checked": 0, "accepted": 0, "rejected_stored": 0, "rejected_batch": 0,
+                         "check_ms_total": 0.0, "check_ms_max": 0.0, "indexed_cards": 0}
+
+    def get(self, combination_hash: str) -> MinHashIndex:
+        with self._lock:
+            index = self._indexes.get(combination_hash)
+            if index is None:
+                index = self._indexes[combination_hash] = MinHashIndex()
+                if len(self._indexes) > self.max_size:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(combination_hash)
+        loader = self._loader or db.get_card_texts
+        before = len(index)
+        for card in loader(combination_hash, index.max_id):
+            index.add(card['id'], card['card_data'])
+            index.max_id = max(index.max_id, card['id'])
+        with self._lock:
+            self._metrics["indexed_cards"] += len(index) - before
+        return index
+
+    def checker(self, combination_hash: str) -> "CardChecker":
+        return CardChecker(self, self.get(combination_hash))
+
+    def _record(self, outcome: str, elapsed_ms: float):
+        with self._lock:
+            self._metrics["checked"] += 1
+            self._metrics[outcome] += 1
+            self._metrics["check_ms_total"] += elapsed_ms
+            self._metrics["check_ms_max"] = max(self._metrics["check_ms_max"], elapsed_ms)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["combinations"] = len(self._indexes)
+        snapshot["duplicate_rate"] = (round((snapshot["rejected_stored"] + snapshot["rejected_batch"])
+                                            / snapshot["checked"], 4) if snapshot["checked"] else 0.0)
+        snapshot["check_ms_avg"] = (round(snapshot["check_ms_total"] / snapshot["checked"], 4)
+                                    if snapshot["checked"] else 0.0)
+        return snapshot
+
+class CardChecker:
+    """
+    One generation's view of a combination: its stored cards plus the cards
+    accepted so far in this run.
+    """
+    def __init__(self, dedup_index: DedupIndex, index: MinHashIndex):
+        self._dedup_index = dedup_index
+        self.index = index
+        self.batch = MinHashIndex(threshold=index.threshold)
+        self._pending = 0
+
+    def accept(self, text: str) -> bool:
+        """
+        True if text is not a near-duplicate; accepted texts are remembered
+        for the rest of the run.
+        """
+        start = time.perf_counter()
+        card_shingles = shingles(text)
+        if self.index.query(card_shingles=card_shingles):
+            outcome = "rejected_stored"
+        elif self.batch.query(card_shingles=card_shingles):
+            outcome = "rejected_batch"
+        else:
+            outcome = "accepted"
+            self.batch.add(("pending", self._pending), card_shingles=card_shingles)
+            self._pending += 1
+        self._dedup_index._record(outcome, (time.perf_counter() - start) * 1000)
+        return outcome == "accepted"
+
+    def stored(self, card_ids: list, texts: list):
+        """
+        Add inserted cards to the shared index under their ids.
+        """
+        for card_id, text in zip(card_ids, texts):
+            self.index.add(card_id, text)
+
+dedup_index = DedupIndex()
+
+def get_dedup_metrics() -> dict:
+    """
+    Duplicate checks plus effective cards per 1k LLM tokens (accepted cards
+    over all prompt and completion tokens spent by this worker).
+    """
+    metrics = dedup_index.metrics()
+    llm_metrics = llm.get_llm_metrics()
+    tokens = llm_metrics["prompt_tokens"] + llm_metrics["completion_tokens"]
+    metrics["effective_cards_per_1k_tokens"] = round(metrics["accepted"] * 1000 / tokens, 3) if tokens else 0.0
+    return metrics
@@ -0,0 +1,189 @@
+"""
+Write-behind buffer for swipe feedback.
+
+Each like/next becomes an in-memory event; events are merged per card and
+flushed as a single bulk statement (db.apply_feedback_batch) once
+FEEDBACK_FLUSH_SIZE events are pending or FEEDBACK_FLUSH_INTERVAL seconds
+have passed, and once more when the worker shuts down.
+
+Ordering rules:
+- times_shown / like_count increments are commutative, so merging them per
+  card and applying them in any order gives the same totals as one UPDATE
+  per swipe.
+- For a (session_id, card_id) pair the last event received by this worker
+  wins: its feedback_text and its ended_at, which is stamped when the event
+  arrives rather than at flush time.
+- Workers flush independently; there is no ordering between events buffered
+  in different workers, and readers see counts up to one flush interval late.
+- A failed flush puts its events back into the buffer and is retried on the
+  next flush, up to FEEDBACK_MAX_RETRIES flushes in a row; then, or at once
+  when the batch itself is invalid (a data or type error), its events are
+  logged and dropped so they cannot block later swipes. Events still
+  buffered when the process is killed without a clean shutdown are lost.
+"""
+import os
+import atexit
+import logging
+import threading
+import traceback
+from datetime import datetime
+import psycopg2
+import db_operations as db
+
+FEEDBACK_BUFFER_ENABLED = os.getenv('FEEDBACK_BUFFER_ENABLED', 'true').lower() == 'true'
+FEEDBACK_FLUSH_SIZE = int(os.getenv('FEEDBACK_FLUSH_SIZE', 200))  # pending events that trigger a flush
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv('FEEDBACK_FLUSH_INTERVAL', 2.0))  # max seconds an event waits
+FEEDBACK_MAX_RETRIES = int(os.getenv('FEEDBACK_MAX_RETRIES', 10))  # failed flushes in a row before dropping
+
+# Errors that retrying the same batch cannot fix
+DATA_ERRORS = (psycopg2.DataError, TypeError, ValueError)
+
+def parse_id(value):
+    """
+    A positive int4 id from an int or a string of digits, else None.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.strip().isdecimal():
+        value = int(value)
+    if isinstance(value, int) and 0 < value < 2 ** 31:
+        return value
+    return None
+
+def merge_events(events: list) -> tuple:
+    """
+    Fold swipe events into per-card increments and per-(session, card) endings.
+
+    Returns:
+        (card_counts, session_endings): {card_id: [shown, likes]} and
+        {(session_id, card_id): (feedback_text, ended_at)}.
+    """
+    now = datetime.utcnow()
+    card_counts = {}
+    session_endings = {}
+    for event in events:
+        counts = card_counts.setdefault(event['card_id'], [0, 0])
+        counts[0] += 1
+        counts[1] += 1 if event.get('liked') else 0
+        if event.get('session_id') is not None:
+            session_endings[(event['session_id'], event['card_id'])] = (event.get('feedback_text'), now)
+    return card_counts, session_endings
+
+def _as_rows(card_counts: dict, session_endings: dict) -> tuple:
+    return ([(card_id, shown, likes) for card_id, (shown, likes) in card_counts.items()],
+            [(session_id, card_id, text, ended_at) for (session_id, card_id), (text, ended_at) in session_endings.items()])
+
+class FeedbackBuffer:
+    def __init__(self, writer=db.apply_feedback_batch, flush_size: int = FEEDBACK_FLUSH_SIZE,
+                 flush_interval: float = FEEDBACK_FLUSH_INTERVAL):
+        self._writer = writer
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._card_counts = {}  # card_id -> [shown, likes]
+        self._session_endings = {}  # (session_id, card_id) -> (feedback_text, ended_at)
+        self._pending_events = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._consecutive_failures = 0
+        self._metrics = {"events": 0, "flushes": 0, "flush_failures": 0, "rows_written": 0, "dropped_events": 0}
+
+    def _merge(self, card_counts: dict, session_endings: dict, events: int, requeued: bool = False):
+        # Caller holds self._lock
+        for card_id, (shown, likes) in card_counts.items():
+            counts = self._card_counts.setdefault(card_id, [0, 0])
+            counts[0] += shown
+            counts[1] += likes
+        for key, ending in session_endings.items():
+            if requeued:
+                # Events put back after a failed flush are older than anything received since
+                self._session_endings.setdefault(key, ending)
+            else:
+                self._session_endings[key] = ending
+        self._pending_events += events
+
+    def add(self, card_id: int, liked: bool = False, session_id: int = None, feedback_text: str = None):
+        self.add_many([{"card_id": card_id, "liked": liked, "session_id": session_id,
+                        "feedback_text": feedback_text}])
+
+    def add_many(self, events: list):
+        card_counts, session_endings = merge_events(events)
+        with self._lock:
+            self._merge(card_counts, session_endings, len(events))
+            self._metrics["events"] += len(events)
+            should_flush = self._pending_events >= self.flush_size
+
+        self._ensure_started()
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write everything buffered so far. Returns the number of events flushed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending_events:
+                    return 0
+                card_counts, self._card_counts = self._card_counts, {}
+                session_endings, self._session_endings = self._session_endings, {}
+                events, self._pending_events = self._pending_events, 0
+
+            try:
+                updated = self._writer(*_as_rows(card_counts, session_endings))
+            except Exception as e:
+                logging.error(traceback.format_exc())
+                with self._lock:
+                    self._metrics["flush_failures"] += 1
+                    self._consecutive_failures += 1
+                    if isinstance(e, DATA_ERRORS) or self._consecutive_failures >= FEEDBACK_MAX_RETRIES:
+                        self._consecutive_failures = 0
+                        self._metrics["dropped_events"] += events
+                        logging.error(f"Dropping {events} feedback events after flush error: {e}; "
+                                      f"card counts {card_counts}")
+                    else:
+                        logging.error(f"Error flushing {events} feedback events, will retry: {e}")
+                        self._merge(card_counts, session_endings, events, requeued=True)
+                return 0
+
+            with self._lock:
+                self._consecutive_failures = 0
+                self._metrics["flushes"] += 1
+                self._metrics["rows_written"] += sum(updated)
+            return events
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="feedback-flush", daemon=True)
+                self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["pending_events"] = self._pending_events
+        return snapshot
+
+feedback_buffer = FeedbackBuffer()
+atexit.register(feedback_buffer.close)
+
+def record_feedback(events: list):
+    """
+    Record swipe events, buffered or written straight through depending on FEEDBACK_BUFFER_ENABLED.
+    """
+    if FEEDBACK_BUFFER_ENABLED:
+        feedback_buffer.add_many(events)
+        return
+
+    db.apply_feedback_batch(*_as_rows(*merge_events(events)))
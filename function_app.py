@@ -1,16 +1,51 @@
+import os
 import json
+import threading
 import traceback
 import azure.functions as func
+from utils import generate_hash_str, load_env
+
+# Settings from .env must be in place before the modules below read them at import
+load_env()
+
 # from requests import options
 import db_operations as db
 import llm_operations as llm
-from utils import generate_hash_str
+import replenishment
+import prewarm
+import dedup
+import feedback_buffer
+import session_tokens
+import tracing
+from cache_operations import catalog, prompt_cache, invalidate_catalog
 import logging
 
+WARMUP_ON_IMPORT = os.getenv('WARMUP_ON_IMPORT', 'false').lower() in ('1', 'true', 'yes')
+
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
+
+def warm_up():
+    """
+    Open the database pool and load the catalog ahead of the first request.
+    """
+    try:
+        db.get_pool()
+        catalog.get_dynamics()
+    except Exception as e:
+        logging.error(f"Warm-up failed: {e}")
+
+if WARMUP_ON_IMPORT:
+    # Overlaps connection setup with the rest of the host start-up
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.warm_up_trigger(arg_name="warmup")
+def warmup(warmup: func.warmup.WarmUpContext) -> None:
+    logging.info('Warm-up trigger fired.')
+    warm_up()
         
 
 @app.route(route="create_session", methods=["POST"])
+@tracing.traced("http.create_session")
 def create_session(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
@@ -27,13 +62,18 @@ def create_session(req: func.HttpRequest) -> func.HttpResponse:
         
         selection_hash = generate_hash_str(selection_name)
         logging.info(f"Received selections: {selection_name} with selections {selections}")
-        session_id = db.start_session(selections, selection_name, selection_hash)
-        sys, user =  llm.format_prompt_templates(selections)
+        response = {}
+        if session_tokens.tokens_enabled():
+            session_id, response['session_token'] = session_tokens.start_session(selections, selection_name, selection_hash)
+        else:
+            session_id = db.start_session(selections, selection_name, selection_hash)
+        sys, user =  llm.get_prompt(selections, selection_hash)
         logging.info(f"Started session with ID: {session_id}")
 
-        return func.HttpResponse(json.dumps({"session_id": session_id, 
-                                             "system_message": sys,
-                                             "user_message": user}), 
+        response.update({"session_id": session_id,
+                         "system_message": sys,
+                         "user_message": user})
+        return func.HttpResponse(json.dumps(response), 
                                  status_code=200, 
                                  mimetype="application/json")  
     
@@ -42,12 +82,77 @@ def create_session(req: func.HttpRequest) -> func.HttpResponse:
          status_code=200
     )
 
+MAX_PAGE_SIZE = 50
+
+def _verify_session_token(req: func.HttpRequest, session_id: str):
+    """
+    Returns (token_session, error_response); both are None when no token was sent.
+    """
+    token = req.params.get('token') or req.headers.get('X-Session-Token')
+    if not token:
+        return None, None
+    token_session = session_tokens.verify_token(token)
+    if token_session is None or str(token_session['id']) != session_id:
+        return None, func.HttpResponse(
+            "Invalid session token.",
+            status_code=401
+        )
+    return token_session, None
+
+def _feedback_session(req: func.HttpRequest, req_body: dict, session_id: int):
+    """
+    Session id that feedback is recorded under, from the session_token body
+    field or the X-Session-Token header. With tokens enabled, a session_id
+    sent without a valid token for that session is rejected.
+
+    Returns (session_id, error_response).
+    """
+    token = req_body.get('session_token') or req.headers.get('X-Session-Token')
+    if not token:
+        if session_id is not None and session_tokens.tokens_enabled():
+            return None, func.HttpResponse("A session token is required.", status_code=401)
+        return session_id, None
+    token_session = session_tokens.verify_token(token)
+    if token_session is None or (session_id is not None and token_session['id'] != session_id):
+        return None, func.HttpResponse("Invalid session token.", status_code=401)
+    return token_session['id'], None
+
+def _draw_with_stock(draw, refill: func.Out[str]) -> dict:
+    """
+    Run a draw, generating synchronously only when the session has no fresh
+    cards left to be dealt and enqueueing a refill when the cards it has not
+    seen are below the low-water mark.
+    """
+    result = draw()
+    if result is None:
+        return None
+    session_info = result['session']
+    available_cards = result['unseen']
+    logging.info(f"Retrieved session info: {session_info['selection_name']}")
+    logging.info(f"Retrieved session cards, {available_cards} unseen cards left of {result['stock']} in stock")
+
+    # Nothing was dealt (for a page: nothing could be reserved after it) and nothing is left
+    if available_cards == 0 and not result.get('has_more', result['cards']):
+        logging.info("No unseen cards in stock, generating new cards...")
+        replenishment.ensure_stock(session_info['selection'],
+                                   session_info['selection_hash'],
+                                   session_info['selection_name'],
+                                   priority=llm.PRIORITY_INTERACTIVE,
+                                   session_id=session_info['id'])
+        result = draw()
+    if available_cards < replenishment.REPLENISH_LOW_WATER:
+        logging.info("Stock below low-water mark, enqueueing refill...")
+        replenishment.enqueue_refill(session_info, out=refill)
+    return result
+
 @app.route(route="get_cards/{session_id}", methods=["GET"])
-def get_cards(req: func.HttpRequest) -> func.HttpResponse:
+@app.queue_output(arg_name="refill", queue_name=replenishment.REPLENISH_QUEUE, connection="AzureWebJobsStorage")
+@tracing.traced("http.get_cards")
+def get_cards(req: func.HttpRequest, refill: func.Out[str]) -> func.HttpResponse:
     """         """
     logging.info('Python HTTP trigger function processed a request.')
     SAMPLE_SIZE = 10
-    LIFETIME_POLICY = 5  # max times a card can be shown before being retired
+    LIFETIME_POLICY = replenishment.LIFETIME_POLICY  # max times a card can be shown before being retired
     session_id = req.route_params.get('session_id')
 
     if not session_id:
@@ -56,31 +161,31 @@ def get_cards(req: func.HttpRequest) -> func.HttpResponse:
             status_code=400
         )
     else:
+        token_session, error = _verify_session_token(req, session_id)
+        if error:
+            return error
 
         try:
-            session_info = db.get_session(session_id)
-            logging.info(f"Retrieved session info: {session_info['selection_name']}")
-            available_cards = db.get_cards_by_hash(session_info['selection_hash'], policy=LIFETIME_POLICY)
-            logging.info(f"Retrieved session cards with {len(available_cards)} cards")
-
-            if len(available_cards) < SAMPLE_SIZE:
-                logging.info("Not enough cards found, generating new cards...")
-                generated_cards = llm.generate_session_cards(session_info['selection'])
-                new_cards = [card['description'] for card in generated_cards]
-                card_ids = db.create_cards(new_cards, session_info['selection_hash'], session_info['selection_name'])
-                for card_id in card_ids:
-                    logging.info(f"Created new card with ID: {card_id}")
-            # else: 
-            session_cards = db.sample_cards_by_hash(session_info['selection_hash'], 
-                                                    sample_size=SAMPLE_SIZE,
-                                                    policy=LIFETIME_POLICY)
-            
-            db.create_session_cards(session_id, 
-                                    [card['id'] for card in session_cards],)
-            
+            draw = _draw_with_stock(lambda: db.draw_session_cards(session_id, sample_size=SAMPLE_SIZE,
+                                                                  policy=LIFETIME_POLICY, session=token_session),
+                                    refill)
+            if draw is None:
+                return func.HttpResponse(
+                    f"Session {session_id} not found.",
+                    status_code=404
+                )
+
+            session_cards = draw['cards']
+
             return func.HttpResponse(json.dumps(session_cards), 
                                         status_code=200, 
                                         mimetype="application/json")
+        except llm.LLMUnavailable as e:
+            logging.error(f"Card generation unavailable: {e}")
+            return func.HttpResponse(
+                "Card generation is temporarily unavailable, please retry.",
+                status_code=503
+            )
         except Exception as e:
             logging.error(f"Error retrieving or generating cards: {e}")
             logging.error(traceback.format_exc())
@@ -88,8 +193,126 @@ def get_cards(req: func.HttpRequest) -> func.HttpResponse:
                 f"Error processing request: {e}",
                 status_code=500
             )
-        
+
+@app.route(route="get_cards/{session_id}/next", methods=["GET"])
+@app.queue_output(arg_name="refill", queue_name=replenishment.REPLENISH_QUEUE, connection="AzureWebJobsStorage")
+@tracing.traced("http.get_next_cards")
+def get_next_cards(req: func.HttpRequest, refill: func.Out[str]) -> func.HttpResponse:
+    """
+    Continuation of a session's deck: returns the page named by `cursor`
+    (the first page when omitted) with a cursor for the page after it.
+    Cards the session has already been dealt are never repeated.
+    """
+    logging.info('Next cards endpoint hit.')
+    session_id = req.route_params.get('session_id')
+
+    token_session, error = _verify_session_token(req, session_id)
+    if error:
+        return error
+
+    page = 1
+    cursor = req.params.get('cursor')
+    if cursor:
+        claims = session_tokens.verify_cursor(cursor)
+        if claims is None or str(claims['sid']) != session_id:
+            return func.HttpResponse(
+                "Invalid cursor.",
+                status_code=400
+            )
+        page = claims['page']
+
+    try:
+        page_size = min(max(int(req.params.get('page_size', 10)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return func.HttpResponse(
+            "page_size must be an integer.",
+            status_code=400
+        )
+
+    try:
+        result = _draw_with_stock(lambda: db.next_session_page(session_id, page, page_size=page_size,
+                                                               policy=replenishment.LIFETIME_POLICY,
+                                                               session=token_session),
+                                  refill)
+        if result is None:
+            return func.HttpResponse(
+                f"Session {session_id} not found.",
+                status_code=404
+            )
+
+        return func.HttpResponse(json.dumps({"cards": result['cards'],
+                                             "page": result['page'],
+                                             "has_more": result['has_more'],
+                                             "next_cursor": session_tokens.issue_cursor(int(session_id), page + 1)}),
+                                 status_code=200,
+                                 mimetype="application/json")
+    except llm.LLMUnavailable as e:
+        logging.error(f"Card generation unavailable: {e}")
+        return func.HttpResponse(
+            "Card generation is temporarily unavailable, please retry.",
+            status_code=503
+        )
+    except Exception as e:
+        logging.error(f"Error retrieving next cards: {e}")
+        logging.error(traceback.format_exc())
+        return func.HttpResponse(
+            f"Error processing request: {e}",
+            status_code=500
+        )
+
+@app.queue_trigger(arg_name="msg", queue_name=replenishment.REPLENISH_QUEUE, connection="AzureWebJobsStorage")
+@tracing.traced("queue.replenish_cards")
+def replenish_cards(msg: func.QueueMessage) -> None:
+    logging.info('Card replenishment queue trigger processed a message.')
+
+    card_ids = replenishment.handle_refill_message(msg.get_body().decode('utf-8'))
+    logging.info(f"Replenishment created {len(card_ids)} cards")
+
+@app.timer_trigger(schedule="0 */10 * * * *", arg_name="timer", run_on_startup=False)
+@tracing.traced("timer.replenish_low_stock")
+def replenish_low_stock(timer: func.TimerRequest) -> None:
+    logging.info('Card replenishment timer trigger fired.')
+
+    refilled = replenishment.replenish_low_stock()
+    logging.info(f"Replenished {len(refilled)} combinations: {refilled}")
+
+@app.timer_trigger(schedule="0 45 * * * *", arg_name="timer", run_on_startup=False)
+@tracing.traced("timer.prewarm_popular")
+def prewarm_popular(timer: func.TimerRequest) -> None:
+    logging.info('Pre-warm timer trigger fired.')
+
+    report = prewarm.run_prewarm()
+    logging.info(f"Pre-warm report {report['report_id']}: {report['cards_created']} cards, "
+                 f"projected hit rate {report['projected_hit_rate']:.0%}")
+
+@app.timer_trigger(schedule="0 * * * * *", arg_name="timer", run_on_startup=False)
+@tracing.traced("timer.compact_card_events")
+def compact_card_events(timer: func.TimerRequest) -> None:
+    logging.info('Card events compaction timer trigger fired.')
+
+    total = 0
+    while True:
+        folded = db.compact_card_events()
+        total += folded
+        if folded < db.COMPACTION_BATCH_SIZE:
+            break
+    logging.info(f"Folded {total} card events into cards")
+
+@app.timer_trigger(schedule="0 */15 * * * *", arg_name="timer", run_on_startup=False)
+@tracing.traced("timer.archive_exhausted_cards")
+def archive_exhausted_cards(timer: func.TimerRequest) -> None:
+    logging.info('Card archival timer trigger fired.')
+
+    total = 0
+    while True:
+        archived = db.archive_exhausted_cards(policy=replenishment.LIFETIME_POLICY)
+        total += archived
+        if archived < db.ARCHIVE_BATCH_SIZE:
+            break
+    logging.info(f"Archived {total} exhausted cards")
+
 @app.route(route="update_card_status", methods=["POST"])
+@tracing.traced("http.update_card_status")
 def update_card_status(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
@@ -99,18 +322,28 @@ def update_card_status(req: func.HttpRequest) -> func.HttpResponse:
         pass
     else:
         session_id = req_body.get('session_id', None)
-        card_id = req_body.get('card_id')
+        card_id = feedback_buffer.parse_id(req_body.get('card_id'))
         liked = req_body.get('liked', None)
         disliked = req_body.get('disliked', None)
 
-        if not card_id:
+        if card_id is None:
             return func.HttpResponse(
-                "Please provide card_id.",
+                "Please provide card_id as a positive integer.",
                 status_code=400
             )
+        if session_id is not None:
+            session_id = feedback_buffer.parse_id(session_id)
+            if session_id is None:
+                return func.HttpResponse(
+                    "session_id must be a positive integer.",
+                    status_code=400
+                )
+
+        session_id, error = _feedback_session(req, req_body, session_id)
+        if error:
+            return error
 
-        db.update_card_status(card_id, liked=liked)
-        db.update_session_card(session_id, card_id)
+        feedback_buffer.record_feedback([{"session_id": session_id, "card_id": card_id, "liked": liked}])
 
         return func.HttpResponse(
             json.dumps({"status": "success"}),
@@ -123,15 +356,129 @@ def update_card_status(req: func.HttpRequest) -> func.HttpResponse:
         status_code=200
     )
 
+@app.route(route="update_card_status_batch", methods=["POST"])
+@tracing.traced("http.update_card_status_batch")
+def update_card_status_batch(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Batch card status endpoint hit.')
+
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        req_body = None
+
+    events = req_body.get('events') if isinstance(req_body, dict) else None
+    if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+        return func.HttpResponse(
+            "Please provide an events list where every event has a card_id.",
+            status_code=400
+        )
+
+    parsed = []
+    for e in events:
+        card_id = feedback_buffer.parse_id(e.get('card_id'))
+        session_id = e.get('session_id')
+        if session_id is not None:
+            session_id = feedback_buffer.parse_id(session_id)
+        if card_id is None or (e.get('session_id') is not None and session_id is None):
+            return func.HttpResponse(
+                "Every event needs card_id, and session_id when given, as positive integers.",
+                status_code=400
+            )
+        session_id, error = _feedback_session(req, req_body, session_id)
+        if error:
+            return error
+        parsed.append({"session_id": session_id,
+                       "card_id": card_id,
+                       "liked": e.get('liked', False),
+                       "feedback_text": e.get('feedback_text')})
+
+    feedback_buffer.record_feedback(parsed)
+
+    return func.HttpResponse(
+        json.dumps({"status": "success", "accepted": len(events)}),
+        status_code=200,
+        mimetype="application/json"
+    )
+
 @app.route(route="get_dynamics", methods=["GET"])
+@tracing.traced("http.get_dynamics")
 def get_dynamics(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Get dynamics endpoint hit.')
 
-    dynamics = db.get_dynamics()
-    logging.info(f"Retrieved dynamics: {dynamics}")
+    dynamics = catalog.get_dynamics()
+    logging.info(f"Retrieved {len(dynamics)} dynamics")
 
     return func.HttpResponse(
         json.dumps(dynamics),
         status_code=200,
         mimetype="application/json"
     )
+
+@app.route(route="inventory", methods=["GET"])
+@tracing.traced("http.inventory")
+def inventory(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Inventory endpoint hit.')
+
+    hashes = [h for h in req.params.get('hashes', '').split(',') if h]
+    if not hashes:
+        return func.HttpResponse(
+            "Please provide a comma-separated list of combination hashes.",
+            status_code=400
+        )
+
+    counts = db.count_fresh_cards_batch(hashes, policy=replenishment.LIFETIME_POLICY)
+
+    return func.HttpResponse(
+        json.dumps(counts),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.route(route="invalidate_cache", methods=["POST"])
+@tracing.traced("http.invalidate_cache")
+def invalidate_cache(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Invalidate cache endpoint hit.')
+
+    invalidate_catalog()
+
+    return func.HttpResponse(
+        json.dumps({"status": "success"}),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.route(route="metrics", methods=["GET"])
+@tracing.traced("http.metrics")
+def metrics(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Metrics endpoint hit.')
+
+    return func.HttpResponse(
+        json.dumps({"db_pool": db.get_pool_metrics(),
+                    "generation": replenishment.get_generation_metrics(),
+                    "llm": llm.get_llm_metrics(),
+                    "feedback": feedback_buffer.feedback_buffer.metrics(),
+                    "prompt_cache": prompt_cache.metrics(),
+                    "dedup": dedup.get_dedup_metrics(),
+                    "latency": tracing.get_metrics()}),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.route(route="traces", methods=["GET"])
+def traces(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Most recent finished spans, oldest first (empty unless TRACING_ENABLED is set).
+    """
+    try:
+        limit = int(req.params.get('limit', 100))
+    except ValueError:
+        return func.HttpResponse(
+            "limit must be an integer.",
+            status_code=400
+        )
+
+    return func.HttpResponse(
+        json.dumps(tracing.recent_spans(limit), default=str),
+        status_code=200,
+        mimetype="application/json"
+    )
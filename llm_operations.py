@@ -1,58 +1,416 @@
 import os
-import db_operations as db
 import logging
-from openai import AzureOpenAI
+import threading
+import time
 import json
-from dotenv import load_dotenv
+import heapq
+import queue
+import random
+import itertools
 import traceback
-import db_operations as db
+from email.utils import parsedate_to_datetime
+from cache_operations import catalog, prompt_cache
+from utils import generate_hash_str
+import tracing
 import re
 
-logging.basicConfig(level=logging.INFO)
-load_dotenv()
+# The openai SDK (and its httpx/pydantic stack) is imported on first use by
+# connect_llm, so endpoints that never call the LLM do not pay for it at cold start.
+
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))  # seconds for a whole completion
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 4))  # retries after 429/5xx/timeouts, done by the scheduler
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 20))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', 10))
+LLM_MAX_TOKENS = int(os.getenv('LLM_MAX_TOKENS', 1024))  # completion tokens per call
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))  # completions in flight per worker
+LLM_RPM = int(os.getenv('LLM_RPM', 0))  # requests per minute budget, 0 for none
+LLM_TPM = int(os.getenv('LLM_TPM', 0))  # tokens per minute budget, 0 for none
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 60))  # seconds a call may wait for a slot
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', 1))  # seconds, doubled per retry
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', 30))
+LLM_CARDS_PER_CALL = int(os.getenv('LLM_CARDS_PER_CALL', 10))  # cards one completion is asked for
+
+PRIORITY_INTERACTIVE = 0  # a user is waiting (get_cards with an empty deck)
+PRIORITY_BACKGROUND = 1  # refills and sweeps
+
+_call_timings = threading.local()
+_llm_metrics = {
+    "calls": 0,
+    "connections_opened": 0,
+    "connect_ms_total": 0.0,
+    "ttft_ms_total": 0.0,
+    "ttft_ms_max": 0.0,
+    "total_ms_total": 0.0,
+    "total_ms_max": 0.0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+}
+_llm_metrics_lock = threading.Lock()
+
+def _tracing_transport(**kwargs):
+    """
+    HTTP transport that times TCP connect + TLS handshake for the current call,
+    which is zero whenever a kept-alive connection is reused.
+    """
+    import httpx
+
+    class _TracingTransport(httpx.HTTPTransport):
+        def handle_request(self, request: httpx.Request) -> httpx.Response:
+            def trace(event_name, info):
+                if event_name == "connection.connect_tcp.started":
+                    _call_timings.connect_started = time.perf_counter()
+                elif event_name in ("connection.start_tls.complete", "connection.connect_tcp.complete") \
+                        and getattr(_call_timings, "connect_started", None) is not None:
+                    _call_timings.connect_ms = (time.perf_counter() - _call_timings.connect_started) * 1000
+
+            request.extensions["trace"] = trace
+            return super().handle_request(request)
+
+    return _TracingTransport(**kwargs)
 
 def connect_llm():
     """
     Connects to the Azure OpenAI service using the provided endpoint, model name, and subscription key.
-    
+
+    The client owns an HTTP connection pool with keep-alive, so it should be
+    created once and reused through get_llm_client().
+
     Returns:
         client (AzureOpenAI): An instance of the AzureOpenAI client.
     """
+    import httpx
+    from openai import AzureOpenAI
+
+    http_client = httpx.Client(
+        transport=_tracing_transport(limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                                         max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS)),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
     client = AzureOpenAI(
         api_version=os.environ['LLM_API_VERSION'],
         azure_endpoint=os.environ['LLM_ENDPOINT'],
         api_key=os.environ['LLM_KEY'],
+        max_retries=0,  # retried by the scheduler, which shares backoff across calls
+        http_client=http_client,
     )
     return client
 
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client():
+    """
+    Process-wide AzureOpenAI client, created on first use and shared by all threads.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = connect_llm()
+    return _client
+
+class LLMQueueTimeout(Exception):
+    pass
+
+class LLMUnavailable(Exception):
+    """
+    A completion failed before its stream started: no slot, retries
+    exhausted, or a request the service rejected.
+    """
+    pass
+
+def _status_code(error: Exception):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Rate limits, server errors, timeouts and dropped connections; not bad requests or auth failures.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    import openai
+    return isinstance(error, openai.APIConnectionError)  # includes APITimeoutError
+
+def _retry_after(error: Exception):
+    """
+    Seconds the service asked us to wait (retry-after-ms or Retry-After), or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+class Priority:
+    """
+    Priority shared by the LLM calls of one job, such as a generation's
+    fan-out, which a caller that starts waiting on the job can raise.
+    Accepted wherever a priority int is.
+    """
+    def __init__(self, lane: int):
+        self.lane = lane
+
+    def raise_to(self, lane: int):
+        if lane < self.lane:
+            self.lane = lane
+            scheduler.reprioritize()
+
+class LLMScheduler:
+    """
+    Admission control for completions in this worker.
+
+    Calls wait in priority lanes (lower first, FIFO within a lane) for one of
+    max_concurrency slots and for room in the sliding one-minute request and
+    token budgets. Failed requests are retried with full-jitter exponential
+    backoff, or after the Retry-After the service sent; a 429 also pauses
+    admission for every lane, since the quota is shared.
+    """
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rpm: int = LLM_RPM, tpm: int = LLM_TPM,
+                 max_retries: int = LLM_MAX_RETRIES, queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._window = []  # [admitted_at, tokens] for the last minute
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._metrics = {"admitted": 0, "retries": 0, "rate_limited": 0, "failed": 0, "queue_timeouts": 0,
+                         "budget_waits": 0, "queue_wait_ms_total": 0.0, "queue_wait_ms_max": 0.0}
+
+    def _admission_wait(self, now: float, tokens: int) -> float:
+        """
+        Seconds until a call needing `tokens` fits the pause and budgets (0 when it fits now).
+        """
+        if now < self._paused_until:
+            return self._paused_until - now
+        while self._window and self._window[0][0] <= now - 60:
+            self._window.pop(0)
+        wait = 0.0
+        if self.rpm and len(self._window) >= self.rpm:
+            wait = self._window[len(self._window) - self.rpm][0] + 60 - now
+        if self.tpm and self._window:
+            used = sum(entry[1] for entry in self._window)
+            for admitted_at, spent in self._window:
+                if used + tokens <= self.tpm:
+                    break
+                used -= spent
+                wait = max(wait, admitted_at + 60 - now)
+        return max(wait, 0.0)
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0) -> list:
+        """
+        Block until this call may be sent; returns the ticket to pass to release().
+        """
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        with self._cond:
+            job = priority if isinstance(priority, Priority) else None
+            entry = [job.lane if job else priority, next(self._seq), job]
+            heapq.heappush(self._waiting, entry)
+            budget_wait_counted = False
+            while True:
+                now = time.monotonic()
+                timeout = None
+                if self._waiting[0] is entry and self._in_flight < self.max_concurrency:
+                    timeout = self._admission_wait(now, tokens)
+                    if timeout == 0:
+                        break
+                    if not budget_wait_counted:
+                        self._metrics["budget_waits"] += 1
+                        budget_wait_counted = True
+                if now >= deadline:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._metrics["queue_timeouts"] += 1
+                    self._cond.notify_all()
+                    raise LLMQueueTimeout(f"No LLM slot available after {self.queue_timeout}s")
+                self._cond.wait(min(timeout, deadline - now) if timeout is not None else deadline - now)
+
+            heapq.heappop(self._waiting)
+            self._in_flight += 1
+            ticket = [now, tokens]
+            self._window.append(ticket)
+            waited_ms = (now - start) * 1000
+            self._metrics["admitted"] += 1
+            self._metrics["queue_wait_ms_total"] += waited_ms
+            self._metrics["queue_wait_ms_max"] = max(self._metrics["queue_wait_ms_max"], waited_ms)
+            # The next caller in line may fit as well
+            self._cond.notify_all()
+        return ticket
+
+    def reprioritize(self):
+        """
+        Move queued calls whose Priority was raised into their new lane.
+        """
+        with self._cond:
+            for entry in self._waiting:
+                if entry[2] is not None:
+                    entry[0] = entry[2].lane
+            heapq.heapify(self._waiting)
+            self._cond.notify_all()
+
+    def release(self, ticket: list, tokens: int = None):
+        """
+        Free the slot; `tokens` replaces the estimate charged to the token budget.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if tokens is not None:
+                ticket[1] = tokens
+            self._cond.notify_all()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = _retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if _status_code(error) == 429:
+            with self._cond:
+                self._metrics["rate_limited"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def submit(self, request, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0):
+        """
+        Send request() once admitted, retrying retryable failures.
+
+        Returns (result, ticket); the caller holds the slot until it calls
+        release(ticket), so a streamed response keeps its slot while it is read.
+        """
+        attempt = 0
+        while True:
+            ticket = self.acquire(priority, tokens)
+            try:
+                return request(), ticket
+            except Exception as e:
+                self.release(ticket)
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    with self._cond:
+                        self._metrics["failed"] += 1
+                    raise
+                delay = self._backoff(attempt, e)
+                with self._cond:
+                    self._metrics["retries"] += 1
+                logging.warning(f"LLM request failed ({e.__class__.__name__}), retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def metrics(self) -> dict:
+        with self._cond:
+            snapshot = dict(self._metrics)
+            snapshot["in_flight"] = self._in_flight
+            snapshot["queued"] = {lane: sum(1 for entry in self._waiting if entry[0] == lane)
+                                  for lane in (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)}
+            snapshot["paused_for_s"] = max(0.0, round(self._paused_until - time.monotonic(), 3))
+        return snapshot
+
+scheduler = LLMScheduler()
+
+CHARS_PER_TOKEN = 4  # rough estimate for prompt tokens, which the stream does not report
+
+def _record_call(connect_ms: float, ttft_ms: float, total_ms: float, prompt_tokens: int = 0, completion_tokens: int = 0):
+    tracing.record("llm.call", total_ms, connect_ms=round(connect_ms, 3), ttft_ms=round(ttft_ms, 3),
+                   prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    with _llm_metrics_lock:
+        _llm_metrics["calls"] += 1
+        if connect_ms:
+            _llm_metrics["connections_opened"] += 1
+            _llm_metrics["connect_ms_total"] += connect_ms
+        _llm_metrics["ttft_ms_total"] += ttft_ms
+        _llm_metrics["ttft_ms_max"] = max(_llm_metrics["ttft_ms_max"], ttft_ms)
+        _llm_metrics["total_ms_total"] += total_ms
+        _llm_metrics["total_ms_max"] = max(_llm_metrics["total_ms_max"], total_ms)
+        _llm_metrics["prompt_tokens"] += prompt_tokens
+        _llm_metrics["completion_tokens"] += completion_tokens
+    logging.info(f"LLM call: connect {connect_ms:.0f} ms, first token {ttft_ms:.0f} ms, total {total_ms:.0f} ms")
+
+def get_llm_metrics() -> dict:
+    with _llm_metrics_lock:
+        metrics = dict(_llm_metrics)
+    metrics["scheduler"] = scheduler.metrics()
+    return metrics
 
-def call_llm(system_message, user_message, temperature=0.2):
+def stream_llm(system_message, user_message, temperature=0.2, priority: int = PRIORITY_INTERACTIVE):
+    """
+    Streams a chat completion from the Azure OpenAI service, yielding text as it arrives.
+
+    The request goes through the scheduler (see LLMScheduler), which may
+    hold it back and retries it until the stream starts; a stream that
+    breaks after that is not retried. Connection setup, time to first token
+    and total time are recorded for every call (see get_llm_metrics()).
+    """
+    client = get_llm_client()
+    prompt_tokens = (len(system_message) + len(user_message)) // CHARS_PER_TOKEN
+
+    def request():
+        _call_timings.connect_started = None
+        _call_timings.connect_ms = 0.0
+        # Create a chat completion request
+        return client.chat.completions.create(
+            messages=[
+                {
+                    "role": "system",
+                    "content": system_message,
+                },
+                {
+                    "role": "user",
+                    "content": user_message,
+                }
+            ],
+            max_tokens=LLM_MAX_TOKENS,
+            temperature=temperature,
+            model=os.environ['LLM_DEPLOYMENT'],
+            stream=True,
+        )
+
+    stream, ticket = scheduler.submit(request, priority=priority, tokens=prompt_tokens + LLM_MAX_TOKENS)
+    # Time from the admission of the attempt that succeeded, not from queueing
+    start = time.perf_counter() - (time.monotonic() - ticket[0])
+    first_token_at = None
+    completion_tokens = 0
+    try:
+        for chunk in stream:
+            # Azure sends content-filter chunks without choices
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            completion_tokens += 1  # one streamed delta per token
+            yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+        scheduler.release(ticket, prompt_tokens + completion_tokens)
+        end = time.perf_counter()
+        _record_call(_call_timings.connect_ms,
+                     ((first_token_at or end) - start) * 1000,
+                     (end - start) * 1000,
+                     prompt_tokens=prompt_tokens,
+                     completion_tokens=completion_tokens)
+
+def call_llm(system_message, user_message, temperature=0.2, priority: int = PRIORITY_INTERACTIVE):
     """
     Calls the Azure OpenAI service to generate a chat completion based on a user query.
     
     Returns:
-        response (dict): The response from the Azure OpenAI service containing the chat completion.
+        response (str): The content of the chat completion.
     """
-    client = connect_llm()
-    
-    # Create a chat completion request
-
-    response = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": system_message,
-            },
-            {
-                "role": "user",
-                "content": user_message,
-            }
-        ],
-        max_tokens=1024,
-        temperature=temperature,
-        model=os.environ['LLM_DEPLOYMENT'],
-    )
-    return response.choices[0].message.content
+    return "".join(stream_llm(system_message, user_message, temperature=temperature, priority=priority))
 
 def format_llm_list_response(agent_response: str) -> list:
     """
@@ -63,18 +421,71 @@ def format_llm_list_response(agent_response: str) -> list:
     match = re.search(r'(\[.*\])', agent_response, re.DOTALL)
     if match:
         try:
-            print(f"group 1: {match.group(1)}")  # Debugging line to see the matched JSON
             response = json.loads(match.group(1))
             return response
         except json.JSONDecodeError as e:
-            print(traceback.format_exc())
-            print(f"JSON decoding error: {e}")
+            logging.error(traceback.format_exc())
+            logging.error(f"JSON decoding error: {e}")
             response = []
             pass  # If parsing fails, fall through to return text
 
     # If no JSON object found or parsing fails, return as text
     return response
 
+def iter_json_array_objects(chunks):
+    """
+    Incrementally parse the first JSON array in a stream of text chunks,
+    yielding each object in it as soon as its closing brace arrives.
+
+    Text before the array (prose, code fences) is skipped. If the stream ends
+    early, every object completed so far has already been yielded and the
+    unfinished tail is dropped.
+    """
+    buffer = ""
+    pos = 0
+    started = False
+    depth = 0
+    in_string = False
+    escape = False
+    item_start = None
+
+    for chunk in chunks:
+        buffer += chunk
+        while pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                started = char == '['
+            elif in_string:
+                if escape:
+                    escape = False
+                elif char == '\\':
+                    escape = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == '{':
+                if depth == 0:
+                    item_start = pos
+                depth += 1
+            elif char == '}' and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    try:
+                        yield json.loads(buffer[item_start:pos + 1])
+                    except json.JSONDecodeError as e:
+                        logging.error(f"Skipping malformed item in LLM response: {e}")
+                    item_start = None
+            elif char == ']' and depth == 0:
+                return
+            pos += 1
+
+        # Keep only the unfinished object in memory
+        if item_start is None:
+            buffer, pos = "", 0
+        else:
+            buffer, pos, item_start = buffer[item_start:], pos - item_start, 0
+
 def format_llm_response(agent_response: str) -> str:
     """
     Format the response from an LLM to return a valid json object.
@@ -84,12 +495,11 @@ def format_llm_response(agent_response: str) -> str:
     match = re.search(r'(\{.*\})', agent_response, re.DOTALL)
     if match:
         try:
-            print(f"group 1: {match.group(1)}")  # Debugging line to see the matched JSON
             response = json.loads(match.group(1))
             return response
         except json.JSONDecodeError as e:
-            print(traceback.format_exc())
-            print(f"JSON decoding error: {e}")
+            logging.error(traceback.format_exc())
+            logging.error(f"JSON decoding error: {e}")
             response = {}
             pass  # If parsing fails, fall through to return text
 
@@ -97,7 +507,7 @@ def format_llm_response(agent_response: str) -> str:
     return response
 
 def format_prompt_templates(selections: dict) -> str:
-    base_dynamic_template = db.get_prompt_templates("base", selections.get("dynamic"))[0]['prompt']
+    base_dynamic_template = catalog.get_prompt_templates("base", selections.get("dynamic"))[0]['prompt']
 
     default_user_message = f"""
     Given the following user selections: {selections}, generate a unique combination of 10 items that best match these preferences.
@@ -116,7 +526,7 @@ def format_prompt_templates(selections: dict) -> str:
         if key == "dynamic":
             continue
         try:
-            templates = db.get_prompt_templates(key, value)
+            templates = catalog.get_prompt_templates(key, value)
             prompt_templates.extend(templates)
         except Exception as e:
             logging.error(traceback.format_exc())
@@ -132,21 +542,151 @@ def format_prompt_templates(selections: dict) -> str:
 
     return system_message, user_message
 
-def generate_session_cards(selections: dict) -> list:
+def get_prompt(selections: dict, selection_hash: str = None) -> tuple:
+    """
+    Memoized format_prompt_templates, keyed by selection_hash and the catalog version.
+    """
+    if selection_hash is None:
+        selection_hash = generate_hash_str(json.dumps(selections, sort_keys=True))
+    return prompt_cache.get_or_build(selection_hash, lambda: format_prompt_templates(selections))
+
+class _ParseTimer:
+    """
+    Runs iter_json_array_objects over `chunks`, accumulating the time spent
+    parsing apart from the time spent waiting on the stream.
+    """
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._waited = 0.0
+        self.parse_ms = 0.0
+
+    def _timed_chunks(self):
+        chunks = iter(self._chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self._waited += time.perf_counter() - start
+            yield chunk
+
+    def parse(self):
+        parser = iter_json_array_objects(self._timed_chunks())
+        while True:
+            start, waited = time.perf_counter(), self._waited
+            try:
+                card = next(parser)
+            except StopIteration:
+                return
+            finally:
+                self.parse_ms += ((time.perf_counter() - start) - (self._waited - waited)) * 1000
+            yield card
+
+def stream_session_cards(selections: dict, chunks=None, selection_hash: str = None,
+                         priority: int = PRIORITY_INTERACTIVE, part: tuple = None):
+    """
+    Yield generated cards one by one while the completion is still streaming.
+
+    Args:
+        chunks: optional iterable of text chunks to parse instead of calling the LLM.
+        part: (index, total) when this completion is one of several run in parallel.
+    """
+    if chunks is None:
+        system_message, user_message = get_prompt(selections, selection_hash)
+        if part is not None:
+            user_message += (f"\n\nThis is set {part[0] + 1} of {part[1]} generated at the same time for these "
+                             f"selections: vary themes and wording so the sets do not overlap.")
+        chunks = stream_llm(system_message, user_message, priority=priority)
+
+    count = 0
+    received = [0]
+
+    def counted(chunks):
+        for chunk in chunks:
+            received[0] += 1
+            yield chunk
+
+    chunks = counted(chunks)
+    timer = _ParseTimer(chunks) if tracing.enabled() else None
+    try:
+        for card in (timer.parse() if timer else iter_json_array_objects(chunks)):
+            count += 1
+            yield card
+    except Exception as e:
+        if not received[0]:
+            raise LLMUnavailable(f"LLM request failed before the stream started: {e}") from e
+        # A dropped or timed-out stream keeps every card that was already complete
+        logging.error(traceback.format_exc())
+        logging.error(f"LLM stream interrupted after {count} cards: {e}")
+    finally:
+        if timer:
+            tracing.record("llm.parse", timer.parse_ms, cards=count)
+
+def stream_cards_fanout(selections: dict, completions: int = 1, selection_hash: str = None,
+                        priority: int = PRIORITY_INTERACTIVE):
+    """
+    Run `completions` completions in parallel and yield their cards as they
+    arrive, merged into one stream without exact duplicates.
+
+    The scheduler still bounds how many of them are in flight at once. A
+    completion that fails before streaming is logged and skipped; the error
+    is raised only when every completion failed that way.
+    """
+    if completions <= 1:
+        yield from stream_session_cards(selections, selection_hash=selection_hash, priority=priority)
+        return
+
+    results = queue.Queue()
+    done = object()
+    errors = []
+
+    def run(part: int):
+        try:
+            for card in stream_session_cards(selections, selection_hash=selection_hash, priority=priority,
+                                             part=(part, completions)):
+                results.put(card)
+        except LLMUnavailable as e:
+            logging.error(f"Completion {part + 1} of {completions} failed: {e}")
+            errors.append(e)
+        finally:
+            results.put(done)
+
+    for part in range(completions):
+        threading.Thread(target=run, args=(part,), name=f"llm-fanout-{part}", daemon=True).start()
+
+    seen = set()
+    finished = 0
+    while finished < completions:
+        card = results.get()
+        if card is done:
+            finished += 1
+            continue
+        key = " ".join(str(card.get('description', card)).lower().split())
+        if key in seen:
+            continue
+        seen.add(key)
+        yield card
+
+    if len(errors) == completions:
+        raise errors[0]
+
+def generate_session_cards(selections: dict, selection_hash: str = None, priority: int = PRIORITY_INTERACTIVE) -> list:
     try:
-        system_message, user_message = format_prompt_templates(selections)
-        response = call_llm(system_message, user_message)
-        logging.info(f"LLM response: {response}")
-        formatted_response = format_llm_list_response(response)
- 
-        return formatted_response
+        cards = list(stream_session_cards(selections, selection_hash=selection_hash, priority=priority))
+        logging.info(f"LLM generated {len(cards)} cards")
+        return cards
     except Exception as e:
         logging.error(traceback.format_exc())
         logging.error(f"Error generating session cards: {e}")
         return []
     
 if __name__ == "__main__":
-    
+    from utils import load_env
+    load_env()
+    logging.basicConfig(level=logging.INFO)
+
     test_selections = {'social_context': 'family', 
                         'purpose': 'fun', 
                         'tone': '1', 
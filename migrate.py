@@ -0,0 +1,87 @@
+"""
+Apply the SQL files in migrations/ that the database has not run yet.
+
+Each file is a version (0001_initial_schema.sql -> '0001') and runs in its
+own transaction together with its schema_migrations row.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied and pending versions
+"""
+import os
+import sys
+from utils import load_env
+
+load_env()
+import db_operations as db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+def list_migrations() -> list:
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if filename.endswith('.sql'):
+            migrations.append((filename.split('_', 1)[0], os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+def applied_versions(cur) -> set:
+    cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                       version TEXT PRIMARY KEY,
+                       name TEXT,
+                       applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                   );""")
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def apply_migration(cur, version: str, path: str):
+    with open(path) as f:
+        cur.execute(f.read())
+    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, os.path.basename(path)))
+
+def migrate(target: str = None) -> list:
+    """
+    Apply pending migrations in order, up to and including `target` when given.
+
+    Returns:
+        applied (list): versions applied by this run.
+    """
+    applied = []
+    with db.get_connection() as conn:
+        cur = conn.cursor()
+        # Concurrent deploys wait here instead of applying the same file twice
+        cur.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'))")
+        try:
+            done = applied_versions(cur)
+            conn.commit()
+            for version, path in list_migrations():
+                if version in done:
+                    continue
+                if target is not None and version > target:
+                    break
+                print(f"applying migration {os.path.basename(path)} ...")
+                try:
+                    apply_migration(cur, version, path)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied.append(version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'))")
+            conn.commit()
+    return applied
+
+def status() -> list:
+    with db.get_connection() as conn:
+        cur = conn.cursor()
+        done = applied_versions(cur)
+        conn.commit()
+    return [(version, os.path.basename(path), version in done) for version, path in list_migrations()]
+
+if __name__ == "__main__":
+    if '--status' in sys.argv:
+        for version, name, is_applied in status():
+            print(f"{'applied' if is_applied else 'pending':>8}  {name}")
+    else:
+        applied = migrate()
+        print(f"applied {len(applied)} migrations: {applied}" if applied else "database is up to date")
@@ -0,0 +1,47 @@
+-- Baseline schema; IF NOT EXISTS lets databases created from table_schemas.sql adopt migrations as-is.
+CREATE TABLE IF NOT EXISTS sessions (
+    id SERIAL PRIMARY KEY,
+    selection TEXT NOT NULL,
+    selection_hash TEXT,
+    selection_name TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ended_at TIMESTAMP NULL
+);
+
+CREATE TABLE IF NOT EXISTS cards (
+    id SERIAL PRIMARY KEY,
+    card_data TEXT NOT NULL,
+    combination_name TEXT,
+    combination_hash TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    like_count INT DEFAULT 0,
+    times_shown INT DEFAULT 0,
+    last_time_shown TIMESTAMP NULL
+);
+
+CREATE TABLE IF NOT EXISTS prompt_templates (
+    id SERIAL PRIMARY KEY,
+    selection_key TEXT NOT NULL,
+    selection_value TEXT,
+    prompt TEXT,
+    template_order INT
+);
+
+CREATE TABLE IF NOT EXISTS dynamics (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS session_cards (
+    id SERIAL PRIMARY KEY,
+    session_id  int,
+    card_id int,
+    feedback_text TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ended_at TIMESTAMP NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_cards_hash_times_shown ON cards (combination_hash, times_shown);
@@ -0,0 +1,29 @@
+-- Indexes for the get_cards / update_card_status access paths.
+
+-- Sampling and get_cards_by_hash only read cards still under the lifetime policy (5).
+CREATE INDEX IF NOT EXISTS idx_cards_fresh_by_hash ON cards (combination_hash, id) WHERE times_shown < 5;
+
+-- Prompt assembly and the catalog cache look templates up by key and value.
+CREATE INDEX IF NOT EXISTS idx_prompt_templates_selection ON prompt_templates (selection_key, selection_value);
+
+-- A card is recorded once per session; drop duplicates from repeated get_cards calls first.
+DELETE FROM session_cards sc
+USING session_cards older
+WHERE older.session_id = sc.session_id
+  AND older.card_id = sc.card_id
+  AND older.id < sc.id;
+
+ALTER TABLE session_cards
+    ADD CONSTRAINT session_cards_session_card_key UNIQUE (session_id, card_id);
+
+CREATE INDEX IF NOT EXISTS idx_session_cards_card_id ON session_cards (card_id);
+
+-- NOT VALID enforces the keys for new rows without failing on historical orphans;
+-- run VALIDATE CONSTRAINT once those are cleaned up.
+ALTER TABLE session_cards
+    ADD CONSTRAINT session_cards_session_id_fkey FOREIGN KEY (session_id)
+    REFERENCES sessions (id) ON DELETE CASCADE NOT VALID;
+
+ALTER TABLE session_cards
+    ADD CONSTRAINT session_cards_card_id_fkey FOREIGN KEY (card_id)
+    REFERENCES cards (id) NOT VALID;
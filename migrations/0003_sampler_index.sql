@@ -0,0 +1,4 @@
+-- The bucketed sampler ranks fresh cards by (times_shown, id) within a combination;
+-- adding id to the inventory index lets it read them presorted. Counts keep using it.
+CREATE INDEX IF NOT EXISTS idx_cards_hash_times_shown_id ON cards (combination_hash, times_shown, id);
+DROP INDEX IF EXISTS idx_cards_hash_times_shown;
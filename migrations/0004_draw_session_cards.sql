@@ -0,0 +1,106 @@
+-- get_cards in one round trip: resolve the session, sample the deck, record the
+-- session_cards rows and return the cards, all inside one transaction.
+--
+-- Sampling matches sampling.choose_bucket_ranks: fresh cards not yet seen by
+-- the session are grouped by times_shown, the top scores of each bucket are
+-- drawn from their order statistics, and the winning (times_shown, rank)
+-- pairs are resolved through the (combination_hash, times_shown, id) index.
+CREATE OR REPLACE FUNCTION draw_session_cards(p_session_id INT, p_sample_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_session sessions%ROWTYPE;
+    v_bucket RECORD;
+    v_counts BIGINT[] := '{}';
+    v_scores DOUBLE PRECISION[] := '{}';
+    v_score_buckets INT[] := '{}';
+    v_winners INT[];
+    v_pick_buckets INT[] := '{}';
+    v_pick_ranks INT[] := '{}';
+    v_log_cdf DOUBLE PRECISION;
+    v_rank INT;
+    v_stock BIGINT;
+    v_cards JSON;
+BEGIN
+    SELECT * INTO v_session FROM sessions s WHERE s.id = p_session_id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    FOR v_bucket IN
+        SELECT c.times_shown AS times_shown, COUNT(*) AS n
+        FROM cards c
+        WHERE c.combination_hash = v_session.selection_hash
+          AND c.times_shown < p_policy
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+        GROUP BY c.times_shown
+    LOOP
+        v_counts[v_bucket.times_shown + 1] := v_bucket.n;
+        v_log_cdf := 0;
+        FOR i IN 0 .. LEAST(p_sample_size, v_bucket.n) - 1 LOOP
+            v_log_cdf := v_log_cdf + LN(1 - random()) / (v_bucket.n - i);
+            v_scores := v_scores || (-LN(GREATEST(1 - EXP(v_log_cdf), 1e-300)) / (p_policy - v_bucket.times_shown));
+            v_score_buckets := v_score_buckets || v_bucket.times_shown;
+        END LOOP;
+    END LOOP;
+
+    SELECT array_agg(t.bucket ORDER BY t.score DESC) INTO v_winners
+    FROM (SELECT u.score, u.bucket
+          FROM unnest(v_scores, v_score_buckets) AS u(score, bucket)
+          ORDER BY u.score DESC
+          LIMIT p_sample_size) t;
+
+    -- Uniform distinct ranks inside each winning bucket
+    FOR i IN 1 .. COALESCE(array_length(v_winners, 1), 0) LOOP
+        LOOP
+            v_rank := floor(random() * v_counts[v_winners[i] + 1])::INT;
+            EXIT WHEN NOT EXISTS (SELECT 1 FROM unnest(v_pick_buckets, v_pick_ranks) AS p(bucket, rank)
+                                  WHERE p.bucket = v_winners[i] AND p.rank = v_rank);
+        END LOOP;
+        v_pick_buckets := v_pick_buckets || v_winners[i];
+        v_pick_ranks := v_pick_ranks || v_rank;
+    END LOOP;
+
+    WITH ranked AS (
+        SELECT c.id, c.times_shown,
+               row_number() OVER (PARTITION BY c.times_shown ORDER BY c.id) - 1 AS rank
+        FROM cards c
+        WHERE c.combination_hash = v_session.selection_hash
+          AND c.times_shown = ANY(v_pick_buckets)
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+    ),
+    picked AS (
+        SELECT c.id, c.card_data, c.times_shown, c.like_count, p.ord
+        FROM unnest(v_pick_buckets, v_pick_ranks) WITH ORDINALITY AS p(bucket, rank, ord)
+        JOIN ranked r ON r.times_shown = p.bucket AND r.rank = p.rank
+        JOIN cards c ON c.id = r.id
+    ),
+    recorded AS (
+        INSERT INTO session_cards (session_id, card_id)
+        SELECT p_session_id, picked.id FROM picked
+        ON CONFLICT (session_id, card_id) DO NOTHING
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', picked.id,
+                                               'card_data', picked.card_data,
+                                               'times_shown', picked.times_shown,
+                                               'like_count', picked.like_count)
+                             ORDER BY picked.ord), '[]'::json)
+    INTO v_cards
+    FROM picked;
+
+    SELECT COUNT(*) INTO v_stock
+    FROM cards c
+    WHERE c.combination_hash = v_session.selection_hash AND c.times_shown < p_policy;
+
+    RETURN json_build_object(
+        'session', json_build_object('id', v_session.id,
+                                     'selection', v_session.selection,
+                                     'selection_name', v_session.selection_name,
+                                     'selection_hash', v_session.selection_hash),
+        'stock', v_stock,
+        'cards', v_cards);
+END;
+$$;
@@ -0,0 +1,132 @@
+-- Append-only counters for hot cards.
+--
+-- Swipes insert rows into card_events instead of updating the wide cards row,
+-- and compact_card_events (a timer job) folds them into cards periodically.
+-- live_cards(hash) adds the not-yet-folded events on read, so sampling and
+-- inventory see exact counts at any time.
+CREATE TABLE IF NOT EXISTS card_events (
+    id BIGSERIAL PRIMARY KEY,
+    card_id INT NOT NULL,
+    combination_hash TEXT,
+    shown INT NOT NULL DEFAULT 0,
+    likes INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_card_events_hash ON card_events (combination_hash);
+
+-- Plain SQL so the planner inlines it and pushes predicates into both tables.
+CREATE OR REPLACE FUNCTION live_cards(p_combination_hash TEXT)
+RETURNS TABLE (id INT, card_data TEXT, combination_name TEXT, combination_hash TEXT, created_at TIMESTAMP,
+               like_count INT, times_shown INT, last_time_shown TIMESTAMP)
+LANGUAGE sql STABLE
+AS $$
+    SELECT c.id, c.card_data, c.combination_name, c.combination_hash, c.created_at,
+           c.like_count + COALESCE(p.likes, 0)::INT,
+           c.times_shown + COALESCE(p.shown, 0)::INT,
+           c.last_time_shown
+    FROM cards c
+    LEFT JOIN (SELECT e.card_id, SUM(e.shown) AS shown, SUM(e.likes) AS likes
+               FROM card_events e
+               WHERE e.combination_hash = p_combination_hash
+               GROUP BY e.card_id) p ON p.card_id = c.id
+    WHERE c.combination_hash = p_combination_hash
+$$;
+
+-- draw_session_cards from 0004, reading counts through live_cards.
+CREATE OR REPLACE FUNCTION draw_session_cards(p_session_id INT, p_sample_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_session sessions%ROWTYPE;
+    v_bucket RECORD;
+    v_counts BIGINT[] := '{}';
+    v_scores DOUBLE PRECISION[] := '{}';
+    v_score_buckets INT[] := '{}';
+    v_winners INT[];
+    v_pick_buckets INT[] := '{}';
+    v_pick_ranks INT[] := '{}';
+    v_log_cdf DOUBLE PRECISION;
+    v_rank INT;
+    v_stock BIGINT;
+    v_cards JSON;
+BEGIN
+    SELECT * INTO v_session FROM sessions s WHERE s.id = p_session_id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    FOR v_bucket IN
+        SELECT c.times_shown AS times_shown, COUNT(*) AS n
+        FROM live_cards(v_session.selection_hash) c
+        WHERE c.times_shown < p_policy
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+        GROUP BY c.times_shown
+    LOOP
+        v_counts[v_bucket.times_shown + 1] := v_bucket.n;
+        v_log_cdf := 0;
+        FOR i IN 0 .. LEAST(p_sample_size, v_bucket.n) - 1 LOOP
+            v_log_cdf := v_log_cdf + LN(1 - random()) / (v_bucket.n - i);
+            v_scores := v_scores || (-LN(GREATEST(1 - EXP(v_log_cdf), 1e-300)) / (p_policy - v_bucket.times_shown));
+            v_score_buckets := v_score_buckets || v_bucket.times_shown;
+        END LOOP;
+    END LOOP;
+
+    SELECT array_agg(t.bucket ORDER BY t.score DESC) INTO v_winners
+    FROM (SELECT u.score, u.bucket
+          FROM unnest(v_scores, v_score_buckets) AS u(score, bucket)
+          ORDER BY u.score DESC
+          LIMIT p_sample_size) t;
+
+    -- Uniform distinct ranks inside each winning bucket
+    FOR i IN 1 .. COALESCE(array_length(v_winners, 1), 0) LOOP
+        LOOP
+            v_rank := floor(random() * v_counts[v_winners[i] + 1])::INT;
+            EXIT WHEN NOT EXISTS (SELECT 1 FROM unnest(v_pick_buckets, v_pick_ranks) AS p(bucket, rank)
+                                  WHERE p.bucket = v_winners[i] AND p.rank = v_rank);
+        END LOOP;
+        v_pick_buckets := v_pick_buckets || v_winners[i];
+        v_pick_ranks := v_pick_ranks || v_rank;
+    END LOOP;
+
+    WITH ranked AS (
+        SELECT c.id, c.card_data, c.times_shown, c.like_count,
+               row_number() OVER (PARTITION BY c.times_shown ORDER BY c.id) - 1 AS rank
+        FROM live_cards(v_session.selection_hash) c
+        WHERE c.times_shown = ANY(v_pick_buckets)
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+    ),
+    picked AS (
+        SELECT r.id, r.card_data, r.times_shown, r.like_count, p.ord
+        FROM unnest(v_pick_buckets, v_pick_ranks) WITH ORDINALITY AS p(bucket, rank, ord)
+        JOIN ranked r ON r.times_shown = p.bucket AND r.rank = p.rank
+    ),
+    recorded AS (
+        INSERT INTO session_cards (session_id, card_id)
+        SELECT p_session_id, picked.id FROM picked
+        ON CONFLICT (session_id, card_id) DO NOTHING
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', picked.id,
+                                               'card_data', picked.card_data,
+                                               'times_shown', picked.times_shown,
+                                               'like_count', picked.like_count)
+                             ORDER BY picked.ord), '[]'::json)
+    INTO v_cards
+    FROM picked;
+
+    SELECT COUNT(*) INTO v_stock
+    FROM live_cards(v_session.selection_hash) c
+    WHERE c.times_shown < p_policy;
+
+    RETURN json_build_object(
+        'session', json_build_object('id', v_session.id,
+                                     'selection', v_session.selection,
+                                     'selection_name', v_session.selection_name,
+                                     'selection_hash', v_session.selection_hash),
+        'stock', v_stock,
+        'cards', v_cards);
+END;
+$$;
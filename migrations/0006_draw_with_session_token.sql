@@ -0,0 +1,16 @@
+-- Token-authenticated get_cards: the caller already knows the session's selection
+-- from its signed token, so the session row (possibly still queued for its
+-- asynchronous insert) is written here if missing before drawing.
+CREATE OR REPLACE FUNCTION draw_session_cards(p_session_id INT, p_sample_size INT, p_policy INT,
+                                              p_selection TEXT, p_selection_name TEXT, p_selection_hash TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO sessions (id, selection, selection_name, selection_hash)
+    VALUES (p_session_id, p_selection, p_selection_name, p_selection_hash)
+    ON CONFLICT (id) DO NOTHING;
+
+    RETURN draw_session_cards(p_session_id, p_sample_size, p_policy);
+END;
+$$;
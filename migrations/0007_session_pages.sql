@@ -0,0 +1,61 @@
+-- Paginated decks: session_cards rows carry the page they were served on, and
+-- the page after the current one is drawn ahead of time and kept reserved.
+ALTER TABLE session_cards ADD COLUMN IF NOT EXISTS page INT;
+ALTER TABLE session_cards ADD COLUMN IF NOT EXISTS reserved BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_session_cards_session_page ON session_cards (session_id, page);
+
+CREATE OR REPLACE FUNCTION next_session_page(p_session_id INT, p_page INT, p_page_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_served INT;
+    v_draw JSON;
+    v_next JSON;
+    v_cards JSON;
+BEGIN
+    -- One page turn per session at a time
+    PERFORM pg_advisory_xact_lock(p_session_id);
+
+    -- Serve what the previous call reserved, topping up if the page size grew
+    UPDATE session_cards SET reserved = FALSE
+    WHERE session_id = p_session_id AND page = p_page AND reserved;
+
+    SELECT COUNT(*) INTO v_served FROM session_cards
+    WHERE session_id = p_session_id AND page = p_page;
+
+    v_draw := draw_session_cards(p_session_id, GREATEST(p_page_size - v_served, 0), p_policy);
+    IF v_draw IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE session_cards SET page = p_page
+    WHERE session_id = p_session_id
+      AND card_id IN (SELECT (c->>'id')::INT FROM json_array_elements(v_draw->'cards') c);
+
+    SELECT COALESCE(json_agg(json_build_object('id', c.id,
+                                               'card_data', c.card_data,
+                                               'times_shown', c.times_shown,
+                                               'like_count', c.like_count)
+                             ORDER BY sc.id), '[]'::json)
+    INTO v_cards
+    FROM session_cards sc
+    JOIN cards c ON c.id = sc.card_id
+    WHERE sc.session_id = p_session_id AND sc.page = p_page;
+
+    -- Prefetch: draw and reserve the following page now
+    v_next := draw_session_cards(p_session_id, p_page_size, p_policy);
+
+    UPDATE session_cards SET page = p_page + 1, reserved = TRUE
+    WHERE session_id = p_session_id
+      AND card_id IN (SELECT (c->>'id')::INT FROM json_array_elements(v_next->'cards') c);
+
+    RETURN json_build_object(
+        'session', v_draw->'session',
+        'stock', (v_next->>'stock')::BIGINT,
+        'page', p_page,
+        'cards', v_cards,
+        'has_more', json_array_length(v_next->'cards') > 0);
+END;
+$$;
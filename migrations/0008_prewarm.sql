@@ -0,0 +1,13 @@
+-- Demand mining for the pre-warm job scans the last days of sessions by creation time.
+CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at);
+
+-- One row per pre-warm run: what was forecast, what was generated and the projected hit rate.
+CREATE TABLE IF NOT EXISTS prewarm_reports (
+    id SERIAL PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    token_budget INT,
+    tokens_planned INT,
+    cards_created INT,
+    projected_hit_rate REAL,
+    report JSONB NOT NULL
+);
@@ -0,0 +1,36 @@
+-- Retirement of exhausted cards.
+--
+-- Cards shown LIFETIME_POLICY (5) times are never sampled again. archive_exhausted_cards
+-- (a timer job) moves them, in batches, from cards into archived_cards with their
+-- final like_count and times_shown, so the hot table and its indexes only hold
+-- cards that can still be served. Ids are kept, and the cards sequence never
+-- reuses them, so an id names the same card in either table.
+CREATE TABLE IF NOT EXISTS archived_cards (
+    id INT PRIMARY KEY,
+    card_data TEXT NOT NULL,
+    combination_name TEXT,
+    combination_hash TEXT,
+    created_at TIMESTAMP,
+    like_count INT DEFAULT 0,
+    times_shown INT DEFAULT 0,
+    last_time_shown TIMESTAMP NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_archived_cards_hash ON archived_cards (combination_hash);
+
+-- Finds archival candidates without scanning the live rows.
+CREATE INDEX IF NOT EXISTS idx_cards_exhausted ON cards (id) WHERE times_shown >= 5;
+
+-- session_cards rows outlive the cards they point to once those are archived.
+ALTER TABLE session_cards DROP CONSTRAINT IF EXISTS session_cards_card_id_fkey;
+
+-- Live and archived cards together, for analytics on like_count history.
+CREATE OR REPLACE VIEW all_cards AS
+    SELECT id, card_data, combination_name, combination_hash, created_at,
+           like_count, times_shown, last_time_shown, NULL::TIMESTAMP AS archived_at
+    FROM cards
+    UNION ALL
+    SELECT id, card_data, combination_name, combination_hash, created_at,
+           like_count, times_shown, last_time_shown, archived_at
+    FROM archived_cards;
@@ -0,0 +1,181 @@
+-- Like-aware sampling.
+--
+-- card_quality is a Bayesian-smoothed like rate: a Beta(1, 2) prior (one like
+-- in three showings) plus the card's own counts, so a new card starts at 1/3
+-- and moves towards its observed like rate as feedback comes in. cards.quality
+-- stores it as a generated column, which Postgres recomputes in the same
+-- UPDATE whenever like_count or times_shown change (compaction, direct counter
+-- mode, update_card_status); live_cards recomputes it for cards with swipes
+-- still in card_events.
+--
+-- The draw weight is freshness times a quality factor. Quality is cut into 4
+-- tiers, so cards with the same (times_shown, tier) still share a weight and
+-- the bucketed sampler keeps working on at most policy * 4 buckets.
+-- dynamics.exploration sets, per dynamic, the share of the factor that
+-- ignores quality: 1 draws by freshness only (the previous behaviour), 0 by
+-- freshness times tier quality.
+CREATE OR REPLACE FUNCTION card_quality(p_likes INT, p_shown INT)
+RETURNS REAL
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT ((p_likes + 1.0) / (p_shown + 3.0))::REAL
+$$;
+
+CREATE OR REPLACE FUNCTION quality_tier(p_quality REAL)
+RETURNS INT
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT LEAST(3, FLOOR(p_quality * 4))::INT
+$$;
+
+CREATE OR REPLACE FUNCTION card_draw_weight(p_policy INT, p_times_shown INT, p_tier INT, p_exploration REAL)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT GREATEST(0, p_policy - p_times_shown)
+           * (p_exploration + (1 - p_exploration) * (p_tier + 0.5) / 4)::DOUBLE PRECISION
+$$;
+
+ALTER TABLE cards ADD COLUMN IF NOT EXISTS quality REAL
+    GENERATED ALWAYS AS (card_quality(like_count, times_shown)) STORED;
+
+ALTER TABLE dynamics ADD COLUMN IF NOT EXISTS exploration REAL NOT NULL DEFAULT 0.5
+    CHECK (exploration BETWEEN 0 AND 1);
+
+-- Buckets are counted and ranked by (times_shown, quality) within a combination
+CREATE INDEX IF NOT EXISTS idx_cards_hash_times_shown_quality ON cards (combination_hash, times_shown, quality, id);
+DROP INDEX IF EXISTS idx_cards_hash_times_shown_id;
+
+-- live_cards from 0005 with a quality column; the return type changes, so drop first.
+DROP FUNCTION IF EXISTS live_cards(TEXT);
+CREATE FUNCTION live_cards(p_combination_hash TEXT)
+RETURNS TABLE (id INT, card_data TEXT, combination_name TEXT, combination_hash TEXT, created_at TIMESTAMP,
+               like_count INT, times_shown INT, last_time_shown TIMESTAMP, quality REAL)
+LANGUAGE sql STABLE
+AS $$
+    SELECT c.id, c.card_data, c.combination_name, c.combination_hash, c.created_at,
+           c.like_count + COALESCE(p.likes, 0)::INT,
+           c.times_shown + COALESCE(p.shown, 0)::INT,
+           c.last_time_shown,
+           CASE WHEN p.card_id IS NULL THEN c.quality
+                ELSE card_quality(c.like_count + p.likes::INT, c.times_shown + p.shown::INT) END
+    FROM cards c
+    LEFT JOIN (SELECT e.card_id, SUM(e.shown) AS shown, SUM(e.likes) AS likes
+               FROM card_events e
+               WHERE e.combination_hash = p_combination_hash
+               GROUP BY e.card_id) p ON p.card_id = c.id
+    WHERE c.combination_hash = p_combination_hash
+$$;
+
+-- draw_session_cards from 0005, with (times_shown, quality tier) buckets weighted
+-- by card_draw_weight and the exploration of the session's dynamic.
+CREATE OR REPLACE FUNCTION draw_session_cards(p_session_id INT, p_sample_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_session sessions%ROWTYPE;
+    v_exploration REAL;
+    v_bucket RECORD;
+    v_counts BIGINT[] := '{}';
+    v_scores DOUBLE PRECISION[] := '{}';
+    v_score_buckets INT[] := '{}';
+    v_winners INT[];
+    v_pick_buckets INT[] := '{}';
+    v_pick_ranks INT[] := '{}';
+    v_log_cdf DOUBLE PRECISION;
+    v_weight DOUBLE PRECISION;
+    v_rank INT;
+    v_stock BIGINT;
+    v_cards JSON;
+BEGIN
+    SELECT * INTO v_session FROM sessions s WHERE s.id = p_session_id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT d.exploration INTO v_exploration
+    FROM dynamics d
+    WHERE lower(d.name) = lower(v_session.selection::json->>'dynamic')
+    LIMIT 1;
+    v_exploration := COALESCE(v_exploration, 0.5);
+
+    -- Bucket b = times_shown * 4 + tier
+    FOR v_bucket IN
+        SELECT c.times_shown * 4 + quality_tier(c.quality) AS bucket, c.times_shown AS times_shown,
+               quality_tier(c.quality) AS tier, COUNT(*) AS n
+        FROM live_cards(v_session.selection_hash) c
+        WHERE c.times_shown < p_policy
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+        GROUP BY c.times_shown, quality_tier(c.quality)
+    LOOP
+        v_counts[v_bucket.bucket + 1] := v_bucket.n;
+        v_weight := card_draw_weight(p_policy, v_bucket.times_shown, v_bucket.tier, v_exploration);
+        CONTINUE WHEN v_weight <= 0;
+        v_log_cdf := 0;
+        FOR i IN 0 .. LEAST(p_sample_size, v_bucket.n) - 1 LOOP
+            v_log_cdf := v_log_cdf + LN(1 - random()) / (v_bucket.n - i);
+            v_scores := v_scores || (-LN(GREATEST(1 - EXP(v_log_cdf), 1e-300)) / v_weight);
+            v_score_buckets := v_score_buckets || v_bucket.bucket;
+        END LOOP;
+    END LOOP;
+
+    SELECT array_agg(t.bucket ORDER BY t.score DESC) INTO v_winners
+    FROM (SELECT u.score, u.bucket
+          FROM unnest(v_scores, v_score_buckets) AS u(score, bucket)
+          ORDER BY u.score DESC
+          LIMIT p_sample_size) t;
+
+    -- Uniform distinct ranks inside each winning bucket
+    FOR i IN 1 .. COALESCE(array_length(v_winners, 1), 0) LOOP
+        LOOP
+            v_rank := floor(random() * v_counts[v_winners[i] + 1])::INT;
+            EXIT WHEN NOT EXISTS (SELECT 1 FROM unnest(v_pick_buckets, v_pick_ranks) AS p(bucket, rank)
+                                  WHERE p.bucket = v_winners[i] AND p.rank = v_rank);
+        END LOOP;
+        v_pick_buckets := v_pick_buckets || v_winners[i];
+        v_pick_ranks := v_pick_ranks || v_rank;
+    END LOOP;
+
+    WITH ranked AS (
+        SELECT c.id, c.card_data, c.times_shown, c.like_count,
+               c.times_shown * 4 + quality_tier(c.quality) AS bucket,
+               row_number() OVER (PARTITION BY c.times_shown, quality_tier(c.quality)
+                                  ORDER BY c.quality, c.id) - 1 AS rank
+        FROM live_cards(v_session.selection_hash) c
+        WHERE c.times_shown * 4 + quality_tier(c.quality) = ANY(v_pick_buckets)
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+    ),
+    picked AS (
+        SELECT r.id, r.card_data, r.times_shown, r.like_count, p.ord
+        FROM unnest(v_pick_buckets, v_pick_ranks) WITH ORDINALITY AS p(bucket, rank, ord)
+        JOIN ranked r ON r.bucket = p.bucket AND r.rank = p.rank
+    ),
+    recorded AS (
+        INSERT INTO session_cards (session_id, card_id)
+        SELECT p_session_id, picked.id FROM picked
+        ON CONFLICT (session_id, card_id) DO NOTHING
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', picked.id,
+                                               'card_data', picked.card_data,
+                                               'times_shown', picked.times_shown,
+                                               'like_count', picked.like_count)
+                             ORDER BY picked.ord), '[]'::json)
+    INTO v_cards
+    FROM picked;
+
+    SELECT COUNT(*) INTO v_stock
+    FROM live_cards(v_session.selection_hash) c
+    WHERE c.times_shown < p_policy;
+
+    RETURN json_build_object(
+        'session', json_build_object('id', v_session.id,
+                                     'selection', v_session.selection,
+                                     'selection_name', v_session.selection_name,
+                                     'selection_hash', v_session.selection_hash),
+        'stock', v_stock,
+        'cards', v_cards);
+END;
+$$;
@@ -0,0 +1,135 @@
+-- Fix the draw direction of the weighted samplers.
+--
+-- Since 0004 draw_session_cards (and sample_cards_by_hash) ranked cards by
+-- -LN(RANDOM()) / weight DESC. That score is Exp(weight), which is smaller for
+-- heavier cards, so fresher and better-liked cards were drawn *less* often.
+-- Cards are now taken in ascending score order, which draws them with
+-- probability proportional to their weight, without replacement.
+--
+-- quality_tier also gets fixed bounds. A live card has times_shown < 5, so
+-- card_quality stays within [1/7, 5/7] and FLOOR(quality * 4) never reached
+-- tier 3. With these bounds a new card (1/3) sits in tier 1, and one or two
+-- likes move it up.
+CREATE OR REPLACE FUNCTION quality_tier(p_quality REAL)
+RETURNS INT
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT CASE WHEN p_quality < 0.25 THEN 0
+                WHEN p_quality < 0.4 THEN 1
+                WHEN p_quality < 0.55 THEN 2
+                ELSE 3 END
+$$;
+
+-- draw_session_cards from 0010, drawing the lowest scores.
+CREATE OR REPLACE FUNCTION draw_session_cards(p_session_id INT, p_sample_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_session sessions%ROWTYPE;
+    v_exploration REAL;
+    v_bucket RECORD;
+    v_counts BIGINT[] := '{}';
+    v_scores DOUBLE PRECISION[] := '{}';
+    v_score_buckets INT[] := '{}';
+    v_winners INT[];
+    v_pick_buckets INT[] := '{}';
+    v_pick_ranks INT[] := '{}';
+    v_score DOUBLE PRECISION;
+    v_weight DOUBLE PRECISION;
+    v_rank INT;
+    v_stock BIGINT;
+    v_cards JSON;
+BEGIN
+    SELECT * INTO v_session FROM sessions s WHERE s.id = p_session_id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT d.exploration INTO v_exploration
+    FROM dynamics d
+    WHERE lower(d.name) = lower(v_session.selection::json->>'dynamic')
+    LIMIT 1;
+    v_exploration := COALESCE(v_exploration, 0.5);
+
+    -- Bucket b = times_shown * 4 + tier
+    FOR v_bucket IN
+        SELECT c.times_shown * 4 + quality_tier(c.quality) AS bucket, c.times_shown AS times_shown,
+               quality_tier(c.quality) AS tier, COUNT(*) AS n
+        FROM live_cards(v_session.selection_hash) c
+        WHERE c.times_shown < p_policy
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+        GROUP BY c.times_shown, quality_tier(c.quality)
+    LOOP
+        v_counts[v_bucket.bucket + 1] := v_bucket.n;
+        v_weight := card_draw_weight(p_policy, v_bucket.times_shown, v_bucket.tier, v_exploration);
+        CONTINUE WHEN v_weight <= 0;
+        -- The i-th smallest of n Exp(w) scores: gaps are Exp((n - i) * w)
+        v_score := 0;
+        FOR i IN 0 .. LEAST(p_sample_size, v_bucket.n) - 1 LOOP
+            v_score := v_score - LN(1 - random()) / ((v_bucket.n - i) * v_weight);
+            v_scores := v_scores || v_score;
+            v_score_buckets := v_score_buckets || v_bucket.bucket;
+        END LOOP;
+    END LOOP;
+
+    -- Lowest scores win, so heavier buckets are drawn more often
+    SELECT array_agg(t.bucket ORDER BY t.score) INTO v_winners
+    FROM (SELECT u.score, u.bucket
+          FROM unnest(v_scores, v_score_buckets) AS u(score, bucket)
+          ORDER BY u.score
+          LIMIT p_sample_size) t;
+
+    -- Uniform distinct ranks inside each winning bucket
+    FOR i IN 1 .. COALESCE(array_length(v_winners, 1), 0) LOOP
+        LOOP
+            v_rank := floor(random() * v_counts[v_winners[i] + 1])::INT;
+            EXIT WHEN NOT EXISTS (SELECT 1 FROM unnest(v_pick_buckets, v_pick_ranks) AS p(bucket, rank)
+                                  WHERE p.bucket = v_winners[i] AND p.rank = v_rank);
+        END LOOP;
+        v_pick_buckets := v_pick_buckets || v_winners[i];
+        v_pick_ranks := v_pick_ranks || v_rank;
+    END LOOP;
+
+    WITH ranked AS (
+        SELECT c.id, c.card_data, c.times_shown, c.like_count,
+               c.times_shown * 4 + quality_tier(c.quality) AS bucket,
+               row_number() OVER (PARTITION BY c.times_shown, quality_tier(c.quality)
+                                  ORDER BY c.quality, c.id) - 1 AS rank
+        FROM live_cards(v_session.selection_hash) c
+        WHERE c.times_shown * 4 + quality_tier(c.quality) = ANY(v_pick_buckets)
+          AND NOT EXISTS (SELECT 1 FROM session_cards sc
+                          WHERE sc.session_id = p_session_id AND sc.card_id = c.id)
+    ),
+    picked AS (
+        SELECT r.id, r.card_data, r.times_shown, r.like_count, p.ord
+        FROM unnest(v_pick_buckets, v_pick_ranks) WITH ORDINALITY AS p(bucket, rank, ord)
+        JOIN ranked r ON r.bucket = p.bucket AND r.rank = p.rank
+    ),
+    recorded AS (
+        INSERT INTO session_cards (session_id, card_id)
+        SELECT p_session_id, picked.id FROM picked
+        ON CONFLICT (session_id, card_id) DO NOTHING
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', picked.id,
+                                               'card_data', picked.card_data,
+                                               'times_shown', picked.times_shown,
+                                               'like_count', picked.like_count)
+                             ORDER BY picked.ord), '[]'::json)
+    INTO v_cards
+    FROM picked;
+
+    SELECT COUNT(*) INTO v_stock
+    FROM live_cards(v_session.selection_hash) c
+    WHERE c.times_shown < p_policy;
+
+    RETURN json_build_object(
+        'session', json_build_object('id', v_session.id,
+                                     'selection', v_session.selection,
+                                     'selection_name', v_session.selection_name,
+                                     'selection_hash', v_session.selection_hash),
+        'stock', v_stock,
+        'cards', v_cards);
+END;
+$$;
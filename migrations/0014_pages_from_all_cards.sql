@@ -0,0 +1,64 @@
+-- next_session_page from 0012, reading served cards through all_cards.
+--
+-- Pages were built with JOIN cards, so a card archived (0009) after it was
+-- served or reserved silently dropped out of its page when the page was
+-- requested again. all_cards covers both cards and archived_cards.
+CREATE OR REPLACE FUNCTION next_session_page(p_session_id INT, p_page INT, p_page_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_served INT;
+    v_reserved INT;
+    v_draw JSON;
+    v_next JSON;
+    v_cards JSON;
+BEGIN
+    -- One page turn per session at a time
+    PERFORM pg_advisory_xact_lock(p_session_id);
+
+    -- Serve what the previous call reserved, topping up if the page size grew
+    UPDATE session_cards SET reserved = FALSE
+    WHERE session_id = p_session_id AND page = p_page AND reserved;
+
+    SELECT COUNT(*) INTO v_served FROM session_cards
+    WHERE session_id = p_session_id AND page = p_page;
+
+    v_draw := draw_session_cards(p_session_id, GREATEST(p_page_size - v_served, 0), p_policy);
+    IF v_draw IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE session_cards SET page = p_page
+    WHERE session_id = p_session_id
+      AND card_id IN (SELECT (c->>'id')::INT FROM json_array_elements(v_draw->'cards') c);
+
+    SELECT COALESCE(json_agg(json_build_object('id', c.id,
+                                               'card_data', c.card_data,
+                                               'times_shown', c.times_shown,
+                                               'like_count', c.like_count)
+                             ORDER BY sc.id), '[]'::json)
+    INTO v_cards
+    FROM session_cards sc
+    JOIN all_cards c ON c.id = sc.card_id
+    WHERE sc.session_id = p_session_id AND sc.page = p_page;
+
+    -- Prefetch: top the following page up to p_page_size; a repeated call for
+    -- the same page finds it already reserved and draws nothing
+    SELECT COUNT(*) INTO v_reserved FROM session_cards
+    WHERE session_id = p_session_id AND page = p_page + 1;
+
+    v_next := draw_session_cards(p_session_id, GREATEST(p_page_size - v_reserved, 0), p_policy);
+
+    UPDATE session_cards SET page = p_page + 1, reserved = TRUE
+    WHERE session_id = p_session_id
+      AND card_id IN (SELECT (c->>'id')::INT FROM json_array_elements(v_next->'cards') c);
+
+    RETURN json_build_object(
+        'session', v_draw->'session',
+        'stock', (v_next->>'stock')::BIGINT,
+        'page', p_page,
+        'cards', v_cards,
+        'has_more', v_reserved + json_array_length(v_next->'cards') > 0);
+END;
+$$;
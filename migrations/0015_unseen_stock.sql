@@ -0,0 +1,187 @@
+-- Report how many fresh cards the session has not been dealt yet.
+--
+-- 'stock' counts every fresh card of the combination, including the ones
+-- this session has already seen. Deciding on it alone, a long session that
+-- had seen every fresh card of a well-stocked combination got empty pages
+-- for good: no synchronous generation (stock > 0) and no refill (stock above
+-- the low-water mark). Both functions now also return 'unseen', the fresh
+-- cards still left for this session after the draw, which get_cards bases
+-- those decisions on.
+
+-- draw_session_cards from 0013, with 'unseen'.
+CREATE OR REPLACE FUNCTION draw_session_cards(p_session_id INT, p_sample_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_session sessions%ROWTYPE;
+    v_exploration REAL;
+    v_ids INT[];
+    v_buckets INT[];
+    v_times_shown INT[];
+    v_like_counts INT[];
+    v_bucket RECORD;
+    v_counts BIGINT[] := '{}';
+    v_firsts BIGINT[] := '{}';
+    v_scores DOUBLE PRECISION[] := '{}';
+    v_score_buckets INT[] := '{}';
+    v_winners INT[];
+    v_picks INT[] := '{}';
+    v_score DOUBLE PRECISION;
+    v_weight DOUBLE PRECISION;
+    v_pick INT;
+    v_stock BIGINT;
+    v_unseen BIGINT;
+    v_cards JSON;
+BEGIN
+    SELECT * INTO v_session FROM sessions s WHERE s.id = p_session_id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT d.exploration INTO v_exploration
+    FROM dynamics d
+    WHERE lower(d.name) = lower(v_session.selection::json->>'dynamic')
+    LIMIT 1;
+    v_exploration := COALESCE(v_exploration, 0.5);
+
+    -- Bucket b = times_shown * 4 + tier; candidates are the cards the session has not seen
+    SELECT COUNT(*),
+           COUNT(*) FILTER (WHERE NOT c.seen),
+           array_agg(c.id ORDER BY c.bucket, c.quality, c.id) FILTER (WHERE NOT c.seen),
+           array_agg(c.bucket ORDER BY c.bucket, c.quality, c.id) FILTER (WHERE NOT c.seen),
+           array_agg(c.times_shown ORDER BY c.bucket, c.quality, c.id) FILTER (WHERE NOT c.seen),
+           array_agg(c.like_count ORDER BY c.bucket, c.quality, c.id) FILTER (WHERE NOT c.seen)
+    INTO v_stock, v_unseen, v_ids, v_buckets, v_times_shown, v_like_counts
+    FROM (SELECT lc.id, lc.times_shown, lc.like_count, lc.quality,
+                 lc.times_shown * 4 + quality_tier(lc.quality) AS bucket,
+                 EXISTS (SELECT 1 FROM session_cards sc
+                         WHERE sc.session_id = p_session_id AND sc.card_id = lc.id) AS seen
+          FROM live_cards(v_session.selection_hash) lc
+          WHERE lc.times_shown < p_policy) c;
+
+    FOR v_bucket IN
+        SELECT u.bucket, COUNT(*) AS n, MIN(u.ord) AS first
+        FROM unnest(v_buckets) WITH ORDINALITY AS u(bucket, ord)
+        GROUP BY u.bucket
+    LOOP
+        v_counts[v_bucket.bucket + 1] := v_bucket.n;
+        v_firsts[v_bucket.bucket + 1] := v_bucket.first;
+        v_weight := card_draw_weight(p_policy, v_bucket.bucket / 4, v_bucket.bucket % 4, v_exploration);
+        CONTINUE WHEN v_weight <= 0;
+        -- The i-th smallest of n Exp(w) scores: gaps are Exp((n - i) * w)
+        v_score := 0;
+        FOR i IN 0 .. LEAST(p_sample_size, v_bucket.n) - 1 LOOP
+            v_score := v_score - LN(1 - random()) / ((v_bucket.n - i) * v_weight);
+            v_scores := v_scores || v_score;
+            v_score_buckets := v_score_buckets || v_bucket.bucket;
+        END LOOP;
+    END LOOP;
+
+    -- Lowest scores win, so heavier buckets are drawn more often
+    SELECT array_agg(t.bucket ORDER BY t.score) INTO v_winners
+    FROM (SELECT u.score, u.bucket
+          FROM unnest(v_scores, v_score_buckets) AS u(score, bucket)
+          ORDER BY u.score
+          LIMIT p_sample_size) t;
+
+    -- Uniform distinct ranks inside each winning bucket, as positions in v_ids
+    FOR i IN 1 .. COALESCE(array_length(v_winners, 1), 0) LOOP
+        LOOP
+            v_pick := v_firsts[v_winners[i] + 1] + floor(random() * v_counts[v_winners[i] + 1])::INT;
+            EXIT WHEN NOT v_pick = ANY(v_picks);
+        END LOOP;
+        v_picks := v_picks || v_pick;
+    END LOOP;
+
+    WITH picked AS (
+        SELECT v_ids[p.pos] AS id, v_times_shown[p.pos] AS times_shown,
+               v_like_counts[p.pos] AS like_count, p.ord
+        FROM unnest(v_picks) WITH ORDINALITY AS p(pos, ord)
+    ),
+    recorded AS (
+        INSERT INTO session_cards (session_id, card_id)
+        SELECT p_session_id, picked.id FROM picked
+        ON CONFLICT (session_id, card_id) DO NOTHING
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', picked.id,
+                                               'card_data', a.card_data,
+                                               'times_shown', picked.times_shown,
+                                               'like_count', picked.like_count)
+                             ORDER BY picked.ord), '[]'::json)
+    INTO v_cards
+    FROM picked
+    JOIN all_cards a ON a.id = picked.id;
+
+    RETURN json_build_object(
+        'session', json_build_object('id', v_session.id,
+                                     'selection', v_session.selection,
+                                     'selection_name', v_session.selection_name,
+                                     'selection_hash', v_session.selection_hash),
+        'stock', v_stock,
+        'unseen', v_unseen - COALESCE(array_length(v_picks, 1), 0),
+        'cards', v_cards);
+END;
+$$;
+
+-- next_session_page from 0014, passing on 'unseen' from the prefetch draw.
+CREATE OR REPLACE FUNCTION next_session_page(p_session_id INT, p_page INT, p_page_size INT, p_policy INT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_served INT;
+    v_reserved INT;
+    v_draw JSON;
+    v_next JSON;
+    v_cards JSON;
+BEGIN
+    -- One page turn per session at a time
+    PERFORM pg_advisory_xact_lock(p_session_id);
+
+    -- Serve what the previous call reserved, topping up if the page size grew
+    UPDATE session_cards SET reserved = FALSE
+    WHERE session_id = p_session_id AND page = p_page AND reserved;
+
+    SELECT COUNT(*) INTO v_served FROM session_cards
+    WHERE session_id = p_session_id AND page = p_page;
+
+    v_draw := draw_session_cards(p_session_id, GREATEST(p_page_size - v_served, 0), p_policy);
+    IF v_draw IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE session_cards SET page = p_page
+    WHERE session_id = p_session_id
+      AND card_id IN (SELECT (c->>'id')::INT FROM json_array_elements(v_draw->'cards') c);
+
+    SELECT COALESCE(json_agg(json_build_object('id', c.id,
+                                               'card_data', c.card_data,
+                                               'times_shown', c.times_shown,
+                                               'like_count', c.like_count)
+                             ORDER BY sc.id), '[]'::json)
+    INTO v_cards
+    FROM session_cards sc
+    JOIN all_cards c ON c.id = sc.card_id
+    WHERE sc.session_id = p_session_id AND sc.page = p_page;
+
+    -- Prefetch: top the following page up to p_page_size; a repeated call for
+    -- the same page finds it already reserved and draws nothing
+    SELECT COUNT(*) INTO v_reserved FROM session_cards
+    WHERE session_id = p_session_id AND page = p_page + 1;
+
+    v_next := draw_session_cards(p_session_id, GREATEST(p_page_size - v_reserved, 0), p_policy);
+
+    UPDATE session_cards SET page = p_page + 1, reserved = TRUE
+    WHERE session_id = p_session_id
+      AND card_id IN (SELECT (c->>'id')::INT FROM json_array_elements(v_next->'cards') c);
+
+    RETURN json_build_object(
+        'session', v_draw->'session',
+        'stock', (v_next->>'stock')::BIGINT,
+        'unseen', (v_next->>'unseen')::BIGINT,
+        'page', p_page,
+        'cards', v_cards,
+        'has_more', v_reserved + json_array_length(v_next->'cards') > 0);
+END;
+$$;
@@ -0,0 +1,7 @@
+-- Drop idx_cards_fresh_by_hash (0002).
+--
+-- Since 0005 every read of fresh cards goes through live_cards and filters on
+-- times_shown plus the swipes still in card_events, so the partial index's
+-- predicate (times_shown < 5, with the lifetime policy hard-coded) can never
+-- match a query. It was only write cost on every counter update.
+DROP INDEX IF EXISTS idx_cards_fresh_by_hash;
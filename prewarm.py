@@ -0,0 +1,145 @@
+"""
+Pre-warming of popular combinations ahead of demand.
+
+The job reads recent demand per combination from sessions and
+session_cards, forecasts the card servings each will need over the next
+window, and generates stock for the ones that would run short, spending at
+most a token budget. Every run writes a report to prewarm_reports.
+"""
+import os
+import heapq
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import db_operations as db
+import llm_operations as llm
+import replenishment
+
+PREWARM_WINDOW_HOURS = int(os.getenv('PREWARM_WINDOW_HOURS', 2))  # hours of demand to stock ahead
+PREWARM_LOOKBACK_DAYS = int(os.getenv('PREWARM_LOOKBACK_DAYS', 7))  # history used for the forecast
+PREWARM_TOP_N = int(os.getenv('PREWARM_TOP_N', 20))  # combinations considered per run
+PREWARM_TOKEN_BUDGET = int(os.getenv('PREWARM_TOKEN_BUDGET', 50000))  # LLM tokens one run may spend
+PREWARM_SAFETY_FACTOR = float(os.getenv('PREWARM_SAFETY_FACTOR', 1.2))  # headroom over the forecast
+
+def forecast_servings(combination: dict, lookback_days: int = PREWARM_LOOKBACK_DAYS,
+                      safety_factor: float = PREWARM_SAFETY_FACTOR) -> float:
+    """
+    Card servings expected in the next window: the larger of the current
+    rate (last window) and the average of the same window on previous days,
+    with headroom.
+    """
+    same_window_avg = combination['served_same_window'] / max(lookback_days, 1)
+    return max(combination['served_recent'], same_window_avg) * safety_factor
+
+def completion_cost(combination: dict) -> int:
+    """
+    Upper bound on the tokens one completion for this combination spends.
+    """
+    system_message, user_message = llm.get_prompt(combination['selection'], combination['selection_hash'])
+    return (len(system_message) + len(user_message)) // llm.CHARS_PER_TOKEN + llm.LLM_MAX_TOKENS
+
+def plan_prewarm(combinations: list, token_budget: int = PREWARM_TOKEN_BUDGET,
+                 policy: int = replenishment.LIFETIME_POLICY, cards_per_call: int = llm.LLM_CARDS_PER_CALL) -> list:
+    """
+    Decide how many completions each combination gets.
+
+    Each combination's shortfall is its forecast minus the servings its stock
+    has left. Completions go one at a time to the combination that covers the
+    most missing servings per token, until shortfalls are covered or the
+    budget runs out.
+
+    Returns:
+        plan (list): one entry per combination with forecast, shortfall,
+        completions, tokens and cost fields added.
+    """
+    plan = []
+    heap = []
+    for combination in combinations:
+        entry = dict(combination,
+                     forecast=round(forecast_servings(combination), 2),
+                     completions=0,
+                     tokens=0)
+        entry['shortfall'] = max(0.0, entry['forecast'] - combination['servings_left'])
+        plan.append(entry)
+        if entry['shortfall'] > 0:
+            entry['cost'] = completion_cost(combination)
+            heapq.heappush(heap, (-min(entry['shortfall'], cards_per_call * policy) / entry['cost'], len(plan) - 1))
+
+    budget_left = token_budget
+    while heap:
+        _, i = heapq.heappop(heap)
+        entry = plan[i]
+        if entry['cost'] > budget_left:
+            continue
+        budget_left -= entry['cost']
+        entry['completions'] += 1
+        entry['tokens'] += entry['cost']
+        remaining = entry['shortfall'] - entry['completions'] * cards_per_call * policy
+        if remaining > 0:
+            heapq.heappush(heap, (-min(remaining, cards_per_call * policy) / entry['cost'], i))
+    return plan
+
+def projected_hit_rate(plan: list, policy: int = replenishment.LIFETIME_POLICY, created_key: str = None,
+                       cards_per_call: int = llm.LLM_CARDS_PER_CALL) -> float:
+    """
+    Share of the forecast servings the stock can cover: with the cards in
+    created_key when given, else with the planned completions.
+    """
+    forecast = sum(entry['forecast'] for entry in plan)
+    if not forecast:
+        return 1.0
+    covered = 0.0
+    for entry in plan:
+        new_cards = entry[created_key] if created_key else entry['completions'] * cards_per_call
+        covered += min(entry['forecast'], entry['servings_left'] + new_cards * policy)
+    return round(covered / forecast, 4)
+
+def _generate(entry: dict) -> int:
+    try:
+        card_ids = replenishment.ensure_stock(entry['selection'], entry['selection_hash'], entry['selection_name'],
+                                              min_stock=entry['stock'] + entry['completions'] * llm.LLM_CARDS_PER_CALL,
+                                              priority=llm.PRIORITY_BACKGROUND, completions=entry['completions'])
+        return len(card_ids)
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        logging.error(f"Error pre-warming {entry['selection_name']}: {e}")
+        return 0
+
+def run_prewarm(token_budget: int = PREWARM_TOKEN_BUDGET, window_hours: int = PREWARM_WINDOW_HOURS,
+                lookback_days: int = PREWARM_LOOKBACK_DAYS, top_n: int = PREWARM_TOP_N) -> dict:
+    """
+    Forecast, plan and generate, then store and return the report.
+    """
+    combinations = db.get_combination_demand(lookback_days=lookback_days, window_hours=window_hours,
+                                             policy=replenishment.LIFETIME_POLICY, top_n=top_n)
+    plan = plan_prewarm(combinations, token_budget)
+    tokens_before = llm.get_llm_metrics()
+
+    selected = [entry for entry in plan if entry['completions']]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(selected), llm.LLM_MAX_CONCURRENCY))) as pool:
+        for entry, created in zip(selected, pool.map(_generate, selected)):
+            entry['created'] = created
+    tokens_after = llm.get_llm_metrics()
+
+    report = {
+        "window_hours": window_hours,
+        "lookback_days": lookback_days,
+        "token_budget": token_budget,
+        "tokens_planned": sum(entry['tokens'] for entry in plan),
+        # Worker-wide counters, so generations running concurrently are included
+        "tokens_used": (tokens_after['prompt_tokens'] + tokens_after['completion_tokens']
+                        - tokens_before['prompt_tokens'] - tokens_before['completion_tokens']),
+        "cards_created": sum(entry.get('created', 0) for entry in plan),
+        "hit_rate_before": projected_hit_rate([dict(entry, completions=0) for entry in plan]),
+        "projected_hit_rate": projected_hit_rate([dict(entry, created=entry.get('created', 0)) for entry in plan],
+                                                 created_key='created'),
+        "combinations": [{key: entry.get(key) for key in
+                          ("selection_name", "sessions", "served_recent", "served_same_window", "forecast",
+                           "stock", "servings_left", "shortfall", "completions", "tokens", "created")}
+                         for entry in plan],
+    }
+    report['report_id'] = db.insert_prewarm_report(report)
+    logging.info(f"Pre-warm: {report['cards_created']} cards for {len(selected)} combinations, "
+                 f"{report['tokens_planned']} tokens planned, hit rate {report['hit_rate_before']:.0%} -> "
+                 f"{report['projected_hit_rate']:.0%}")
+    return report
@@ -0,0 +1,253 @@
+import os
+import json
+import queue
+import threading
+import logging
+import traceback
+import db_operations as db
+import llm_operations as llm
+import dedup
+from utils import SingleFlight
+
+LIFETIME_POLICY = 5  # max times a card can be shown before being retired
+REPLENISH_QUEUE = "card-replenishment"
+REPLENISH_MODE = os.getenv('REPLENISH_MODE', 'queue')  # 'queue' uses the Storage queue binding, 'local' an in-process worker
+REPLENISH_LOW_WATER = int(os.getenv('REPLENISH_LOW_WATER', 30))  # fresh cards to keep in stock per combination
+REPLENISH_MAX_BATCHES = int(os.getenv('REPLENISH_MAX_BATCHES', 3))  # LLM generations per refill message
+REPLENISH_LOOKBACK_HOURS = int(os.getenv('REPLENISH_LOOKBACK_HOURS', 24))  # sessions scanned by the timer sweep
+
+STREAM_INSERT_BATCH = int(os.getenv('STREAM_INSERT_BATCH', 5))  # cards stored per insert while the LLM streams
+DEDUP_EXTRA_ROUNDS = int(os.getenv('DEDUP_EXTRA_ROUNDS', 2))  # re-requests to replace near-duplicates dropped
+
+def generate_and_store_cards(selection: dict, selection_hash: str, selection_name: str,
+                             priority: int = llm.PRIORITY_INTERACTIVE, completions: int = 1) -> list:
+    """
+    Run LLM generation for a combination and store the cards.
+
+    Cards are inserted in batches of STREAM_INSERT_BATCH while the completion
+    streams, so they become available to other requests early and survive a
+    truncated or interrupted response. With completions > 1 that many
+    completions run in parallel and their cards are merged. When
+    DEDUP_ENABLED, near-duplicates of stored cards or of earlier cards in the
+    run are dropped before insert. When that leaves fewer cards than the
+    completions asked for, the missing ones are requested again, up to
+    DEDUP_EXTRA_ROUNDS more times.
+
+    Returns:
+        card_ids (list): ids of the newly created cards.
+    """
+    checker = dedup.dedup_index.checker(selection_hash) if dedup.DEDUP_ENABLED else None
+    card_ids = []
+    batch = []
+    rejected = 0
+
+    def store(batch):
+        new_ids = db.create_cards(batch, selection_hash, selection_name)
+        if checker:
+            checker.stored(new_ids, batch)
+        card_ids.extend(new_ids)
+
+    requested = completions * llm.LLM_CARDS_PER_CALL
+    for _ in range(DEDUP_EXTRA_ROUNDS + 1):
+        round_rejected = 0
+        for card in llm.stream_cards_fanout(selection, completions, selection_hash=selection_hash,
+                                            priority=priority):
+            if 'description' not in card:
+                continue
+            if checker and not checker.accept(card['description']):
+                round_rejected += 1
+                continue
+            batch.append(card['description'])
+            if len(batch) >= STREAM_INSERT_BATCH:
+                store(batch)
+                batch = []
+        if batch:
+            store(batch)
+            batch = []
+        rejected += round_rejected
+
+        # Replace only what deduplication dropped; a short stream is not retried here
+        missing = requested - len(card_ids)
+        if not round_rejected or missing <= 0:
+            break
+        completions = min(completions, -(-missing // llm.LLM_CARDS_PER_CALL))
+        logging.info(f"{round_rejected} near-duplicates dropped for {selection_name}, requesting {missing} more")
+    logging.info(f"Created {len(card_ids)} new cards for {selection_name} ({rejected} near-duplicates dropped)")
+    return card_ids
+
+# One generation per combination at a time: SingleFlight coalesces callers in
+# this worker, the advisory lock serializes workers, and whoever gets the lock
+# second re-checks stock so it reuses the first worker's cards. A caller that
+# joins a generation raises its LLM priority to its own, so a user waiting on
+# a background refill is not queued behind the background lane.
+_generations = SingleFlight()
+_generation_priorities = {}  # selection_hash -> llm.Priority of the generation in flight
+_generation_metrics = {"shared_across_workers": 0, "lock_timeouts": 0, "lock_pool_timeouts": 0,
+                       "priority_raises": 0}
+_generation_metrics_lock = threading.Lock()
+
+def _generate_if_short(selection: dict, selection_hash: str, selection_name: str, min_stock: int,
+                       priority: int, completions: int, session_id: int = None) -> list:
+    if count_stock(selection_hash, session_id=session_id) >= min_stock:
+        with _generation_metrics_lock:
+            _generation_metrics["shared_across_workers"] += 1
+        return []
+    return generate_and_store_cards(selection, selection_hash, selection_name, priority, completions)
+
+def _generate_exclusive(selection: dict, selection_hash: str, selection_name: str, min_stock: int,
+                        priority: int, completions: int, session_id: int = None) -> list:
+    args = (selection, selection_hash, selection_name, min_stock, priority, completions, session_id)
+    try:
+        with db.advisory_lock(f"generate-cards:{selection_hash}"):
+            return _generate_if_short(*args)
+    except db.LockTimeout as e:
+        # The other worker's generation is stuck or very slow, or every lock
+        # connection is busy with other combinations; don't wait on them
+        logging.warning(f"{e}; generating {selection_name} without the lock")
+        with _generation_metrics_lock:
+            _generation_metrics["lock_pool_timeouts" if isinstance(e, db.LockPoolTimeout) else "lock_timeouts"] += 1
+        return _generate_if_short(*args)
+
+def ensure_stock(selection: dict, selection_hash: str, selection_name: str, min_stock: int = 1,
+                 priority: int = llm.PRIORITY_INTERACTIVE, completions: int = 1, session_id: int = None) -> list:
+    """
+    Generate cards for a combination unless it already holds min_stock fresh cards,
+    letting at most one generation per combination run at a time. With
+    session_id, only cards that session has not been dealt count as stock.
+
+    Returns:
+        card_ids (list): ids created by the generation this call ran or waited on;
+        empty when another worker had already restocked the combination.
+    """
+    with _generation_metrics_lock:
+        shared = _generation_priorities.setdefault(selection_hash, llm.Priority(priority))
+        if priority < shared.lane:
+            _generation_metrics["priority_raises"] += 1
+    shared.raise_to(priority)
+
+    def generate():
+        # Adopt the registered priority, which callers that join may raise
+        with _generation_metrics_lock:
+            lane = _generation_priorities.setdefault(selection_hash, shared)
+        lane.raise_to(priority)
+        try:
+            return _generate_exclusive(selection, selection_hash, selection_name, min_stock, lane, completions,
+                                       session_id)
+        finally:
+            with _generation_metrics_lock:
+                if _generation_priorities.get(selection_hash) is lane:
+                    del _generation_priorities[selection_hash]
+
+    return _generations.do(selection_hash, generate)
+
+def get_generation_metrics() -> dict:
+    metrics = _generations.metrics()
+    with _generation_metrics_lock:
+        metrics.update(_generation_metrics)
+    return metrics
+
+def count_stock(selection_hash: str, policy: int = LIFETIME_POLICY, session_id: int = None) -> int:
+    return db.count_fresh_cards(selection_hash, policy=policy, exclude_session_id=session_id)
+
+def replenish(selection: dict, selection_hash: str, selection_name: str,
+              low_water: int = REPLENISH_LOW_WATER, max_batches: int = REPLENISH_MAX_BATCHES,
+              session_id: int = None) -> list:
+    """
+    Top a combination up to the low-water mark with at most max_batches
+    background completions, run in parallel when the deficit needs several.
+    With session_id, the mark applies to the cards that session has not been dealt.
+    """
+    card_ids = []
+    batches_left = max_batches
+    while batches_left > 0:
+        deficit = low_water - count_stock(selection_hash, session_id=session_id)
+        if deficit <= 0:
+            break
+        completions = min(batches_left, -(-deficit // llm.LLM_CARDS_PER_CALL))
+        new_ids = ensure_stock(selection, selection_hash, selection_name, min_stock=low_water,
+                               priority=llm.PRIORITY_BACKGROUND, completions=completions, session_id=session_id)
+        if not new_ids:
+            break
+        card_ids.extend(new_ids)
+        batches_left -= completions
+    return card_ids
+
+def build_refill_message(session_info: dict) -> str:
+    return json.dumps({"selection": session_info['selection'],
+                       "selection_hash": session_info['selection_hash'],
+                       "selection_name": session_info['selection_name'],
+                       "session_id": session_info.get('id')})
+
+def handle_refill_message(message: str) -> list:
+    payload = json.loads(message)
+    try:
+        return replenish(payload['selection'], payload['selection_hash'], payload['selection_name'],
+                         session_id=payload.get('session_id'))
+    finally:
+        with _pending_lock:
+            _pending.discard(payload['selection_hash'])
+
+# Combinations with a refill already queued by this worker, so a burst of
+# get_cards calls for the same deck enqueues a single message.
+_pending = set()
+_pending_lock = threading.Lock()
+_local_queue = queue.Queue()
+_local_worker = None
+
+def _run_local_worker():
+    while True:
+        message = _local_queue.get()
+        try:
+            handle_refill_message(message)
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            logging.error(f"Error replenishing cards: {e}")
+        finally:
+            _local_queue.task_done()
+
+def _ensure_local_worker():
+    global _local_worker
+    with _pending_lock:
+        if _local_worker is None:
+            _local_worker = threading.Thread(target=_run_local_worker, name="card-replenishment", daemon=True)
+            _local_worker.start()
+
+def enqueue_refill(session_info: dict, out=None) -> bool:
+    """
+    Ask for a combination to be topped up in the background.
+
+    The message goes to the Storage queue through the `out` binding when
+    REPLENISH_MODE is 'queue', and to an in-process worker thread otherwise.
+    Duplicate queue messages are harmless because the worker re-checks stock
+    before generating; the local worker skips combinations already pending.
+    """
+    message = build_refill_message(session_info)
+    if out is not None and REPLENISH_MODE == 'queue':
+        out.set(message)
+        return True
+
+    with _pending_lock:
+        if session_info['selection_hash'] in _pending:
+            return False
+        _pending.add(session_info['selection_hash'])
+    _ensure_local_worker()
+    _local_queue.put(message)
+    return True
+
+def replenish_low_stock(low_water: int = REPLENISH_LOW_WATER, lookback_hours: int = REPLENISH_LOOKBACK_HOURS) -> list:
+    """
+    Sweep recently requested combinations and top up every one below the low-water mark.
+    """
+    refilled = []
+    for combination in db.get_recent_combinations(policy=LIFETIME_POLICY, since_hours=lookback_hours):
+        if combination['stock'] >= low_water:
+            continue
+        logging.info(f"Replenishing {combination['selection_name']} ({combination['stock']} cards in stock)")
+        try:
+            card_ids = replenish(combination['selection'], combination['selection_hash'],
+                                 combination['selection_name'], low_water=low_water)
+            refilled.append({"selection_name": combination['selection_name'], "created": len(card_ids)})
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            logging.error(f"Error replenishing {combination['selection_name']}: {e}")
+    return refilled
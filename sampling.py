@@ -0,0 +1,75 @@
+"""
+Python model of the weighted draw in draw_session_cards (migrations/0013).
+
+Cards are drawn server-side; these functions mirror the SQL so the
+algorithm can be checked against exact weighted sampling without a
+database (tests/test_sampling.py) and timed (benchmarks/bench_sampling.py).
+"""
+import math
+import bisect
+import random
+import heapq
+
+DEFAULT_EXPLORATION = 0.5  # dynamics.exploration default
+QUALITY_TIERS = 4  # quality_tier() in migrations/0011
+# Upper bounds of the lower tiers. A live card has times_shown < policy, so its
+# quality stays between 1/(policy + 2) and policy/(policy + 2); these bounds
+# keep every tier reachable (a new card starts in tier 1).
+QUALITY_TIER_BOUNDS = (0.25, 0.4, 0.55)
+
+def quality_tier(quality: float) -> int:
+    return bisect.bisect_right(QUALITY_TIER_BOUNDS, quality)
+
+def bucket_weight(times_shown: int, tier: int, policy: int, exploration: float = DEFAULT_EXPLORATION) -> float:
+    """
+    Draw weight of every card in a (times_shown, quality tier) bucket:
+    freshness times a quality factor, as card_draw_weight in migrations/0010.
+    Heavier cards are more likely to be drawn.
+    exploration 1 ignores quality, 0 weights fully by the tier's quality.
+    """
+    return max(0, policy - times_shown) * (exploration + (1 - exploration) * (tier + 0.5) / QUALITY_TIERS)
+
+def smallest_scores(count: int, weight: float, k: int, rng=random) -> list:
+    """
+    The k smallest of `count` independent Exp(weight) scores, smallest first,
+    drawn in O(k) instead of generating all of them.
+
+    Exp(weight) is the distribution of -LN(RANDOM()) / weight in the SQL
+    sampler, and taking scores in ascending order draws cards with
+    probability proportional to their weight, without replacement. The
+    minimum of `remaining` Exp(weight) draws is Exp(remaining * weight), and
+    by memorylessness each next order statistic adds another such gap.
+    """
+    scores = []
+    score = 0.0
+    for remaining in range(count, max(count - k, 0), -1):
+        score -= math.log(1.0 - rng.random()) / (remaining * weight)
+        scores.append(score)
+    return scores
+
+def choose_bucket_ranks(counts: dict, sample_size: int, policy: int, rng=random,
+                        exploration: float = DEFAULT_EXPLORATION) -> list:
+    """
+    Turn per-bucket counts, keyed by (times_shown, quality tier), into
+    (bucket, rank) picks with the same distribution as sorting every card by
+    -LN(RANDOM()) / weight ascending.
+
+    Cards in one bucket share a weight (see bucket_weight) and are
+    exchangeable, so only the bucket of each of the lowest sample_size scores
+    matters; the cards inside a bucket are then a uniform random subset of its
+    ranks. The draw_session_cards database function (migrations/0013) runs
+    the same algorithm server-side.
+    """
+    candidates = []
+    for bucket, count in counts.items():
+        weight = bucket_weight(bucket[0], bucket[1], policy, exploration)
+        if weight <= 0 or count <= 0:
+            continue
+        candidates.extend((score, bucket) for score in smallest_scores(count, weight, sample_size, rng))
+
+    winners = heapq.nsmallest(sample_size, candidates)
+    taken = {}
+    for _, bucket in winners:
+        taken[bucket] = taken.get(bucket, 0) + 1
+    ranks = {bucket: rng.sample(range(counts[bucket]), n) for bucket, n in taken.items()}
+    return [(bucket, ranks[bucket].pop()) for _, bucket in winners]
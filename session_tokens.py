@@ -0,0 +1,187 @@
+"""
+Stateless signed session tokens.
+
+create_session hands out a compact token carrying the session id and its
+selection, signed with HMAC-SHA256 under SESSION_TOKEN_SECRET. Requests that
+present it are trusted without reading the sessions table, and the session
+row itself is written asynchronously in batches for analytics.
+"""
+import os
+import hmac
+import json
+import time
+import queue
+import atexit
+import base64
+import hashlib
+import logging
+import threading
+import traceback
+import psycopg2
+import db_operations as db
+from utils import generate_hash_str
+
+SESSION_TOKEN_SECRET = os.getenv('SESSION_TOKEN_SECRET')  # tokens are disabled when unset
+SESSION_TOKEN_TTL = int(os.getenv('SESSION_TOKEN_TTL', 24 * 3600))  # seconds
+SESSION_ID_BLOCK = int(os.getenv('SESSION_ID_BLOCK', 50))  # session ids reserved per sequence round trip
+SESSION_WRITE_MAX_RETRIES = int(os.getenv('SESSION_WRITE_MAX_RETRIES', 10))  # failed writes in a row before dropping
+
+# Errors that retrying the same batch cannot fix
+DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, TypeError, ValueError)
+
+def tokens_enabled() -> bool:
+    return bool(SESSION_TOKEN_SECRET)
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(SESSION_TOKEN_SECRET.encode(), payload, hashlib.sha256).digest()[:16]
+
+def issue_cursor(session_id: int, page: int) -> str:
+    """
+    Opaque continuation cursor for a session's next page; signed when tokens are enabled.
+    """
+    payload = json.dumps({"sid": session_id, "page": page}, separators=(',', ':')).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload)) if tokens_enabled() else ''}"
+
+def verify_cursor(cursor: str) -> dict:
+    """
+    Returns:
+        cursor (dict): {"sid", "page"}, or None if the cursor is malformed or its signature is wrong.
+    """
+    try:
+        encoded_payload, encoded_signature = cursor.split('.', 1)
+        payload = _b64decode(encoded_payload)
+        if tokens_enabled() and not hmac.compare_digest(_sign(payload), _b64decode(encoded_signature)):
+            return None
+        claims = json.loads(payload)
+        return {"sid": int(claims['sid']), "page": int(claims['page'])}
+    except (ValueError, TypeError, KeyError):
+        return None
+
+def issue_token(session_id: int, selection: dict, selection_name: str) -> str:
+    payload = json.dumps({"sid": session_id, "sel": selection, "name": selection_name, "iat": int(time.time())},
+                         separators=(',', ':')).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+def verify_token(token: str) -> dict:
+    """
+    Check a token's signature and age.
+
+    Returns:
+        session (dict): id, selection, selection_name and selection_hash, or None if the token is invalid.
+    """
+    if not tokens_enabled() or not token or '.' not in token:
+        return None
+    try:
+        encoded_payload, encoded_signature = token.split('.', 1)
+        payload = _b64decode(encoded_payload)
+        if not hmac.compare_digest(_sign(payload), _b64decode(encoded_signature)):
+            return None
+        claims = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+
+    if time.time() - claims['iat'] > SESSION_TOKEN_TTL:
+        return None
+    return {"id": claims['sid'],
+            "selection": claims['sel'],
+            "selection_name": claims['name'],
+            "selection_hash": generate_hash_str(claims['name'])}
+
+class SessionIdBlock:
+    """
+    Hands out session ids from blocks reserved from the sessions sequence.
+    """
+    def __init__(self, block_size: int = SESSION_ID_BLOCK):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._ids = []
+
+    def next_id(self) -> int:
+        with self._lock:
+            if not self._ids:
+                self._ids = db.reserve_session_ids(self.block_size)[::-1]
+            return self._ids.pop()
+
+class SessionWriter:
+    """
+    Background writer for session rows created under a token. Rows are inserted
+    in batches with ON CONFLICT DO NOTHING, because a get_cards call carrying
+    the token may already have inserted the row itself. A failed batch is
+    retried up to SESSION_WRITE_MAX_RETRIES writes in a row; then, or at once
+    on a data or integrity error, it is logged and dropped.
+    """
+    def __init__(self, writer=db.insert_sessions, batch_size: int = 100):
+        self._writer = writer
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self.dropped = 0
+
+    def submit(self, session_id: int, selection: dict, selection_name: str, selection_hash: str):
+        self._queue.put((session_id, selection, selection_name, selection_hash))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+                    self._thread.start()
+
+    def _drain(self, first=None) -> list:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list):
+        try:
+            self._writer(batch)
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            self._consecutive_failures += 1
+            if isinstance(e, DATA_ERRORS) or self._consecutive_failures >= SESSION_WRITE_MAX_RETRIES:
+                self._consecutive_failures = 0
+                self.dropped += len(batch)
+                logging.error(f"Dropping {len(batch)} sessions after write error: {e}; "
+                              f"ids {[row[0] for row in batch]}")
+                return
+            logging.error(f"Error writing {len(batch)} sessions, will retry: {e}")
+            for row in batch:
+                self._queue.put(row)
+            time.sleep(1)
+        else:
+            self._consecutive_failures = 0
+
+    def _run(self):
+        while True:
+            self._write(self._drain(self._queue.get()))
+
+    def flush(self):
+        batch = self._drain()
+        while batch:
+            self._writer(batch)
+            batch = self._drain()
+
+_session_ids = SessionIdBlock()
+session_writer = SessionWriter()
+atexit.register(session_writer.flush)
+
+def start_session(selection: dict, selection_name: str, selection_hash: str) -> tuple:
+    """
+    Create a session without waiting for its insert.
+
+    Returns:
+        (session_id, token)
+    """
+    session_id = _session_ids.next_id()
+    session_writer.submit(session_id, selection, selection_name, selection_hash)
+    return session_id, issue_token(session_id, selection, selection_name)
@@ -1,5 +1,8 @@
 -- Active: 1753569113741@@ssc-postree.postgres.database.azure.com@5432@connect@public
 
+-- Reference copy of the current schema. Changes are shipped as numbered files
+-- in migrations/ and applied with `python migrate.py`.
+
 -- Table: companies
 CREATE TABLE sessions (
     id SERIAL PRIMARY KEY,
@@ -10,6 +13,14 @@ CREATE TABLE sessions (
     ended_at TIMESTAMP NULL
 );
 
+-- Bayesian-smoothed like rate used by cards.quality (0010)
+CREATE FUNCTION card_quality(p_likes INT, p_shown INT)
+RETURNS REAL
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT ((p_likes + 1.0) / (p_shown + 3.0))::REAL
+$$;
+
 CREATE TABLE cards (
     id SERIAL PRIMARY KEY,
     card_data TEXT NOT NULL,
@@ -18,7 +29,9 @@ CREATE TABLE cards (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     like_count INT DEFAULT 0,
     times_shown INT DEFAULT 0,
-    last_time_shown TIMESTAMP NULL
+    last_time_shown TIMESTAMP NULL,
+    -- Bayesian-smoothed like rate, recomputed on every counter update (0010)
+    quality REAL GENERATED ALWAYS AS (card_quality(like_count, times_shown)) STORED
 );
 
 CREATE TABLE prompt_templates (
@@ -34,15 +47,70 @@ CREATE TABLE dynamics (
     name TEXT NOT NULL,
     title TEXT,
     description TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    exploration REAL NOT NULL DEFAULT 0.5 CHECK (exploration BETWEEN 0 AND 1)  -- 1 = freshness only
 );
 
 CREATE TABLE session_cards (
     id SERIAL PRIMARY KEY,
-    session_id  int,
-    card_id int,
+    session_id  int REFERENCES sessions (id) ON DELETE CASCADE,
+    card_id int,  -- cards (id) or archived_cards (id)
     feedback_text TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    ended_at TIMESTAMP NULL
+    ended_at TIMESTAMP NULL,
+    page INT,
+    reserved BOOLEAN NOT NULL DEFAULT FALSE,
+    CONSTRAINT session_cards_session_card_key UNIQUE (session_id, card_id)
+);
+
+-- Inventory counts and draw_session_cards find a combination's cards through this index
+CREATE INDEX idx_cards_hash_times_shown_quality ON cards (combination_hash, times_shown, quality, id);
+CREATE INDEX idx_prompt_templates_selection ON prompt_templates (selection_key, selection_value);
+CREATE INDEX idx_session_cards_card_id ON session_cards (card_id);
+CREATE INDEX idx_session_cards_session_page ON session_cards (session_id, page);
+
+-- Swipe counters waiting to be folded into cards by compact_card_events
+CREATE TABLE card_events (
+    id BIGSERIAL PRIMARY KEY,
+    card_id INT NOT NULL,
+    combination_hash TEXT,
+    shown INT NOT NULL DEFAULT 0,
+    likes INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_card_events_hash ON card_events (combination_hash);
+
+CREATE INDEX idx_sessions_created_at ON sessions (created_at);
+
+-- Exhausted cards moved out of cards by archive_exhausted_cards, ids kept
+CREATE TABLE archived_cards (
+    id INT PRIMARY KEY,
+    card_data TEXT NOT NULL,
+    combination_name TEXT,
+    combination_hash TEXT,
+    created_at TIMESTAMP,
+    like_count INT DEFAULT 0,
+    times_shown INT DEFAULT 0,
+    last_time_shown TIMESTAMP NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_archived_cards_hash ON archived_cards (combination_hash);
+CREATE INDEX idx_cards_exhausted ON cards (id) WHERE times_shown >= 5;
+
+-- One row per pre-warm run (prewarm.py)
+CREATE TABLE prewarm_reports (
+    id SERIAL PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    token_budget INT,
+    tokens_planned INT,
+    cards_created INT,
+    projected_hit_rate REAL,
+    report JSONB NOT NULL
 );
 
+-- Server-side functions (see migrations/): live_cards (0005, 0010),
+-- draw_session_cards (0004, 0005, 0006, 0010, 0011, 0013, 0015),
+-- next_session_page (0007, 0012, 0014, 0015), quality_tier, card_draw_weight (0010, 0011);
+-- view all_cards over cards and archived_cards (0009)
@@ -0,0 +1,48 @@
+"""
+Id validation and flush error handling of the swipe feedback buffer.
+"""
+import os
+import sys
+import pytest
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import feedback_buffer
+from feedback_buffer import FeedbackBuffer, parse_id
+
+@pytest.mark.parametrize("value, expected", [
+    (7, 7), ("7", 7), (" 12 ", 12), (2 ** 31 - 1, 2 ** 31 - 1),
+    (0, None), (-3, None), ("-3", None), (2 ** 31, None), (True, None), (None, None),
+    (1.5, None), ("1.5", None), ("", None), ("abc", None), ("²", None), ("1²", None), ("①", None),
+])
+def test_parse_id(value, expected):
+    assert parse_id(value) == expected
+
+def test_data_error_drops_batch():
+    def writer(card_counts, session_endings):
+        raise psycopg2.DataError("integer out of range")
+
+    buffer = FeedbackBuffer(writer=writer, flush_size=1000, flush_interval=60)
+    buffer.add(1, liked=True, session_id=2)
+    buffer._stop.set()
+    assert buffer.flush() == 0
+    assert buffer.metrics()["dropped_events"] == 1
+    assert buffer.metrics()["pending_events"] == 0
+
+def test_transient_error_retries_then_drops(monkeypatch):
+    monkeypatch.setattr(feedback_buffer, "FEEDBACK_MAX_RETRIES", 3)
+    calls = []
+
+    def writer(card_counts, session_endings):
+        calls.append(card_counts)
+        raise psycopg2.OperationalError("connection lost")
+
+    buffer = FeedbackBuffer(writer=writer, flush_size=1000, flush_interval=60)
+    buffer.add(1)
+    buffer._stop.set()
+    for _ in range(3):
+        buffer.flush()
+    assert len(calls) == 3
+    assert buffer.metrics()["dropped_events"] == 1
+    assert buffer.flush() == 0 and len(calls) == 3
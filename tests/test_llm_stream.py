@@ -0,0 +1,111 @@
+"""
+Streaming card parser: iter_json_array_objects and stream_session_cards(chunks=...)
+fed by a local fake LLM stream instead of the chat completions API.
+"""
+import os
+import sys
+import json
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import llm_operations as llm
+
+CARDS = [
+    {"id": 1, "description": "¿Qué canción te recuerda a {tu} infancia?"},
+    {"id": 2, "description": "Lista [corta] de tus \"tres\" sueños: {a, b}] y }"},
+    {"id": 3, "description": "Una barra \\ y un corchete ] dentro del texto"},
+]
+
+class StreamInterrupted(Exception):
+    pass
+
+def fake_llm_stream(text: str, chunk_size: int = 3, fail_after: int = None):
+    """
+    Yield `text` in chunks of chunk_size characters, as the completion deltas
+    arrive; raise StreamInterrupted once fail_after characters were sent.
+    """
+    for pos in range(0, len(text), chunk_size):
+        if fail_after is not None and pos >= fail_after:
+            raise StreamInterrupted("connection reset by peer")
+        yield text[pos:pos + chunk_size]
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_parses_whole_array_at_any_chunk_size(chunk_size):
+    text = json.dumps(CARDS, ensure_ascii=False)
+    assert list(llm.iter_json_array_objects(fake_llm_stream(text, chunk_size))) == CARDS
+
+def test_braces_brackets_and_escaped_quotes_inside_strings():
+    cards = [{"description": "{\"[}\"]"}, {"description": "\\\"}]{"}, {"description": "fin"}]
+    text = json.dumps(cards)
+    assert list(llm.iter_json_array_objects(fake_llm_stream(text, 1))) == cards
+
+def test_skips_prose_and_code_fence_before_array():
+    text = ("Claro, aquí tienes las tarjetas:\n```json\n"
+            + json.dumps(CARDS, ensure_ascii=False, indent=2) + "\n```\nEspero que te sirvan.")
+    assert list(llm.iter_json_array_objects(fake_llm_stream(text, 5))) == CARDS
+
+def test_stops_at_end_of_first_array():
+    text = json.dumps(CARDS[:1]) + "\n" + json.dumps(CARDS[1:])
+    assert list(llm.iter_json_array_objects(fake_llm_stream(text))) == CARDS[:1]
+
+@pytest.mark.parametrize("cut", [
+    lambda text: text[:-1],  # missing closing bracket
+    lambda text: text[:text.rindex("}")],  # last object unfinished
+    lambda text: text[:text.rindex("\\")],  # cut inside an escape
+])
+def test_truncated_array_keeps_completed_objects(cut):
+    text = json.dumps(CARDS, ensure_ascii=False)
+    parsed = list(llm.iter_json_array_objects(fake_llm_stream(cut(text))))
+    assert parsed == CARDS[:len(parsed)]
+    assert len(parsed) >= 2
+
+def test_malformed_item_is_skipped():
+    text = '[{"id": 1, "description": "a"}, {"id": 2, description: b}, {"id": 3, "description": "c"}]'
+    assert [card["id"] for card in llm.iter_json_array_objects(fake_llm_stream(text))] == [1, 3]
+
+def test_exception_mid_stream_propagates_from_parser():
+    text = json.dumps(CARDS, ensure_ascii=False)
+    parsed = []
+    with pytest.raises(StreamInterrupted):
+        for card in llm.iter_json_array_objects(fake_llm_stream(text, 4, fail_after=text.index("}, ") + 3)):
+            parsed.append(card)
+    assert parsed == CARDS[:1]
+
+def test_stream_session_cards_keeps_cards_before_exception():
+    text = "```json\n" + json.dumps(CARDS, ensure_ascii=False)
+    chunks = fake_llm_stream(text, 4, fail_after=text.rindex("}, ") + 3)
+    assert list(llm.stream_session_cards({}, chunks=chunks)) == CARDS[:2]
+
+def test_stream_session_cards_truncated_stream():
+    text = "Aquí están:\n" + json.dumps(CARDS, ensure_ascii=False)[:-10]
+    assert list(llm.stream_session_cards({}, chunks=fake_llm_stream(text, 6))) == CARDS[:2]
+
+def test_stream_session_cards_with_tracing(monkeypatch):
+    monkeypatch.setattr(llm.tracing, "enabled", lambda: True)
+    text = json.dumps(CARDS, ensure_ascii=False)
+    chunks = fake_llm_stream(text, 2, fail_after=text.rindex("}, ") + 3)
+    assert list(llm.stream_session_cards({}, chunks=chunks)) == CARDS[:2]
+
+def test_stream_session_cards_raises_when_stream_never_starts():
+    with pytest.raises(llm.LLMUnavailable):
+        list(llm.stream_session_cards({}, chunks=fake_llm_stream("[]", fail_after=0)))
+
+def _fake_completions(monkeypatch, failing_parts: set):
+    def stream_llm(system_message, user_message, priority=llm.PRIORITY_INTERACTIVE):
+        part = int(user_message.split("This is set ")[1].split()[0]) - 1
+        if part in failing_parts:
+            raise llm.LLMQueueTimeout("no slot")
+        yield json.dumps([{"description": f"card {part}"}])
+
+    monkeypatch.setattr(llm, "get_prompt", lambda selections, selection_hash=None: ("system", "user"))
+    monkeypatch.setattr(llm, "stream_llm", stream_llm)
+
+def test_fanout_skips_completions_that_fail_before_streaming(monkeypatch):
+    _fake_completions(monkeypatch, failing_parts={0})
+    assert len(list(llm.stream_cards_fanout({}, completions=3))) == 2
+
+def test_fanout_raises_when_every_completion_fails(monkeypatch):
+    _fake_completions(monkeypatch, failing_parts={0, 1})
+    with pytest.raises(llm.LLMUnavailable):
+        list(llm.stream_cards_fanout({}, completions=2))
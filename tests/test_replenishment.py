@@ -0,0 +1,61 @@
+"""
+Near-duplicate replacement in replenishment.generate_and_store_cards.
+"""
+import os
+import sys
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dedup
+import replenishment
+import llm_operations as llm
+import db_operations as db
+
+def _setup(monkeypatch, rounds: list):
+    """
+    Each call to the LLM returns the next list of descriptions in `rounds`.
+    """
+    stored = []
+    ids = itertools.count(1)
+    calls = []
+
+    def fanout(selection, completions, selection_hash=None, priority=None):
+        calls.append(completions)
+        for description in rounds[min(len(calls), len(rounds)) - 1]:
+            yield {"description": description}
+
+    def create_cards(texts, selection_hash, selection_name):
+        stored.extend(texts)
+        return [next(ids) for _ in texts]
+
+    monkeypatch.setattr(dedup, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(dedup, "dedup_index", dedup.DedupIndex())
+    monkeypatch.setattr(db, "get_card_texts", lambda combination_hash, after_id=0: [])
+    monkeypatch.setattr(db, "create_cards", create_cards)
+    monkeypatch.setattr(llm, "stream_cards_fanout", fanout)
+    monkeypatch.setattr(llm, "LLM_CARDS_PER_CALL", 3)
+    return stored, calls
+
+def _generate():
+    return replenishment.generate_and_store_cards({}, "hash", "name")
+
+def test_duplicates_are_replaced(monkeypatch):
+    stored, calls = _setup(monkeypatch, [
+        ["¿Cuál fue tu primer viaje con amigos?"] * 3,
+        ["¿Qué canción te recuerda a tu infancia?", "¿Cuál es tu comida favorita del verano?"],
+    ])
+    assert len(_generate()) == 3
+    assert len(calls) == 2
+    assert len(stored) == 3
+
+def test_extra_rounds_are_capped(monkeypatch):
+    monkeypatch.setattr(replenishment, "DEDUP_EXTRA_ROUNDS", 2)
+    stored, calls = _setup(monkeypatch, [["¿Cuál fue tu primer viaje con amigos?"] * 3])
+    assert len(_generate()) == 1
+    assert len(calls) == 3
+
+def test_short_stream_without_duplicates_is_not_retried(monkeypatch):
+    stored, calls = _setup(monkeypatch, [["¿Cuál fue tu primer viaje con amigos?"]])
+    assert len(_generate()) == 1
+    assert len(calls) == 1
@@ -0,0 +1,82 @@
+"""
+The bucketed draw (sampling.choose_bucket_ranks, mirrored by draw_session_cards)
+against exact weighted sampling without replacement.
+"""
+import os
+import sys
+import math
+import heapq
+import random
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sampling import choose_bucket_ranks, bucket_weight, quality_tier, QUALITY_TIER_BOUNDS
+
+POLICY = 5
+SAMPLE_SIZE = 10
+EXPLORATION = 0.5
+TRIALS = 10_000
+# (times_shown, quality tier): cards
+DECK = {(0, 1): 8, (0, 2): 4, (1, 0): 3, (1, 3): 5, (2, 1): 5, (3, 2): 4, (4, 0): 2, (4, 3): 4}
+
+def exact_sample(counts: dict, sample_size: int, rng: random.Random) -> list:
+    # -LN(1 - RANDOM()) / weight for every card, ORDER BY score ASC LIMIT sample_size
+    scored = ((-math.log(1.0 - rng.random()) / bucket_weight(bucket[0], bucket[1], POLICY, EXPLORATION),
+               bucket, rank)
+              for bucket, count in counts.items()
+              for rank in range(count))
+    return [(bucket, rank) for _, bucket, rank in heapq.nsmallest(sample_size, scored)]
+
+def bucketed_sample(counts: dict, sample_size: int, rng: random.Random) -> list:
+    return choose_bucket_ranks(counts, sample_size, POLICY, rng, EXPLORATION)
+
+def composition(picks: list) -> tuple:
+    return tuple(sorted(Counter(bucket for bucket, _ in picks).items()))
+
+def test_composition_matches_exact_sampling():
+    rng = random.Random(7)
+    expected = Counter(composition(exact_sample(DECK, SAMPLE_SIZE, rng)) for _ in range(TRIALS))
+    observed = Counter(composition(bucketed_sample(DECK, SAMPLE_SIZE, rng)) for _ in range(TRIALS))
+
+    # Two-sample chi-square over compositions seen at least 5 times in total
+    keys = [k for k in set(expected) | set(observed) if expected[k] + observed[k] >= 5]
+    chi2 = sum((observed[k] - expected[k]) ** 2 / (observed[k] + expected[k]) for k in keys)
+    assert chi2 / max(len(keys) - 1, 1) < 1.5
+
+def test_every_rank_in_a_bucket_is_equally_likely():
+    rng = random.Random(11)
+    hits = Counter()
+    for _ in range(TRIALS):
+        hits.update(bucketed_sample(DECK, SAMPLE_SIZE, rng))
+    for bucket, count in DECK.items():
+        bucket_hits = [hits[(bucket, rank)] for rank in range(count)]
+        mean = sum(bucket_hits) / count
+        assert max(abs(h - mean) for h in bucket_hits) / mean < 0.1
+
+def test_heavier_buckets_are_drawn_more_often():
+    rng = random.Random(13)
+    hits = Counter()
+    for _ in range(TRIALS):
+        hits.update(bucket for bucket, _ in bucketed_sample(DECK, SAMPLE_SIZE, rng))
+    rates = sorted((bucket_weight(bucket[0], bucket[1], POLICY, EXPLORATION), hits[bucket] / (count * TRIALS))
+                   for bucket, count in DECK.items())
+    assert all(a[1] <= b[1] for a, b in zip(rates, rates[1:]) if a[0] < b[0])
+
+def test_no_card_is_drawn_twice_and_spent_cards_never():
+    rng = random.Random(17)
+    counts = {**DECK, (POLICY, 3): 50}
+    for _ in range(1_000):
+        picks = bucketed_sample(counts, SAMPLE_SIZE, rng)
+        assert len(picks) == SAMPLE_SIZE == len(set(picks))
+        assert all(bucket[0] < POLICY for bucket, _ in picks)
+
+def test_small_deck_is_drawn_whole():
+    counts = {(0, 1): 2, (3, 0): 1}
+    assert sorted(bucketed_sample(counts, SAMPLE_SIZE, random.Random(1))) == [((0, 1), 0), ((0, 1), 1), ((3, 0), 0)]
+
+def test_every_quality_tier_is_reachable_by_live_cards():
+    # A live card has times_shown < POLICY; card_quality = (likes + 1) / (shown + 3)
+    tiers = {quality_tier((likes + 1) / (shown + 3)) for shown in range(POLICY) for likes in range(shown + 1)}
+    assert tiers == set(range(len(QUALITY_TIER_BOUNDS) + 1))
+    assert quality_tier(1 / 3) == 1
@@ -0,0 +1,45 @@
+"""
+Retry and drop rules of the background session writer.
+"""
+import os
+import sys
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import session_tokens
+from session_tokens import SessionWriter
+
+ROW = (1, {"dynamic": "questions"}, "name", "hash")
+
+def _write_once(writer: SessionWriter):
+    writer._write(writer._drain(writer._queue.get()))
+
+def test_integrity_error_drops_batch():
+    def insert(batch):
+        raise psycopg2.IntegrityError("null value in column")
+
+    writer = SessionWriter(writer=insert)
+    writer._queue.put(ROW)
+    _write_once(writer)
+    assert writer.dropped == 1
+    assert writer._queue.empty()
+
+def test_transient_error_retries_then_drops(monkeypatch):
+    monkeypatch.setattr(session_tokens, "SESSION_WRITE_MAX_RETRIES", 3)
+    monkeypatch.setattr(session_tokens.time, "sleep", lambda seconds: None)
+    calls = []
+
+    def insert(batch):
+        calls.append(batch)
+        raise psycopg2.OperationalError("connection lost")
+
+    writer = SessionWriter(writer=insert)
+    writer._queue.put(ROW)
+    for _ in range(2):
+        _write_once(writer)
+        assert writer._queue.qsize() == 1
+    _write_once(writer)
+    assert len(calls) == 3
+    assert writer.dropped == 1
+    assert writer._queue.empty()
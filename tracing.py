@@ -0,0 +1,206 @@
+"""
+Lightweight request tracing and latency histograms.
+
+Spans follow the OpenTelemetry shape (trace_id, span_id, parent_id, name,
+start, duration, attributes, status) and nest per thread. Finished spans go
+to an in-memory ring buffer (served by the traces endpoint) and, when
+TRACE_FILE is set, are appended to it as JSON lines. Every span name also
+feeds a latency histogram (see get_metrics()).
+
+Tracing is off unless TRACING_ENABLED is set; when off, span() returns a
+shared no-op and traced() adds one flag check per call.
+"""
+import os
+import json
+import time
+import secrets
+import logging
+import threading
+import functools
+from collections import deque
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+TRACE_FILE = os.getenv('TRACE_FILE')  # JSON lines exporter, disabled when unset
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 500))  # finished spans kept in memory
+HISTOGRAM_BOUNDS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_enabled = TRACING_ENABLED
+_local = threading.local()
+
+def enabled() -> bool:
+    return _enabled
+
+def set_enabled(value: bool):
+    global _enabled
+    _enabled = value
+
+class Histogram:
+    def __init__(self, bounds=HISTOGRAM_BOUNDS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th quantile (max for the overflow bucket).
+        """
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return 0.0
+
+    def snapshot(self) -> dict:
+        return {"count": self.count,
+                "sum_ms": round(self.sum, 3),
+                "max_ms": round(self.max, 3),
+                "p50_ms": self.percentile(0.50),
+                "p95_ms": self.percentile(0.95),
+                "p99_ms": self.percentile(0.99),
+                "buckets": dict(zip([str(b) for b in self.bounds] + ["+Inf"], self.counts))}
+
+class MemoryExporter:
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self._spans = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        with self._lock:
+            self._spans.append(span)
+
+    def recent(self, limit: int = None) -> list:
+        with self._lock:
+            spans = list(self._spans)
+        return spans[-limit:] if limit else spans
+
+class JsonlExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a") as f:
+                    f.write(line)
+            except OSError as e:
+                logging.error(f"Error writing span to {self.path}: {e}")
+
+memory_exporter = MemoryExporter()
+_exporters = [memory_exporter] + ([JsonlExporter(TRACE_FILE)] if TRACE_FILE else [])
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def _finish(span: dict):
+    with _histograms_lock:
+        histogram = _histograms.get(span["name"])
+        if histogram is None:
+            histogram = _histograms[span["name"]] = Histogram()
+        histogram.record(span["duration_ms"])
+    for exporter in _exporters:
+        exporter.export(span)
+
+class Span:
+    __slots__ = ("data", "_start")
+
+    def __init__(self, name: str, attributes: dict):
+        parent = _local.stack[-1] if getattr(_local, "stack", None) else None
+        self.data = {
+            "trace_id": parent.data["trace_id"] if parent else secrets.token_hex(16),
+            "span_id": secrets.token_hex(8),
+            "parent_id": parent.data["span_id"] if parent else None,
+            "name": name,
+            "start": time.time(),
+            "duration_ms": 0.0,
+            "attributes": attributes,
+            "status": "ok",
+        }
+
+    def set_attribute(self, key: str, value):
+        self.data["attributes"][key] = value
+
+    def __enter__(self):
+        if not hasattr(_local, "stack"):
+            _local.stack = []
+        _local.stack.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.data["duration_ms"] = round((time.perf_counter() - self._start) * 1000, 3)
+        if exc_type is not None:
+            self.data["status"] = "error"
+            self.data["attributes"]["error"] = exc_type.__name__
+        _local.stack.pop()
+        _finish(self.data)
+        return False
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name: str, **attributes):
+    """
+    Context manager timing a block as a child of the current span.
+
+        with tracing.span("db.acquire") as s:
+            s.set_attribute("pool_in_use", 3)
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+def record(name: str, duration_ms: float, **attributes):
+    """
+    Record an already-measured operation as a finished child of the current
+    span, for work that cannot be wrapped in a with-block (e.g. generators).
+    """
+    if not _enabled:
+        return
+    s = Span(name, attributes)
+    s.data["start"] = time.time() - duration_ms / 1000
+    s.data["duration_ms"] = round(duration_ms, 3)
+    _finish(s.data)
+
+def traced(name: str):
+    """
+    Decorator running the function inside span `name`.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_metrics() -> dict:
+    with _histograms_lock:
+        return {name: histogram.snapshot() for name, histogram in sorted(_histograms.items())}
+
+def recent_spans(limit: int = None) -> list:
+    return memory_exporter.recent(limit)
@@ -1,5 +1,64 @@
+import os
 import hashlib
+import threading
 
 def generate_hash_str(input_str: str) -> str:
     """Generate a SHA-256 hash of the input string."""
-    return hashlib.sha256(input_str.encode()).hexdigest()
\ No newline at end of file
+    return hashlib.sha256(input_str.encode()).hexdigest()
+
+def load_env(path: str = ".env"):
+    """
+    Load settings from a .env file, when there is one, over the process environment.
+
+    Modules read their settings at import time, so entry points (function_app,
+    migrate.py, scripts) call this before importing them.
+    """
+    if os.path.exists(path):
+        from dotenv import load_dotenv
+        load_dotenv(path, override=True)
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive the same result (or exception).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._metrics = {"executions": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                self._metrics["executions"] += 1
+            else:
+                self._metrics["coalesced"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["in_flight"] = len(self._calls)
+        return snapshot